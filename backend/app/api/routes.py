@@ -1,48 +1,166 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.core.database import get_db
+import asyncio
+import json
+import time
+from typing import Literal, Optional, Tuple, Union
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from app.core.database import get_db, SessionLocal
+from app.core.metrics import track_phase
 from app.models.models import (
     Passage, Question, Option, ReflectionStep, 
-    ReflectionChoice, User, UserAnswer, ReflectionResponse
+    User, UserAnswer, ReflectionResponse, UserErrorProfile,
+    QuestionRollup, CohortRollup
 )
 from app.api.schemas import (
-    QuestionOut, OptionOut, AnswerSubmit, AnswerResult,
+    QuestionOut, QuestionSlimOut, PassageOut, OptionOut, AnswerSubmit, AnswerResult,
+    AnswerBatchSubmit, AnswerBatchResult,
     ReflectionStepsOut, ReflectionStepOut, ReflectionChoiceOut,
-    ReflectionSubmit, DiagnosisOut
+    ReflectionSubmit, DiagnosisOut, UserErrorProfileOut,
+    QuestionRollupOut, QuestionRollupPage, CohortRollupOut, CohortRollupPage,
+    RecommendedQuestionOut, NextQuestionsOut
 )
 
-from app.services.rule_engine import ErrorDiagnoser
-from app.services.gemini_service import generate_diagnosis_explanation
+from app.services.rule_engine import load_choice_snapshot, load_correct_choices
+from app.services.gemini_service import (
+    generate_diagnosis_explanation_async, stream_diagnosis_explanation, get_llm_status
+)
+from app.services.explanation_cache import explanation_cache
+from app.services.precomputed_explanations import precomputed_stats
+from app.services.reflection_service import PreparedReflection, diagnose_reflection
+from app.services.cache import (
+    HTTP_CACHE_MAX_AGE, CachedPayload, question_cache, passage_cache,
+    reflection_steps_cache, content_cache_stats
+)
+from app.services.answer_key import AnswerKeyEntry, answer_key_index
+from app.services.history_export import MEDIA_TYPES, format_batches, history_query, iter_history_batches
+from app.services.error_profile import record_reflection, remove_reflection
+from app.services.dashboard_rollups import (
+    ALL_COHORTS, remove_reflection_from_rollups, rollups_refreshed_through, top_count
+)
+from app.services.recommender import (
+    LEVELS, RECENT_EXCLUDE, profile_weights, question_feature_index, rank
+)
 
 router = APIRouter(prefix="/api", tags=["api"])
 
 
-@router.get("/questions/{question_id}", response_model=QuestionOut)
-def get_question(question_id: int, db: Session = Depends(get_db)):
+@router.get("/questions/{question_id}", response_model=Union[QuestionOut, QuestionSlimOut])
+def get_question(question_id: int, request: Request, slim: bool = False, db: Session = Depends(get_db)):
     '''
     Docstring for get_question
     
     :param question_id: Description
     :type question_id: int
+    :param slim: 为 true 时不返回文章内容，只返回 passage_id（文章通过 /api/passages/{id} 获取一次）
+    :type slim: bool
     :param db: Description
     :type db: Session
     '''
     
+    payloads = question_cache.get(question_id)
+    if payloads is None:
+        payloads = _load_question(question_id, db)
+        question_cache.set(question_id, payloads)
+    full, slim_payload = payloads
+    return _cached_response(request, slim_payload if slim else full, CONTENT_CACHE_CONTROL)
+
+
+def _load_question(question_id: int, db: Session) -> Tuple[CachedPayload, CachedPayload]:
+    """从数据库构建题目 payload：(完整版, slim 版)，序列化和 ETag 在这里计算一次"""
     question = db.query(Question).filter(Question.id == question_id).first()
     if not question:
         raise HTTPException(status_code=404, detail="题目不存在")
     
     passage = db.query(Passage).filter(Passage.id == question.passage_id).first()
-    options = db.query(Option).filter(Option.question_id == question_id).all()
+    options = db.query(Option).filter(Option.question_id == question_id).order_by(Option.option_label).all()
     
-    return QuestionOut(
+    question_out = QuestionOut(
         id=question.id,
+        passage_id=question.passage_id,
         question_type=question.question_type,
         stem=question.stem,
         passage_title=passage.title,
         passage_content=passage.content,
         options=[OptionOut.model_validate(opt) for opt in options]
     )
+    slim_out = QuestionSlimOut(
+        id=question_out.id,
+        passage_id=question_out.passage_id,
+        question_type=question_out.question_type,
+        stem=question_out.stem,
+        options=question_out.options
+    )
+    return CachedPayload.from_model(question_out), CachedPayload.from_model(slim_out)
+
+
+@router.get("/passages/{passage_id}", response_model=PassageOut)
+def get_passage(passage_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    获取文章及其全部题目和选项，文章内容只返回一次
+
+    通过 selectinload 沿 Passage.questions → Question.options 加载，
+    共 3 条查询（文章 / 题目 / 选项），与题目数量无关；结果缓存在 passage_cache 中。
+    """
+    
+    payload = passage_cache.get(passage_id)
+    if payload is None:
+        passage = (
+            db.query(Passage)
+            .options(selectinload(Passage.questions).selectinload(Question.options))
+            .filter(Passage.id == passage_id)
+            .first()
+        )
+        if not passage:
+            raise HTTPException(status_code=404, detail="文章不存在")
+        payload = CachedPayload.from_model(PassageOut.model_validate(passage))
+        passage_cache.set(passage_id, payload)
+    return _cached_response(request, payload, CONTENT_CACHE_CONTROL)
+
+
+# 题库内容对所有用户相同，浏览器和反向代理都可以缓存；复盘步骤的 URL 属于单个用户的答题记录
+CONTENT_CACHE_CONTROL = f"public, max-age={HTTP_CACHE_MAX_AGE}"
+REFLECTION_CACHE_CONTROL = f"private, max-age={HTTP_CACHE_MAX_AGE}"
+
+
+def _cached_response(request: Request, payload: CachedPayload, cache_control: str) -> Response:
+    """
+    返回缓存的响应体；If-None-Match 与 ETag 匹配时返回 304（不带响应体）
+    """
+    headers = {"ETag": payload.etag, "Cache-Control": cache_control}
+    if _etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload.body, media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较：反向代理压缩后可能把 ETag 改成 W/"..." """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """内容缓存、LLM 解释缓存和预生成解释矩阵的命中/未命中统计"""
+    return {
+        **content_cache_stats(),
+        "llm_explanation_cache": explanation_cache.stats(),
+        "precomputed_explanations": precomputed_stats(),
+    }
+
+
+@router.get("/llm/status")
+def get_llm_service_status():
+    """Gemini 服务状态：熔断器、限流、并发和 in-flight 合并统计"""
+    return get_llm_status()
 
 
 @router.post("/answers", response_model=AnswerResult)
@@ -56,27 +174,17 @@ def submit_answer(answer: AnswerSubmit, db: Session = Depends(get_db)):
     return: Description
     """
     
-    user = db.query(User).filter(User.id == answer.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="用户不存在")
-    
-    question = db.query(Question).filter(Question.id == answer.question_id).first()
-    if not question:
+    # 判分只查内存中的答案索引
+    key = answer_key_index.get(answer.question_id, db)
+    if key is None:
         raise HTTPException(status_code=404, detail="题目不存在")
-    
-    correct_option = db.query(Option).filter(
-        Option.question_id == answer.question_id,
-        Option.is_correct == True
-    ).first()
-    
-    selected_option = db.query(Option).filter(Option.id == answer.selected_option_id).first()
-    if not selected_option:
+    if answer.selected_option_id not in key.option_ids:
         raise HTTPException(status_code=404, detail="选项不存在")
     
-    is_correct = (answer.selected_option_id == correct_option.id)
+    is_correct = (answer.selected_option_id == key.correct_option_id)
     needs_reflection = not is_correct
     
-    # 保存答题记录
+    # 保存答题记录（唯一的数据库操作；用户不存在时由外键约束拒绝）
     user_answer = UserAnswer(
         user_id=answer.user_id,
         question_id=answer.question_id,
@@ -85,73 +193,149 @@ def submit_answer(answer: AnswerSubmit, db: Session = Depends(get_db)):
         needs_reflection=needs_reflection
     )
     db.add(user_answer)
-    db.commit()
-    db.refresh(user_answer)
+    try:
+        db.flush()
+        user_answer_id = user_answer.id
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
+    return _answer_result(user_answer_id, is_correct, key)
+
+
+@router.post("/answers/batch", response_model=AnswerBatchResult)
+def submit_answer_batch(batch: AnswerBatchSubmit, db: Session = Depends(get_db)):
+    """
+    批量提交一篇文章 / 一个 section 的全部答案
+
+    全部答案先用内存答案索引判分，任何一题或选项不存在时整批拒绝；
+    然后用一条 INSERT ... RETURNING（executemany）写入全部 UserAnswer 并提交一次，
+    整批在同一事务中，要么全部保存要么全部不保存。
+    """
+    
+    question_ids = [item.question_id for item in batch.answers]
+    if len(set(question_ids)) != len(question_ids):
+        raise HTTPException(status_code=400, detail="同一批次中题目重复")
+    
+    rows = []
+    keys = []
+    for item in batch.answers:
+        key = answer_key_index.get(item.question_id, db)
+        if key is None:
+            raise HTTPException(status_code=404, detail=f"题目不存在: {item.question_id}")
+        if item.selected_option_id not in key.option_ids:
+            raise HTTPException(status_code=404, detail=f"选项不存在: {item.selected_option_id}")
+        is_correct = (item.selected_option_id == key.correct_option_id)
+        rows.append({
+            "user_id": batch.user_id,
+            "question_id": item.question_id,
+            "selected_option_id": item.selected_option_id,
+            "is_correct": is_correct,
+            "needs_reflection": not is_correct,
+        })
+        keys.append(key)
+    
+    # sort_by_parameter_order 保证返回的 id 与 rows 顺序一致
+    statement = insert(UserAnswer).returning(UserAnswer.id, sort_by_parameter_order=True)
+    try:
+        user_answer_ids = db.execute(statement, rows).scalars().all()
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="用户不存在")
     
-    # 返回结果
+    results = [
+        _answer_result(user_answer_id, row["is_correct"], key)
+        for user_answer_id, row, key in zip(user_answer_ids, rows, keys)
+    ]
+    return AnswerBatchResult(
+        results=results,
+        correct_count=sum(result.is_correct for result in results),
+        total=len(results),
+        needs_reflection=[result.user_answer_id for result in results if result.needs_reflection]
+    )
+
+
+def _answer_result(user_answer_id: int, is_correct: bool, key: AnswerKeyEntry) -> AnswerResult:
+    """构造单题判分结果"""
     if is_correct:
         message = "回答正确！"
     else:
-        message = f"回答错误。正确答案是 {correct_option.option_label}。请进入复盘流程。"
+        message = f"回答错误。正确答案是 {key.correct_option_label}。请进入复盘流程。"
     
     return AnswerResult(
-        user_answer_id=user_answer.id,
+        user_answer_id=user_answer_id,
         is_correct=is_correct,
-        correct_option_label=correct_option.option_label,
-        needs_reflection=needs_reflection,
+        correct_option_label=key.correct_option_label,
+        needs_reflection=not is_correct,
         message=message
     )
 
 
 @router.get("/reflections/{user_answer_id}", response_model=ReflectionStepsOut)
-def get_reflection_steps(user_answer_id: int, db: Session = Depends(get_db)):
-    """获取复盘步骤和选项"""
+def get_reflection_steps(user_answer_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    获取复盘步骤和选项
+
+    复盘内容只取决于题目和所选选项，按 (question_id, selected_option_id) 缓存已序列化的
+    payload 和 ETag。命中时只查询一次答题记录；未命中时通过 eager loading 加载题目、选项、
+    复盘步骤及其 choices，查询次数固定：题目 / 题目选项 / 复盘步骤 / 复盘 choices
+    """
     
-    # 获取答题记录
-    user_answer = db.query(UserAnswer).filter(UserAnswer.id == user_answer_id).first()
+    user_answer = (
+        db.query(UserAnswer.question_id, UserAnswer.selected_option_id, UserAnswer.needs_reflection)
+        .filter(UserAnswer.id == user_answer_id)
+        .first()
+    )
     if not user_answer:
         raise HTTPException(status_code=404, detail="答题记录不存在")
     
     if not user_answer.needs_reflection:
         raise HTTPException(status_code=400, detail="该题回答正确，无需复盘")
     
-    # 获取题目信息
-    question = db.query(Question).filter(Question.id == user_answer.question_id).first()
-    
-    # 获取用户选择的选项和正确选项
-    selected_option = db.query(Option).filter(Option.id == user_answer.selected_option_id).first()
-    correct_option = db.query(Option).filter(
-        Option.question_id == question.id,
-        Option.is_correct == True
-    ).first()
-    
-    # 获取复盘步骤
-    steps = db.query(ReflectionStep).filter(
-        ReflectionStep.question_id == question.id
-    ).order_by(ReflectionStep.step_number).all()
+    cache_key = (user_answer.question_id, user_answer.selected_option_id)
+    payload = reflection_steps_cache.get(cache_key)
+    if payload is None:
+        payload = _load_reflection_steps(user_answer.question_id, user_answer.selected_option_id, db)
+        reflection_steps_cache.set(cache_key, payload)
+    return _cached_response(request, payload, REFLECTION_CACHE_CONTROL)
+
+
+def _load_reflection_steps(question_id: int, selected_option_id: int, db: Session) -> CachedPayload:
+    """从数据库构建复盘步骤 payload（同时加载题目、选项、复盘步骤和 choices）"""
+    question = (
+        db.query(Question)
+        .options(
+            selectinload(Question.options),
+            selectinload(Question.reflection_steps).selectinload(ReflectionStep.choices),
+        )
+        .filter(Question.id == question_id)
+        .first()
+    )
+    selected_option = next((opt for opt in question.options if opt.id == selected_option_id), None)
+    correct_option = next((opt for opt in question.options if opt.is_correct), None)
     
-    steps_out = []
-    for step in steps:
-        choices = db.query(ReflectionChoice).filter(
-            ReflectionChoice.reflection_step_id == step.id
-        ).order_by(ReflectionChoice.choice_order).all()
-        
-        steps_out.append(ReflectionStepOut(
+    # 复盘步骤按 step_number 排序，choices 按 choice_order 排序（见 models 中的 relationship）
+    steps_out = [
+        ReflectionStepOut(
             id=step.id,
             step_number=step.step_number,
             step_type=step.step_type,
             prompt_text=step.prompt_text,
             allow_custom_input=step.allow_custom_input,
-            choices=[ReflectionChoiceOut.model_validate(c) for c in choices]
-        ))
+            choices=[ReflectionChoiceOut.model_validate(c) for c in step.choices]
+        )
+        for step in question.reflection_steps
+    ]
     
-    return ReflectionStepsOut(
+    return CachedPayload.from_model(ReflectionStepsOut(
         question_id=question.id,
         question_stem=question.stem,
         user_selected_option=f"{selected_option.option_label}: {selected_option.option_text}",
         correct_option=f"{correct_option.option_label}: {correct_option.option_text}",
         steps=steps_out
-    )
+    ))
 
 
 @router.get("/diagnosis/{user_answer_id}", response_model=DiagnosisOut)
@@ -163,23 +347,21 @@ def get_diagnosis(user_answer_id: int, db: Session = Depends(get_db)):
     if not response:
         raise HTTPException(status_code=404, detail="诊断结果不存在")
 
-    # Reconstruct step comparison text from stored choice IDs
+    # Reconstruct step comparison text from stored choice IDs (2 IN queries)
+    choices = load_choice_snapshot(db, [
+        response.step1_choice_id, response.step2_choice_id, response.step3_choice_id
+    ])
+    correct_choices = load_correct_choices(db, [c.reflection_step_id for c in choices.values()])
+
     def choice_text(choice_id):
-        if not choice_id:
-            return ""
-        c = db.query(ReflectionChoice).filter(ReflectionChoice.id == choice_id).first()
+        c = choices.get(choice_id) if choice_id else None
         return c.choice_text if c else ""
 
     def correct_choice_text(choice_id):
-        if not choice_id:
-            return ""
-        c = db.query(ReflectionChoice).filter(ReflectionChoice.id == choice_id).first()
+        c = choices.get(choice_id) if choice_id else None
         if not c:
             return ""
-        correct = db.query(ReflectionChoice).filter(
-            ReflectionChoice.reflection_step_id == c.reflection_step_id,
-            ReflectionChoice.is_correct == True
-        ).first()
+        correct = correct_choices.get(c.reflection_step_id)
         return correct.choice_text if correct else ""
 
     return DiagnosisOut(
@@ -197,13 +379,14 @@ def get_diagnosis(user_answer_id: int, db: Session = Depends(get_db)):
         rule_error_type=response.rule_error_type or "",
         llm_explanation=response.llm_explanation or "",
         llm_suggestion=response.llm_suggestion or "",
+        llm_status=response.llm_status or "ready",
     )
 
 
-# 提交复盘回答
-@router.post("/reflections", response_model=DiagnosisOut)
-def submit_reflection(reflection: ReflectionSubmit, db: Session = Depends(get_db)):
-    """提交复盘回答，返回诊断结果"""
+def _prepare_reflection(reflection: ReflectionSubmit, db: Session) -> PreparedReflection:
+    """
+    验证答题记录、加载题目上下文并执行规则引擎诊断（同步，包含全部数据库读取）
+    """
     
     # 验证答题记录存在
     user_answer = db.query(UserAnswer).filter(UserAnswer.id == reflection.user_answer_id).first()
@@ -215,122 +398,46 @@ def submit_reflection(reflection: ReflectionSubmit, db: Session = Depends(get_db
         ReflectionResponse.user_answer_id == reflection.user_answer_id
     ).first()
     if existing:
+        # 删除旧复盘与扣减错误画像、Dashboard 汇总在同一事务中提交
+        remove_reflection(db, user_answer.user_id, existing)
+        remove_reflection_from_rollups(db, existing)
         db.delete(existing)
         db.commit()
         print(f"⚠️ 覆盖已有的复盘记录 (user_answer_id={reflection.user_answer_id})")
     
-    # 判断各步骤的正误
-    step1_choice = db.query(ReflectionChoice).filter(ReflectionChoice.id == reflection.step1_choice_id).first()
-    step2_choice = db.query(ReflectionChoice).filter(ReflectionChoice.id == reflection.step2_choice_id).first()
-    step3_choice = db.query(ReflectionChoice).filter(ReflectionChoice.id == reflection.step3_choice_id).first()
-    
-    step1_is_correct = step1_choice.is_correct if step1_choice else False
-    step2_is_correct = step2_choice.is_correct if step2_choice else False
-    
-    # Step 3 理解质量判断
-    if step3_choice and step3_choice.is_correct:
-        step3_quality = "correct"
-    elif step3_choice and step3_choice.choice_order == 4:  # "以上都不对"
-        step3_quality = "unknown"
-    else:
-        step3_quality = "wrong"
-        
-    # 获取题目完整上下文（用于规则引擎和 LLM）
-    question = db.query(Question).filter(Question.id == user_answer.question_id).first()
-    passage = db.query(Passage).filter(Passage.id == question.passage_id).first()
-    selected_option = db.query(Option).filter(Option.id == user_answer.selected_option_id).first()
-    correct_option = db.query(Option).filter(
-        Option.question_id == question.id,
-        Option.is_correct == True
-    ).first()
-    
-    question_data = {
-        "stem": question.stem,
-        "passage_content": passage.content,
-        "correct_answer": f"{correct_option.option_label}: {correct_option.option_text}",
-        "user_answer": f"{selected_option.option_label}: {selected_option.option_text}"
-    }
-    
-    # 规则引擎诊断
-    diagnoser = ErrorDiagnoser(
-        db=db,
-        step1_is_correct=step1_is_correct,
-        step1_choice_id=reflection.step1_choice_id,
-        step2_is_correct=step2_is_correct,
-        step2_choice_id=reflection.step2_choice_id,
-        step3_quality=step3_quality,
-        step3_choice_id=reflection.step3_choice_id,
-        step3_custom_input=reflection.step3_custom_input,
-        step4a_choice_id=reflection.step4a_choice_id,
-        step4b_choice_id=reflection.step4b_choice_id,
-        step5_choice_id=reflection.step5_choice_id,
-        question_data=question_data
-    )
-    
-    # 执行诊断
-    diagnosis_result = diagnoser.diagnose()
-    rule_error_level = diagnosis_result.error_level
-    rule_error_type = diagnosis_result.error_type
-        
-    # LLM 生成个性化解释和建议    
-    llm_context = diagnoser.get_context_for_llm()
-    llm_explanation, llm_suggestion = generate_diagnosis_explanation(
-        error_level=rule_error_level,
-        error_type=rule_error_type,
-        rule_details=diagnosis_result.details,
-        question_data=question_data,
-        user_responses=llm_context
-    )
+    prepared = diagnose_reflection(reflection, user_answer, db)
+    # 结束只读事务，把连接还给连接池：等待 LLM 期间不占用数据库连接
+    db.commit()
+    return prepared
 
-    # 获取每个步骤的学生选择和正确答案（用于前端对比展示）
-    # Step 1: 定位词识别
-    step1_student_choice_obj = db.query(ReflectionChoice).filter(
-        ReflectionChoice.id == reflection.step1_choice_id
-    ).first()
-    step1_correct_choice = db.query(ReflectionChoice).filter(
-        ReflectionChoice.reflection_step_id == step1_student_choice_obj.reflection_step_id,
-        ReflectionChoice.is_correct == True
-    ).first()
-    
-    step1_student_choice = step1_student_choice_obj.choice_text if step1_student_choice_obj else ""
-    step1_correct_answer = step1_correct_choice.choice_text if step1_correct_choice else "未找到正确答案"
-    
-    # Step 2: 答案句定位
-    step2_student_choice_obj = db.query(ReflectionChoice).filter(
-        ReflectionChoice.id == reflection.step2_choice_id
-    ).first()
-    step2_correct_choice = db.query(ReflectionChoice).filter(
-        ReflectionChoice.reflection_step_id == step2_student_choice_obj.reflection_step_id,
-        ReflectionChoice.is_correct == True
-    ).first()
-    
-    step2_student_choice = step2_student_choice_obj.choice_text if step2_student_choice_obj else ""
-    step2_correct_answer = step2_correct_choice.choice_text if step2_correct_choice else "未找到正确答案"
-    
-    # Step 3: 答案句理解
-    step3_student_choice_obj = db.query(ReflectionChoice).filter(
-        ReflectionChoice.id == reflection.step3_choice_id
-    ).first()
-    step3_correct_choice = db.query(ReflectionChoice).filter(
-        ReflectionChoice.reflection_step_id == step3_student_choice_obj.reflection_step_id,
-        ReflectionChoice.is_correct == True
-    ).first()
+
+def _save_reflection(
+    reflection: ReflectionSubmit,
+    prepared: PreparedReflection,
+    llm_explanation: str,
+    llm_suggestion: str,
+    llm_status: str,
+    db: Session
+) -> DiagnosisOut:
+    """
+    保存复盘记录并构建诊断结果（同步）
     
-    step3_student_understanding = step3_student_choice_obj.choice_text if step3_student_choice_obj else ""
-    step3_correct_understanding = step3_correct_choice.choice_text if step3_correct_choice else "未找到正确答案"
+    llm_status 为 "pending" 时，LLM 解释由后台任务稍后补全
+    """
     
-
+    rule_error_level = prepared.diagnosis_result.error_level
+    rule_error_type = prepared.diagnosis_result.error_type
     
     # 保存复盘记录
     response = ReflectionResponse(
         user_answer_id=reflection.user_answer_id,
         step1_choice_id=reflection.step1_choice_id,
-        step1_is_correct=step1_is_correct,
+        step1_is_correct=prepared.step1_is_correct,
         step2_choice_id=reflection.step2_choice_id,
-        step2_is_correct=step2_is_correct,
+        step2_is_correct=prepared.step2_is_correct,
         step3_choice_id=reflection.step3_choice_id,
         step3_custom_input=reflection.step3_custom_input,
-        step3_quality=step3_quality,
+        step3_quality=prepared.step3_quality,
         step4a_choice_id=reflection.step4a_choice_id,
         step4a_custom_input=reflection.step4a_custom_input,
         step4b_choice_id=reflection.step4b_choice_id,
@@ -341,37 +448,545 @@ def submit_reflection(reflection: ReflectionSubmit, db: Session = Depends(get_db
         rule_error_level=rule_error_level,
         rule_error_type=rule_error_type,
         llm_explanation=llm_explanation,
-        llm_suggestion=llm_suggestion
+        llm_suggestion=llm_suggestion,
+        llm_status=llm_status,
+        llm_prompt_version=(
+            prepared.prompt_version_for(llm_explanation, llm_suggestion) if llm_status == "ready" else None
+        )
     )
     db.add(response)
+    # 错误画像与复盘记录在同一事务中更新
+    if prepared.user_id is not None:
+        record_reflection(
+            db, prepared.user_id, reflection.user_answer_id,
+            prepared.question_data["question_id"], rule_error_level, rule_error_type
+        )
     db.commit()
-
-    correct_option = db.query(Option).filter(
-        Option.question_id == question.id,
-        Option.is_correct == True
-    ).first()
     
     return DiagnosisOut(
         user_answer_id=reflection.user_answer_id,
         
         # Step 1 对比
-        step1_is_correct=step1_is_correct,
-        step1_student_choice=step1_student_choice,
-        step1_correct_answer=step1_correct_answer,
+        step1_is_correct=prepared.step1_is_correct,
+        step1_student_choice=prepared.step1_student_choice,
+        step1_correct_answer=prepared.step1_correct_answer,
         
         # Step 2 对比
-        step2_is_correct=step2_is_correct,
-        step2_student_choice=step2_student_choice,
-        step2_correct_answer=step2_correct_answer,
+        step2_is_correct=prepared.step2_is_correct,
+        step2_student_choice=prepared.step2_student_choice,
+        step2_correct_answer=prepared.step2_correct_answer,
         
         # Step 3 对比
-        step3_quality=step3_quality,
-        step3_student_understanding=step3_student_understanding,
-        step3_correct_understanding=step3_correct_understanding,
+        step3_quality=prepared.step3_quality,
+        step3_student_understanding=prepared.step3_student_understanding,
+        step3_correct_understanding=prepared.step3_correct_understanding,
         
         # 诊断结果
         rule_error_level=rule_error_level,
         rule_error_type=rule_error_type,
         llm_explanation=llm_explanation,
-        llm_suggestion=llm_suggestion
+        llm_suggestion=llm_suggestion,
+        llm_status=llm_status
+    )
+
+
+# LLM 解释尚未生成的复盘记录：pending，或（升级前保存的）ready 但没有解释文本
+_NEEDS_LLM_EXPLANATION = or_(
+    ReflectionResponse.llm_status == "pending",
+    and_(
+        ReflectionResponse.llm_status == "ready",
+        or_(ReflectionResponse.llm_explanation.is_(None), ReflectionResponse.llm_explanation == "")
+    )
+)
+
+
+def _claim_llm_explanation(user_answer_id: int) -> bool:
+    """
+    认领生成 LLM 解释的任务（同步，使用独立 session）
+
+    条件 UPDATE 把记录改为 "generating"，只有一个写入方（后台任务或 SSE 流，可能在不同进程）
+    能认领成功；认领失败说明其他写入方正在生成或已经写回。
+    """
+    db = SessionLocal()
+    try:
+        claimed = db.query(ReflectionResponse).filter(
+            ReflectionResponse.user_answer_id == user_answer_id,
+            _NEEDS_LLM_EXPLANATION
+        ).update({ReflectionResponse.llm_status: "generating"}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+    finally:
+        db.close()
+
+
+def _store_llm_explanation(
+    user_answer_id: int,
+    prepared: PreparedReflection,
+    llm_explanation: str,
+    llm_suggestion: str
+) -> bool:
+    """
+    将认领后生成的 LLM 解释写回复盘记录（同步，使用独立 session）
+
+    只更新仍处于 generating 状态的记录；返回是否写入成功（记录期间被覆盖或重新生成时为 False）。
+    """
+    db = SessionLocal()
+    try:
+        stored = db.query(ReflectionResponse).filter(
+            ReflectionResponse.user_answer_id == user_answer_id,
+            ReflectionResponse.llm_status == "generating"
+        ).update({
+            ReflectionResponse.llm_explanation: llm_explanation,
+            ReflectionResponse.llm_suggestion: llm_suggestion,
+            ReflectionResponse.llm_status: "ready",
+            ReflectionResponse.llm_prompt_version: prepared.prompt_version_for(llm_explanation, llm_suggestion),
+        }, synchronize_session=False)
+        db.commit()
+        return stored == 1
+    finally:
+        db.close()
+
+
+def _release_llm_explanation(user_answer_id: int) -> None:
+    """认领后没有写回（客户端断开 / 生成出错）：把记录还原为 pending，允许重新生成（同步）"""
+    db = SessionLocal()
+    try:
+        db.query(ReflectionResponse).filter(
+            ReflectionResponse.user_answer_id == user_answer_id,
+            ReflectionResponse.llm_status == "generating"
+        ).update({ReflectionResponse.llm_status: "pending"}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _read_llm_explanation(user_answer_id: int) -> Tuple[str, str, str]:
+    """读取已保存的 (explanation, suggestion, llm_status)（同步，使用独立 session）"""
+    db = SessionLocal()
+    try:
+        row = db.query(
+            ReflectionResponse.llm_explanation, ReflectionResponse.llm_suggestion, ReflectionResponse.llm_status
+        ).filter(ReflectionResponse.user_answer_id == user_answer_id).first()
+        if row is None:
+            return "", "", "missing"
+        return row.llm_explanation or "", row.llm_suggestion or "", row.llm_status or "ready"
+    finally:
+        db.close()
+
+
+async def _complete_llm_explanation(user_answer_id: int, prepared: PreparedReflection) -> None:
+    """
+    后台任务：认领记录后生成 LLM 解释和建议，并写回复盘记录
+
+    SSE 流已经认领时直接返回，不重复调用 Gemini。
+    """
+    if not await run_in_threadpool(_claim_llm_explanation, user_answer_id):
+        return
+    try:
+        llm_explanation, llm_suggestion = await generate_diagnosis_explanation_async(
+            error_level=prepared.diagnosis_result.error_level,
+            error_type=prepared.diagnosis_result.error_type,
+            rule_details=prepared.diagnosis_result.details,
+            question_data=prepared.question_data,
+            user_responses=prepared.llm_context,
+            cache_key=prepared.cache_key
+        )
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(_release_llm_explanation, user_answer_id)
+        raise
+    await run_in_threadpool(_store_llm_explanation, user_answer_id, prepared, llm_explanation, llm_suggestion)
+
+
+# 提交复盘回答
+@router.post("/reflections", response_model=DiagnosisOut)
+async def submit_reflection(
+    reflection: ReflectionSubmit,
+    background_tasks: BackgroundTasks,
+    defer_llm: bool = False,
+    stream: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    提交复盘回答，返回诊断结果
+    
+    数据库读写和规则引擎在线程池中执行；LLM 调用走 Gemini 异步客户端，
+    等待 LLM 响应期间不占用线程池线程。
+    
+    defer_llm=true 时立即返回规则引擎诊断（llm_status="pending"），
+    LLM 解释由后台任务生成，前端通过 GET /api/diagnosis/{user_answer_id} 轮询。
+    stream=true 同样立即返回 pending，但不调度后台任务：解释由随后打开的
+    GET /api/diagnosis/{user_answer_id}/stream 生成（客户端没有打开流时，
+    记录保持 pending，由 regenerate_explanations.py --pending 补全）。
+    命中预生成解释矩阵时始终直接返回 llm_status="ready"。
+    """
+    
+    prepared = await run_in_threadpool(_prepare_reflection, reflection, db)
+    
+    # 预生成解释矩阵命中（没有自由输入的常见路径）：直接保存，无需调用 LLM
+    if prepared.precomputed:
+        llm_explanation, llm_suggestion = prepared.precomputed
+        return await run_in_threadpool(
+            _save_reflection, reflection, prepared, llm_explanation, llm_suggestion, "ready", db
+        )
+    
+    if defer_llm or stream:
+        result = await run_in_threadpool(
+            _save_reflection, reflection, prepared, "", "", "pending", db
+        )
+        if not stream:
+            background_tasks.add_task(_complete_llm_explanation, reflection.user_answer_id, prepared)
+        return result
+    
+    # LLM 生成个性化解释和建议
+    with track_phase("llm"):
+        llm_explanation, llm_suggestion = await generate_diagnosis_explanation_async(
+            error_level=prepared.diagnosis_result.error_level,
+            error_type=prepared.diagnosis_result.error_type,
+            rule_details=prepared.diagnosis_result.details,
+            question_data=prepared.question_data,
+            user_responses=prepared.llm_context,
+            cache_key=prepared.cache_key
+        )
+    
+    return await run_in_threadpool(
+        _save_reflection, reflection, prepared, llm_explanation, llm_suggestion, "ready", db
+    )
+
+
+def _format_sse(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _replay_events(llm_explanation: str, llm_suggestion: str, llm_status: str = "ready") -> list:
+    """整段发送已保存（或已生成）的文本"""
+    return [
+        _format_sse("explanation", {"delta": llm_explanation}),
+        _format_sse("suggestion", {"delta": llm_suggestion}),
+        _format_sse("done", {
+            "llm_explanation": llm_explanation, "llm_suggestion": llm_suggestion, "llm_status": llm_status
+        }),
+    ]
+
+
+# SSE 流等待其他写入方写回解释的最长时间和轮询间隔（秒）
+STREAM_WAIT_SECONDS = 30.0
+STREAM_POLL_SECONDS = 0.2
+
+
+async def _wait_for_llm_explanation(user_answer_id: int) -> Tuple[str, str, str]:
+    """等待其他写入方生成结束（状态不再是 generating）或超时，返回已保存的文本和状态"""
+    deadline = time.monotonic() + STREAM_WAIT_SECONDS
+    while True:
+        explanation, suggestion, status = await run_in_threadpool(_read_llm_explanation, user_answer_id)
+        if status != "generating" or time.monotonic() >= deadline:
+            return explanation, suggestion, status
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+
+
+def _load_stream_context(user_answer_id: int, db: Session):
+    """
+    读取已保存的复盘记录；LLM 解释尚未就绪时重建规则诊断上下文（同步）
+    
+    返回 (rule 事件数据, 已保存的 (explanation, suggestion), PreparedReflection 或 None)，
+    返回前结束只读事务，流式生成期间不占用数据库连接。
+    """
+    response = db.query(ReflectionResponse).filter(
+        ReflectionResponse.user_answer_id == user_answer_id
+    ).first()
+    if not response:
+        raise HTTPException(status_code=404, detail="诊断结果不存在")
+    
+    rule_event = {
+        "user_answer_id": user_answer_id,
+        "rule_error_level": response.rule_error_level or "",
+        "rule_error_type": response.rule_error_type or "",
+        "llm_status": response.llm_status or "ready",
+    }
+    saved = (response.llm_explanation or "", response.llm_suggestion or "")
+    
+    prepared = None
+    if response.llm_status != "ready" or not response.llm_explanation:
+        prepared = diagnose_reflection(response, response.user_answer, db)
+    db.commit()
+    return rule_event, saved, prepared
+
+
+@router.get("/diagnosis/{user_answer_id}/stream")
+async def stream_diagnosis(user_answer_id: int, db: Session = Depends(get_db)):
+    """
+    以 Server-Sent Events 流式返回诊断结果
+    
+    事件顺序：
+    - rule: 规则引擎诊断（error level / type），立即发送
+    - explanation / suggestion: LLM 文本增量（{"delta": "..."}）
+    - reset: 丢弃已收到的增量，随后发送完整的文本（流式生成中途失败后的回退内容，
+      或生成期间记录已由其他写入方写回时数据库中保存的文本）
+    - done: 完整的 explanation / suggestion 和记录的 llm_status；
+      "ready" 表示文本与数据库中保存的一致
+    
+    LLM 解释已就绪时直接回放已保存的文本。尚未就绪时先认领记录（见 _claim_llm_explanation），
+    认领成功才调用 Gemini（或使用预生成解释）并写回；其他写入方正在生成时等待其写回后回放，
+    不重复调用 Gemini。与 POST /api/reflections?stream=true 配合使用。
+    """
+    
+    rule_event, saved, prepared = await run_in_threadpool(_load_stream_context, user_answer_id, db)
+    
+    async def events():
+        yield _format_sse("rule", rule_event)
+        
+        if prepared is None:
+            for event in _replay_events(*saved):
+                yield event
+            return
+        
+        if not await run_in_threadpool(_claim_llm_explanation, user_answer_id):
+            explanation, suggestion, status = await _wait_for_llm_explanation(user_answer_id)
+            for event in _replay_events(explanation, suggestion, status):
+                yield event
+            return
+        
+        finished = False
+        try:
+            text = {"explanation": "", "suggestion": ""}
+            if prepared.precomputed:
+                text["explanation"], text["suggestion"] = prepared.precomputed
+                yield _format_sse("explanation", {"delta": text["explanation"]})
+                yield _format_sse("suggestion", {"delta": text["suggestion"]})
+            else:
+                with track_phase("llm"):
+                    async for field, delta in stream_diagnosis_explanation(
+                        error_level=prepared.diagnosis_result.error_level,
+                        error_type=prepared.diagnosis_result.error_type,
+                        rule_details=prepared.diagnosis_result.details,
+                        question_data=prepared.question_data,
+                        user_responses=prepared.llm_context,
+                        cache_key=prepared.cache_key
+                    ):
+                        if field == "reset":
+                            text = {"explanation": "", "suggestion": ""}
+                            yield _format_sse("reset", {})
+                            continue
+                        text[field] += delta
+                        yield _format_sse(field, {"delta": delta})
+            
+            finished = True
+            stored = await run_in_threadpool(
+                _store_llm_explanation, user_answer_id, prepared, text["explanation"], text["suggestion"]
+            )
+        finally:
+            if not finished:
+                # 客户端断开时任务已被取消，屏蔽取消以确保还原认领
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(_release_llm_explanation, user_answer_id)
+        
+        if stored:
+            yield _format_sse("done", {
+                "llm_explanation": text["explanation"],
+                "llm_suggestion": text["suggestion"],
+                "llm_status": "ready",
+            })
+            return
+        
+        # 生成期间记录被覆盖或已由其他写入方写回：以数据库中保存的文本为准
+        explanation, suggestion, status = await run_in_threadpool(_read_llm_explanation, user_answer_id)
+        if (explanation, suggestion) != (text["explanation"], text["suggestion"]):
+            yield _format_sse("reset", {})
+            for event in _replay_events(explanation, suggestion, status):
+                yield event
+        else:
+            yield _format_sse("done", {
+                "llm_explanation": explanation, "llm_suggestion": suggestion, "llm_status": status
+            })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/users/{user_id}/profile", response_model=UserErrorProfileOut)
+def get_user_profile(user_id: int, db: Session = Depends(get_db)):
+    """
+    获取学生错误画像
+
+    画像在提交复盘时增量维护，这里只按主键读取一行；
+    还没有任何复盘的用户返回空画像。
+    """
+    
+    profile = db.get(UserErrorProfile, user_id)
+    if profile is None:
+        if not db.query(User.id).filter(User.id == user_id).first():
+            raise HTTPException(status_code=404, detail="用户不存在")
+        return UserErrorProfileOut(user_id=user_id)
+    return UserErrorProfileOut.from_profile(profile)
+
+
+# 一次最多推荐的题目数
+MAX_RECOMMENDATIONS = 50
+
+
+@router.get("/users/{user_id}/next-questions", response_model=NextQuestionsOut)
+def get_next_questions(
+    user_id: int,
+    limit: int = Query(10, ge=1, le=MAX_RECOMMENDATIONS),
+    db: Session = Depends(get_db)
+):
+    """
+    根据学生错误画像推荐下一批练习题
+
+    题库特征常驻内存（见 app/services/recommender.py），请求只做两次主键 / 索引读取
+    （错误画像、最近答过的题），其余为 NumPy 向量运算。
+    """
+    
+    profile = db.get(UserErrorProfile, user_id)
+    if profile is None and not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
+    # 走 ix_user_answers_user_id_created_at，只取最近 RECENT_EXCLUDE 条
+    recent = [
+        question_id for (question_id,) in
+        db.query(UserAnswer.question_id)
+        .filter(UserAnswer.user_id == user_id)
+        .order_by(UserAnswer.created_at.desc())
+        .limit(RECENT_EXCLUDE)
+    ]
+    
+    features = question_feature_index.get(db)
+    w_level, w_type = profile_weights(profile, features)
+    with track_phase("recommend"):
+        recommendations = rank(features, w_level, w_type, exclude_ids=recent, limit=limit)
+    return NextQuestionsOut(
+        user_id=user_id,
+        level_weights={level: round(float(w), 4) for level, w in zip(LEVELS, w_level)},
+        items=[RecommendedQuestionOut.model_validate(r) for r in recommendations],
+    )
+
+
+# 导出时每次从数据库游标读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+
+@router.get("/users/{user_id}/history/export")
+def export_user_history(
+    user_id: int,
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    db: Session = Depends(get_db)
+):
+    """
+    流式导出用户的全部答题 + 复盘记录（NDJSON 或 CSV）
+
+    使用独立的 session 和服务端游标（yield_per）按批读取，边读边发送，
+    内存占用与历史记录条数无关。整个导出在一个只读查询中完成。
+    """
+    
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="用户不存在")
+    
+    def chunks():
+        # 响应体在路由函数返回后才开始生成，不能使用依赖注入的 session
+        export_db = SessionLocal()
+        try:
+            batches = iter_history_batches(export_db, history_query([user_id]), EXPORT_BATCH_SIZE)
+            yield from format_batches(batches, export_format)
+        finally:
+            export_db.close()
+    
+    return StreamingResponse(
+        chunks(),
+        media_type=MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="user_{user_id}_history.{export_format}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+# Dashboard 分页大小上限：每页只做一次主键范围扫描，延迟与历史记录条数无关
+MAX_DASHBOARD_PAGE_SIZE = 200
+
+
+def _accuracy(row) -> Optional[float]:
+    return round(row.correct_count / row.answer_count, 4) if row.answer_count else None
+
+
+def _question_rollup_out(row: QuestionRollup) -> QuestionRollupOut:
+    top_option_id, top_option_count = top_count(row.wrong_option_counts)
+    top_step1_id, top_step1_count = top_count(row.step1_wrong_counts)
+    top_step2_id, top_step2_count = top_count(row.step2_wrong_counts)
+    return QuestionRollupOut(
+        cohort=row.cohort,
+        question_id=row.question_id,
+        answer_count=row.answer_count,
+        correct_count=row.correct_count,
+        accuracy=_accuracy(row),
+        reflection_count=row.reflection_count,
+        level_counts=row.level_counts or {},
+        top_wrong_option_id=top_option_id,
+        top_wrong_option_count=top_option_count,
+        top_step1_wrong_choice_id=top_step1_id,
+        top_step1_wrong_choice_count=top_step1_count,
+        top_step2_wrong_choice_id=top_step2_id,
+        top_step2_wrong_choice_count=top_step2_count,
+        updated_at=row.updated_at,
+    )
+
+
+@router.get("/dashboard/questions", response_model=QuestionRollupPage)
+def get_dashboard_questions(
+    cohort: str = ALL_COHORTS,
+    after: Optional[int] = Query(None, description="上一页返回的 next_after（question_id）"),
+    limit: int = Query(50, ge=1, le=MAX_DASHBOARD_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """
+    教师端 Dashboard：按题目汇总（默认全部学生，?cohort= 指定班级）
+
+    读取 refresh_rollups.py 维护的 question_rollups，按 question_id 做 keyset 分页。
+    """
+    
+    query = db.query(QuestionRollup).filter(QuestionRollup.cohort == cohort)
+    if after is not None:
+        query = query.filter(QuestionRollup.question_id > after)
+    rows = query.order_by(QuestionRollup.question_id).limit(limit).all()
+    return QuestionRollupPage(
+        items=[_question_rollup_out(row) for row in rows],
+        next_after=rows[-1].question_id if len(rows) == limit else None,
+        refreshed_through=rollups_refreshed_through(db),
+    )
+
+
+@router.get("/dashboard/cohorts", response_model=CohortRollupPage)
+def get_dashboard_cohorts(
+    after: Optional[str] = Query(None, description="上一页返回的 next_after（cohort）"),
+    limit: int = Query(50, ge=1, le=MAX_DASHBOARD_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    """
+    教师端 Dashboard：按班级汇总（cohort 为 "__all__" 的一行是全部学生）
+
+    读取 refresh_rollups.py 维护的 cohort_rollups，按 cohort 做 keyset 分页。
+    """
+    
+    query = db.query(CohortRollup)
+    if after is not None:
+        query = query.filter(CohortRollup.cohort > after)
+    rows = query.order_by(CohortRollup.cohort).limit(limit).all()
+    return CohortRollupPage(
+        items=[
+            CohortRollupOut(
+                cohort=row.cohort,
+                answer_count=row.answer_count,
+                correct_count=row.correct_count,
+                accuracy=_accuracy(row),
+                reflection_count=row.reflection_count,
+                level_counts=row.level_counts or {},
+                updated_at=row.updated_at,
+            )
+            for row in rows
+        ],
+        next_after=rows[-1].cohort if len(rows) == limit else None,
+        refreshed_through=rollups_refreshed_through(db),
     )
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional 
 from datetime import datetime
 
@@ -13,6 +13,7 @@ class OptionOut(BaseModel):
 
 class QuestionOut(BaseModel):
     id: int
+    passage_id: int
     question_type: str
     stem: str
     passage_title: str
@@ -22,6 +23,27 @@ class QuestionOut(BaseModel):
     class Config:
         from_attributes = True
 
+class QuestionSlimOut(BaseModel):
+    """Question without the passage text; the passage is referenced by id"""
+    id: int
+    passage_id: int
+    question_type: str
+    stem: str
+    options: list[OptionOut]
+    
+    class Config:
+        from_attributes = True
+
+class PassageOut(BaseModel):
+    """A passage with all of its questions; the passage text is sent once"""
+    id: int
+    title: str
+    content: str
+    questions: list[QuestionSlimOut]
+    
+    class Config:
+        from_attributes = True
+
 class AnswerSubmit(BaseModel):
     """Submit answer payload"""
     user_id: int
@@ -37,6 +59,30 @@ class AnswerResult(BaseModel):
     needs_reflection: bool
     message: str
 
+
+# 一次批量提交的最大答案数（一篇文章约 10 题，一个 section 约 20 题）
+MAX_BATCH_ANSWERS = 50
+
+
+class AnswerBatchItem(BaseModel):
+    """One answer inside a batch submission"""
+    question_id: int
+    selected_option_id: int
+
+
+class AnswerBatchSubmit(BaseModel):
+    """Submit a whole passage / section attempt in one request"""
+    user_id: int
+    answers: list[AnswerBatchItem] = Field(min_length=1, max_length=MAX_BATCH_ANSWERS)
+
+
+class AnswerBatchResult(BaseModel):
+    """Batch grading result: per-question results in submission order"""
+    results: list[AnswerResult]
+    correct_count: int
+    total: int
+    needs_reflection: list[int]  # 需要复盘的 user_answer_id，按提交顺序
+
 class ReflectionChoiceOut(BaseModel):
     id: int
     choice_text: str
@@ -102,7 +148,104 @@ class DiagnosisOut(BaseModel):
     
     llm_explanation: str
     llm_suggestion: str
+    llm_status: str = "ready"  # "pending": LLM 解释尚未生成；"generating": 正在由后台任务或 SSE 流生成
+
+
+    class Config:
+        from_attributes = True
+
+
+class ProfileTrajectoryEntry(BaseModel):
+    """One reflection diagnosis in the recent-window trajectory"""
+    user_answer_id: int
+    question_id: int
+    error_level: Optional[str] = None
+    error_type: Optional[str] = None
+
 
+class UserErrorProfileOut(BaseModel):
+    """Per-user error profile (学生错误画像)"""
+    user_id: int
+    total_reflections: int = 0
+    level_counts: dict[str, int] = {}
+    type_counts: dict[str, int] = {}
+    recent_level_counts: dict[str, int] = {}  # 最近 trajectory 窗口内的层级分布
+    trajectory: list[ProfileTrajectoryEntry] = []  # 旧 -> 新
+    primary_error_level: Optional[str] = None  # 累计次数最多的错误层级
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_profile(cls, profile) -> "UserErrorProfileOut":
+        level_counts = profile.level_counts or {}
+        return cls(
+            user_id=profile.user_id,
+            total_reflections=profile.total_reflections or 0,
+            level_counts=level_counts,
+            type_counts=profile.type_counts or {},
+            recent_level_counts=profile.recent_level_counts or {},
+            trajectory=profile.trajectory or [],
+            primary_error_level=max(level_counts, key=level_counts.get) if level_counts else None,
+            updated_at=profile.updated_at,
+        )
+
+
+class QuestionRollupOut(BaseModel):
+    """Per-question aggregates for the teacher dashboard (one cohort)"""
+    cohort: str
+    question_id: int
+    answer_count: int
+    correct_count: int
+    accuracy: Optional[float] = None
+    reflection_count: int
+    level_counts: dict[str, int]
+    top_wrong_option_id: Optional[int] = None  # 最常被选的错误选项
+    top_wrong_option_count: int = 0
+    top_step1_wrong_choice_id: Optional[int] = None  # Step 1 最常见的错误 choice
+    top_step1_wrong_choice_count: int = 0
+    top_step2_wrong_choice_id: Optional[int] = None  # Step 2 最常见的错误 choice
+    top_step2_wrong_choice_count: int = 0
+    updated_at: Optional[datetime] = None
+
+
+class CohortRollupOut(BaseModel):
+    """Per-cohort aggregates for the teacher dashboard"""
+    cohort: str
+    answer_count: int
+    correct_count: int
+    accuracy: Optional[float] = None
+    reflection_count: int
+    level_counts: dict[str, int]
+    updated_at: Optional[datetime] = None
+
+
+class QuestionRollupPage(BaseModel):
+    """One keyset page of question rollups; pass next_after as ?after= for the next page"""
+    items: list[QuestionRollupOut]
+    next_after: Optional[int] = None
+    refreshed_through: Optional[datetime] = None  # 此前创建的记录都已计入汇总
+
+
+class CohortRollupPage(BaseModel):
+    """One keyset page of cohort rollups"""
+    items: list[CohortRollupOut]
+    next_after: Optional[str] = None
+    refreshed_through: Optional[datetime] = None
+
+
+class RecommendedQuestionOut(BaseModel):
+    """One recommended practice question"""
+    question_id: int
+    question_type: str
+    score: float
+    difficulty: float  # 平滑后的全体学生错误率
+    focus_level: str  # 该题针对的薄弱层级
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class NextQuestionsOut(BaseModel):
+    """Practice recommendations ranked against the student's error profile"""
+    user_id: int
+    level_weights: dict[str, float]  # 画像得到的各层级权重
+    items: list[RecommendedQuestionOut]
@@ -3,6 +3,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
+from app.core.metrics import instrument_engine
 
 load_dotenv()
 
@@ -10,8 +11,10 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable is not set")
 
-# Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL, echo=True)
+# Create the SQLAlchemy engine（SQL_ECHO=true 时打印每条 SQL，仅用于调试）
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
+instrument_engine(engine)
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
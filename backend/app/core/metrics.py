@@ -0,0 +1,288 @@
+"""
+Performance metrics for TOEFL Reading Error Diagnosis
+
+进程内的 Prometheus 指标（文本格式由 GET /metrics 暴露），不依赖 prometheus_client：
+
+- http_request_duration_seconds{method, route, status}：每个路由的延迟直方图
+- http_request_phase_seconds{route, phase}：请求内各阶段耗时
+  （db = 本请求所有 SQL 的耗时之和，rule_engine / llm / recommend 由代码中的 track_phase() 记录），
+  可据此得到 submit_reflection 的 p99 分解
+- http_request_db_statements{route}：每个请求执行的 SQL 条数
+- db_statement_duration_seconds：单条 SQL 耗时
+- llm_request_duration_seconds{kind, outcome}：Gemini 调用耗时和结果
+- llm_rejections_total{reason}：被熔断 / 限流 / 并发上限拒绝的 Gemini 调用
+
+请求级统计通过 contextvars 传递：MetricsMiddleware 为每个请求建立 RequestStats，
+run_in_threadpool / 同步路由会复制 context，因此线程池中执行的 SQL 也计入当前请求。
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 延迟直方图的默认桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# SQL 条数直方图的桶
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """累积桶直方图（与 Prometheus histogram 语义一致）"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # labels -> [各桶计数, sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[labels] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, ([*s[0]], s[1], s[2])) for labels, s in self._series.items())
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound) if bound == float("inf") else bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+# ---------------------------------------------------------------------------
+# Metric definitions
+# ---------------------------------------------------------------------------
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_PHASE = Histogram(
+    "http_request_phase_seconds", "Time spent per request in each phase (db, rule_engine, llm)",
+    ["route", "phase"]
+)
+HTTP_REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements", "SQL statements executed per request",
+    ["route"], buckets=COUNT_BUCKETS
+)
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds", "Latency of individual SQL statements"
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Gemini call latency by call kind and outcome",
+    ["kind", "outcome"]
+)
+LLM_REJECTIONS = Counter(
+    "llm_rejections_total", "Gemini calls rejected by the LLM guard", ["reason"]
+)
+
+REGISTRY = [
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUEST_PHASE,
+    HTTP_REQUEST_DB_STATEMENTS,
+    DB_STATEMENT_DURATION,
+    LLM_REQUEST_DURATION,
+    LLM_REJECTIONS,
+]
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Request-scoped statistics
+# ---------------------------------------------------------------------------
+
+class RequestStats:
+    """单个请求内累积的 SQL 与阶段耗时"""
+
+    def __init__(self):
+        self.db_statements = 0
+        self.db_seconds = 0.0
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_statement(self, seconds: float) -> None:
+        with self._lock:
+            self.db_statements += 1
+            self.db_seconds += seconds
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "metrics_request_stats", default=None
+)
+
+
+@contextmanager
+def track_phase(phase: str):
+    """把代码块的耗时计入当前请求的某个阶段（不在请求中时不记录）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current_request.get()
+        if stats is not None:
+            stats.add_phase(phase, time.perf_counter() - started)
+
+
+def record_llm_call(kind: str, outcome: str, seconds: float) -> None:
+    """
+    记录一次 Gemini 调用
+
+    kind: sync / async / stream
+    outcome: success / invalid（响应无法解析）/ timeout / error / cancelled（流式调用被客户端中断）
+    """
+    LLM_REQUEST_DURATION.observe(seconds, kind, outcome)
+
+
+def record_llm_rejection(reason: str) -> None:
+    LLM_REJECTIONS.inc(reason)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """注册 SQLAlchemy 事件钩子，统计每条 SQL 的耗时"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        DB_STATEMENT_DURATION.observe(elapsed)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.add_statement(elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("metrics_query_start"):
+            conn.info["metrics_query_start"].pop()
+
+
+class MetricsMiddleware:
+    """
+    ASGI 中间件：记录每个请求的延迟、SQL 条数和各阶段耗时
+
+    以路由模板（如 /api/diagnosis/{user_answer_id}）作为 route 标签，未匹配的路径
+    统一记为 "unmatched"，避免标签基数随 URL 增长。流式响应在响应体发送完毕后才记录。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        state = {"status": 500, "recorded": False}
+        started = time.perf_counter()
+
+        def record():
+            # 响应体发送完毕即记录：之后执行的 BackgroundTasks 不计入请求延迟
+            state["recorded"] = True
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(elapsed, scope["method"], route, str(state["status"]))
+            HTTP_REQUEST_DB_STATEMENTS.observe(stats.db_statements, route)
+            HTTP_REQUEST_PHASE.observe(stats.db_seconds, route, "db")
+            for phase, seconds in stats.phases.items():
+                HTTP_REQUEST_PHASE.observe(seconds, route, phase)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            if not state["recorded"]:
+                record()
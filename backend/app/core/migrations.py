@@ -0,0 +1,504 @@
+"""
+Versioned schema migrations for TOEFL Reading Error Diagnosis
+
+已部署的数据库不能靠 `Base.metadata.create_all()` 升级：它只会创建缺失的表，
+不会给已有的表加列或加索引。这里维护一个按版本号递增的迁移列表，
+已执行的版本记录在 schema_migrations 表中，`migrate.py` / `init_database.py`
+只执行尚未执行过的迁移。
+
+约定：
+- 迁移一旦发布就不再修改，新的 schema 变更追加一个新版本
+- 每个迁移的 DDL 写在迁移内部（独立的 MetaData / Table 定义或 SQL），不从当前模型生成，
+  之后修改模型不会改变已发布迁移的行为
+- 迁移是幂等的（IF NOT EXISTS / 先检查再加列），重复执行或中途失败后重跑都安全
+- 模型中的 Index 声明与迁移创建的索引同名，新建的数据库和迁移升级的数据库结构一致
+- 在 PostgreSQL 上，给已有的大表加索引使用 CREATE INDEX CONCURRENTLY，
+  不阻塞写入；这类迁移标记为 transactional=False，在事务之外执行
+"""
+
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+from sqlalchemy import (
+    JSON, Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+    UniqueConstraint, inspect, text
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import func
+
+# 所有迁移共用的 PostgreSQL advisory lock，防止多个进程同时执行迁移
+_ADVISORY_LOCK_ID = 823_517_001
+
+_migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """一个 schema 版本"""
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # False 表示必须在事务之外执行（PostgreSQL CREATE INDEX CONCURRENTLY）
+    transactional: bool = True
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _referenced_tables(metadata: MetaData, *table_names: str) -> None:
+    """
+    在迁移自己的 MetaData 中登记外键引用的已有表（只声明主键列，用于生成 REFERENCES，不会被创建）
+    """
+    for name in table_names:
+        Table(name, metadata, Column("id", Integer, primary_key=True))
+
+
+def _create_tables(conn: Connection, tables: Sequence[Table]) -> None:
+    """创建迁移中定义的表（已存在的表不受影响）"""
+    tables[0].metadata.create_all(bind=conn, tables=list(tables), checkfirst=True)
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str) -> None:
+    """列不存在时添加"""
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _create_index(
+    conn: Connection,
+    name: str,
+    table: str,
+    columns: Sequence[str],
+    include: Sequence[str] = (),
+    unique: bool = False
+) -> None:
+    """
+    创建索引（已存在时跳过）
+
+    PostgreSQL 上使用 CONCURRENTLY，并用 INCLUDE 建覆盖索引；
+    CONCURRENTLY 中途失败会留下 INVALID 的索引，这里先删掉再重建。
+    """
+    cols = ", ".join(columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if conn.dialect.name == "postgresql":
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        include_sql = f" INCLUDE ({', '.join(include)})" if include else ""
+        conn.execute(text(
+            f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols}){include_sql}"
+        ))
+    else:
+        conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+def _baseline(conn: Connection) -> None:
+    """
+    引入迁移之前已部署的 8 张表
+
+    表结构固定在这里，不从当前模型生成：之后给这些表新增的列（llm_status、content_key、
+    cohort、answer_sentence_id 等）和索引都由各自的迁移添加，空库和已有的库走同一条升级路径。
+    """
+    metadata = MetaData()
+    Table(
+        "passages", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("title", String(200), nullable=False),
+        Column("content", Text, nullable=False),
+        Column("created_at", DateTime, server_default=func.now()),
+    )
+    Table(
+        "questions", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("passage_id", Integer, ForeignKey("passages.id"), nullable=False),
+        Column("question_type", String(50), nullable=False),
+        Column("stem", Text, nullable=False),
+        Column("correct_option_id", Integer),
+        Column("answer_sentence", Text),
+        Column("created_at", DateTime, server_default=func.now()),
+    )
+    Table(
+        "options", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+        Column("option_label", String(1), nullable=False),
+        Column("option_text", Text, nullable=False),
+        Column("is_correct", Boolean),
+    )
+    Table(
+        "reflection_steps", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+        Column("step_number", Integer, nullable=False),
+        Column("step_type", String(50), nullable=False),
+        Column("prompt_text", Text, nullable=False),
+        Column("allow_custom_input", Boolean),
+    )
+    Table(
+        "reflection_choices", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("reflection_step_id", Integer, ForeignKey("reflection_steps.id"), nullable=False),
+        Column("choice_text", Text, nullable=False),
+        Column("is_correct", Boolean),
+        Column("choice_order", Integer),
+    )
+    Table(
+        "users", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("username", String(100), nullable=False, unique=True),
+        Column("email", String(200)),
+        Column("created_at", DateTime, server_default=func.now()),
+    )
+    Table(
+        "user_answers", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+        Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+        Column("selected_option_id", Integer, ForeignKey("options.id"), nullable=False),
+        Column("is_correct", Boolean, nullable=False),
+        Column("needs_reflection", Boolean),
+        Column("created_at", DateTime, server_default=func.now()),
+    )
+    Table(
+        "reflection_responses", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("user_answer_id", Integer, ForeignKey("user_answers.id"), nullable=False, unique=True),
+        Column("step1_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step1_is_correct", Boolean),
+        Column("step2_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step2_is_correct", Boolean),
+        Column("step3_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step3_custom_input", Text),
+        Column("step3_quality", String(20)),
+        Column("step4a_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step4a_custom_input", Text),
+        Column("step4b_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step4b_custom_input", Text),
+        Column("step5_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("step5_custom_input", Text),
+        Column("step6_notes", Text),
+        Column("rule_error_level", String(20)),
+        Column("rule_error_type", String(100)),
+        Column("llm_explanation", Text),
+        Column("llm_suggestion", Text),
+        Column("created_at", DateTime, server_default=func.now()),
+        Column("completed_at", DateTime),
+    )
+    _create_tables(conn, metadata.sorted_tables)
+
+
+def _reflection_llm_status(conn: Connection) -> None:
+    _add_column(conn, "reflection_responses", "llm_status", "VARCHAR(20) DEFAULT 'ready'")
+    _add_column(conn, "reflection_responses", "llm_prompt_version", "INTEGER")
+
+
+def _llm_explanation_cache(conn: Connection) -> None:
+    metadata = MetaData()
+    _referenced_tables(metadata, "questions")
+    _create_tables(conn, [Table(
+        "llm_explanation_cache", metadata,
+        Column("fingerprint", String(64), primary_key=True),
+        Column("question_id", Integer, ForeignKey("questions.id")),
+        Column("error_level", String(20)),
+        Column("prompt_version", Integer),
+        Column("llm_explanation", Text, nullable=False),
+        Column("llm_suggestion", Text, nullable=False),
+        Column("hit_count", Integer),
+        Column("created_at", DateTime, server_default=func.now()),
+        Column("last_used_at", DateTime, server_default=func.now()),
+    )])
+
+
+def _precomputed_explanations(conn: Connection) -> None:
+    metadata = MetaData()
+    _referenced_tables(metadata, "questions", "options", "reflection_choices")
+    _create_tables(conn, [Table(
+        "precomputed_explanations", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("question_id", Integer, ForeignKey("questions.id"), nullable=False),
+        Column("selected_option_id", Integer, ForeignKey("options.id"), nullable=False),
+        Column("error_level", String(20), nullable=False),
+        Column("error_type", String(100), nullable=False),
+        Column("salient_choice_id", Integer, ForeignKey("reflection_choices.id")),
+        Column("prompt_version", Integer, nullable=False),
+        Column("llm_explanation", Text, nullable=False),
+        Column("llm_suggestion", Text, nullable=False),
+        Column("created_at", DateTime, server_default=func.now()),
+        UniqueConstraint(
+            "question_id", "selected_option_id", "error_level", "error_type", "salient_choice_id",
+            name="uq_precomputed_explanation_path"
+        ),
+    )])
+
+
+# 迁移 0005 创建的热路径索引：(名称, 表, 列, PostgreSQL INCLUDE 列)
+HOT_PATH_INDEXES = [
+    # 正确选项 / 正确 choice 查询：WHERE fk = ? AND is_correct
+    ("ix_options_question_id_is_correct", "options", ["question_id", "is_correct"], []),
+    ("ix_reflection_choices_step_id_is_correct", "reflection_choices", ["reflection_step_id", "is_correct"], []),
+    # 复盘步骤按 step_number 排序加载
+    ("ix_reflection_steps_question_id_step_number", "reflection_steps", ["question_id", "step_number"], []),
+    # 用户答题历史（按时间倒序），覆盖常用列避免回表
+    ("ix_user_answers_user_id_created_at", "user_answers", ["user_id", "created_at"], ["question_id", "is_correct"]),
+    ("ix_user_answers_question_id", "user_answers", ["question_id"], []),
+    ("ix_user_answers_created_at", "user_answers", ["created_at"], []),
+]
+
+
+def _hot_path_indexes(conn: Connection) -> None:
+    for name, table, columns, include in HOT_PATH_INDEXES:
+        _create_index(conn, name, table, columns, include)
+
+
+def _questions_passage_id_index(conn: Connection) -> None:
+    # GET /api/passages/{id} 按 passage_id 加载文章的全部题目
+    _create_index(conn, "ix_questions_passage_id", "questions", ["passage_id"])
+
+
+def _passage_content_key(title: str) -> str:
+    """迁移 0007 回填时的文章键规则（与当时 content_import.passage_content_key 一致，不随其修改）"""
+    return hashlib.sha256(f"passage\n{title.strip()}".encode("utf-8")).hexdigest()[:32]
+
+
+def _question_content_key(passage_key: str, stem: str) -> str:
+    """迁移 0007 回填时的题目键规则（与当时 content_import.question_content_key 一致）"""
+    return hashlib.sha256(f"question\n{passage_key}\n{stem.strip()}".encode("utf-8")).hexdigest()[:32]
+
+
+def _unique_key(key: str, row_id: int, used: set, what: str) -> str:
+    """键已被 id 更小的行占用（标题 / 题干重复）时加上 id 后缀，保证迁移 0008 的唯一索引能建成"""
+    if key in used:
+        key = f"{key}-{row_id}"
+        print(f"⚠️ {what} {row_id} 与其他行重复，content_key 使用 {key}")
+    used.add(key)
+    return key
+
+
+def _content_keys(conn: Connection) -> None:
+    """
+    passages / questions 增加 content_key（import_content.py 按它 upsert），
+    并按导入器当时的默认规则为已有的行回填
+
+    标题相同的文章、同一文章中题干相同的题目按 id 顺序回填，第一行使用默认键，
+    其余行的键加上 "-<id>" 后缀；文章已不存在的题目不回填（保持 NULL）。
+    """
+    _add_column(conn, "passages", "content_key", "VARCHAR(64)")
+    _add_column(conn, "questions", "content_key", "VARCHAR(64)")
+
+    passages = conn.execute(text("SELECT id, title, content_key FROM passages ORDER BY id")).all()
+    used = {key for _, _, key in passages if key}
+    passage_keys = {}
+    for passage_id, title, key in passages:
+        if key:
+            passage_keys[passage_id] = key
+            continue
+        key = _unique_key(_passage_content_key(title), passage_id, used, "文章标题")
+        passage_keys[passage_id] = key
+        conn.execute(
+            text("UPDATE passages SET content_key = :key WHERE id = :id"),
+            {"key": key, "id": passage_id}
+        )
+
+    questions = conn.execute(text(
+        "SELECT id, passage_id, stem, content_key FROM questions ORDER BY id"
+    )).all()
+    used = {key for _, _, _, key in questions if key}
+    for question_id, passage_id, stem, key in questions:
+        if key:
+            continue
+        if passage_id not in passage_keys:
+            print(f"⚠️ 题目 {question_id} 的文章 {passage_id} 不存在，不回填 content_key")
+            continue
+        key = _unique_key(
+            _question_content_key(passage_keys[passage_id], stem), question_id, used, "题目题干"
+        )
+        conn.execute(
+            text("UPDATE questions SET content_key = :key WHERE id = :id"),
+            {"key": key, "id": question_id}
+        )
+
+
+def _content_key_indexes(conn: Connection) -> None:
+    _create_index(conn, "uq_passages_content_key", "passages", ["content_key"], unique=True)
+    _create_index(conn, "uq_questions_content_key", "questions", ["content_key"], unique=True)
+
+
+def _user_error_profile(conn: Connection) -> None:
+    # 已有的复盘历史由 rebuild_profiles.py 回填
+    metadata = MetaData()
+    _referenced_tables(metadata, "users")
+    _create_tables(conn, [Table(
+        "user_error_profile", metadata,
+        Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+        Column("total_reflections", Integer, nullable=False),
+        Column("level_counts", JSON, nullable=False),
+        Column("type_counts", JSON, nullable=False),
+        Column("trajectory", JSON, nullable=False),
+        Column("recent_level_counts", JSON, nullable=False),
+        Column("updated_at", DateTime, server_default=func.now()),
+    )])
+
+
+def _dashboard_rollups(conn: Connection) -> None:
+    # 汇总表由 refresh_rollups.py 从水位 0 开始回填
+    _add_column(conn, "users", "cohort", "VARCHAR(50)")
+    metadata = MetaData()
+    _referenced_tables(metadata, "questions")
+    _create_tables(conn, [
+        Table(
+            "question_rollups", metadata,
+            Column("cohort", String(50), primary_key=True),
+            Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+            Column("answer_count", Integer, nullable=False),
+            Column("correct_count", Integer, nullable=False),
+            Column("reflection_count", Integer, nullable=False),
+            Column("level_counts", JSON, nullable=False),
+            Column("wrong_option_counts", JSON, nullable=False),
+            Column("step1_wrong_counts", JSON, nullable=False),
+            Column("step2_wrong_counts", JSON, nullable=False),
+            Column("updated_at", DateTime, server_default=func.now()),
+        ),
+        Table(
+            "cohort_rollups", metadata,
+            Column("cohort", String(50), primary_key=True),
+            Column("answer_count", Integer, nullable=False),
+            Column("correct_count", Integer, nullable=False),
+            Column("reflection_count", Integer, nullable=False),
+            Column("level_counts", JSON, nullable=False),
+            Column("updated_at", DateTime, server_default=func.now()),
+        ),
+        Table(
+            "rollup_watermarks", metadata,
+            Column("source", String(50), primary_key=True),
+            Column("last_created_at", DateTime),
+            Column("last_id", Integer, nullable=False),
+            Column("covered_until", DateTime),
+            Column("updated_at", DateTime, server_default=func.now()),
+        ),
+    ])
+
+
+def _reflection_created_at_index(conn: Connection) -> None:
+    _create_index(conn, "ix_reflection_responses_created_at", "reflection_responses", ["created_at"])
+
+
+def _passage_sentences(conn: Connection) -> None:
+    # 已有文章的句子索引由 build_sentence_index.py 回填
+    metadata = MetaData()
+    _referenced_tables(metadata, "passages")
+    _create_tables(conn, [Table(
+        "passage_sentences", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("passage_id", Integer, ForeignKey("passages.id"), nullable=False),
+        Column("sentence_index", Integer, nullable=False),
+        Column("paragraph_index", Integer, nullable=False),
+        Column("start_offset", Integer, nullable=False),
+        Column("end_offset", Integer, nullable=False),
+        Column("tokens", JSON, nullable=False),
+        UniqueConstraint("passage_id", "sentence_index", name="uq_passage_sentences_position"),
+    )])
+    _add_column(conn, "questions", "answer_sentence_id", "INTEGER REFERENCES passage_sentences(id)")
+    _add_column(conn, "reflection_choices", "sentence_id", "INTEGER REFERENCES passage_sentences(id)")
+
+
+def _content_version(conn: Connection) -> None:
+    # 单行表：导入脚本递增 version，API 进程据此清空进程内的内容缓存
+    metadata = MetaData()
+    content_version = Table(
+        "content_version", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("version", Integer, nullable=False),
+        Column("updated_at", DateTime, server_default=func.now()),
+    )
+    _create_tables(conn, [content_version])
+    if conn.execute(text("SELECT COUNT(*) FROM content_version")).scalar() == 0:
+        conn.execute(content_version.insert().values(id=1, version=0))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(2, "reflection_responses.llm_status / llm_prompt_version", _reflection_llm_status),
+    Migration(3, "llm_explanation_cache table", _llm_explanation_cache),
+    Migration(4, "precomputed_explanations table", _precomputed_explanations),
+    Migration(5, "hot foreign-key indexes", _hot_path_indexes, transactional=False),
+    Migration(6, "questions.passage_id index", _questions_passage_id_index, transactional=False),
+    Migration(7, "passages / questions content_key", _content_keys),
+    Migration(8, "content_key unique indexes", _content_key_indexes, transactional=False),
+    Migration(9, "user_error_profile table", _user_error_profile),
+    Migration(10, "users.cohort and dashboard rollup tables", _dashboard_rollups),
+    Migration(11, "reflection_responses.created_at index", _reflection_created_at_index, transactional=False),
+    Migration(12, "passage_sentences index", _passage_sentences),
+    Migration(13, "content_version table", _content_version),
+]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def applied_versions(engine: Engine) -> List[int]:
+    """已执行的迁移版本号（schema_migrations 表不存在时为空）"""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_migrations"):
+            return []
+        rows = conn.execute(schema_migrations.select().order_by(schema_migrations.c.version))
+        return [row.version for row in rows]
+
+
+def pending_migrations(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """尚未执行的迁移（可指定目标版本）"""
+    applied = set(applied_versions(engine))
+    return [
+        m for m in MIGRATIONS
+        if m.version not in applied and (target is None or m.version <= target)
+    ]
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """
+    按版本顺序执行所有未执行的迁移（可指定目标版本），返回本次执行的迁移
+    """
+    _migration_metadata.create_all(bind=engine, checkfirst=True)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        postgres = lock_conn.dialect.name == "postgresql"
+        if postgres:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        try:
+            # 拿到锁之后再计算待执行列表，其他进程可能刚刚执行过
+            pending = pending_migrations(engine, target)
+            for migration in pending:
+                print(f"⏫ 执行迁移 {migration.version:04d}: {migration.name}")
+                if migration.transactional:
+                    with engine.begin() as conn:
+                        migration.upgrade(conn)
+                        _record(conn, migration)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        migration.upgrade(conn)
+                        _record(conn, migration)
+            return pending
+        finally:
+            if postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK_ID})
+
+
+def _record(conn: Connection, migration: Migration) -> None:
+    conn.execute(schema_migrations.insert().values(version=migration.version, name=migration.name))
@@ -1,11 +1,39 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.api.routes import router
+from app.core.database import SessionLocal
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.services.answer_key import answer_key_index
+from app.services.content_version import content_version_watcher
+from app.services.recommender import question_feature_index
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 预加载答案索引和推荐特征索引；失败时（如数据库尚未就绪）在第一次使用时再加载
+    # 先记录当前的内容版本号，之后其他进程导入题库时据此清空缓存
+    content_version_watcher.check()
+    db = SessionLocal()
+    try:
+        count = answer_key_index.load(db)
+        print(f"答案索引已加载: {count} 道题")
+        count = question_feature_index.load(db)
+        print(f"推荐特征索引已加载: {count} 道题")
+    except Exception as e:
+        print(f"⚠️ 索引预加载失败: {e}")
+    finally:
+        db.close()
+    yield
+
 
 app = FastAPI(
     title= "TOEFL Reading Error Diagnosis System",
     description="TOEFL Reading Error Diagnosis System Backend API",
-    version = "0.1.0"
+    version = "0.1.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -14,8 +42,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 前端需要读取 ETag 以便发送 If-None-Match
+    expose_headers=["ETag"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
+
+@app.middleware("http")
+async def check_content_version(request: Request, call_next):
+    """其他进程导入题库后清空本进程的内容缓存（最多每 CONTENT_VERSION_CHECK_SECONDS 秒查一次数据库）"""
+    if content_version_watcher.due():
+        await run_in_threadpool(content_version_watcher.check)
+    return await call_next(request)
+
+
 app.include_router(router)
 
 @app.get("/")
@@ -28,4 +69,9 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus 文本格式的性能指标（路由延迟、SQL、阶段耗时、Gemini 调用）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text, Index, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -8,13 +8,38 @@ class Passage(Base):
     Docstring for Passage
     '''
     __tablename__ = "passages"
+    __table_args__ = (
+        Index("uq_passages_content_key", "content_key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(200), nullable=False)
     content = Column(Text, nullable=False)
+    content_key = Column(String(64))  # 题库导入的稳定键（import_content.py 按它 upsert）
     created_at = Column(DateTime, server_default=func.now())
     
-    questions = relationship("Question", back_populates="passage")
+    questions = relationship("Question", back_populates="passage", order_by="Question.id")
+
+class PassageSentence(Base):
+    """
+    文章句子索引（导入题库时由 app/services/passage_index.py 生成）
+
+    [start_offset, end_offset) 是句子在 Passage.content 中的字符偏移，
+    tokens 是规范化后的词集合（排序后的 JSON 数组）。
+    """
+
+    __tablename__ = "passage_sentences"
+    __table_args__ = (
+        UniqueConstraint("passage_id", "sentence_index", name="uq_passage_sentences_position"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    passage_id = Column(Integer, ForeignKey("passages.id"), nullable=False)
+    sentence_index = Column(Integer, nullable=False)  # 在整篇文章中的序号（从 0 开始）
+    paragraph_index = Column(Integer, nullable=False)  # 所在段落（从 0 开始）
+    start_offset = Column(Integer, nullable=False)
+    end_offset = Column(Integer, nullable=False)
+    tokens = Column(JSON, nullable=False, default=list)
 
 class Question(Base):
     """
@@ -22,6 +47,10 @@ class Question(Base):
     """
 
     __tablename__ = "questions"
+    __table_args__ = (
+        Index("ix_questions_passage_id", "passage_id"),
+        Index("uq_questions_content_key", "content_key", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     passage_id = Column(Integer, ForeignKey("passages.id"), nullable=False)
@@ -29,19 +58,28 @@ class Question(Base):
     stem = Column(Text, nullable=False)
     correct_option_id = Column(Integer)  
     answer_sentence = Column(Text) 
+    # answer_sentence 在文章句子索引中对应的句子（见 app/services/passage_index.py）
+    answer_sentence_id = Column(Integer, ForeignKey("passage_sentences.id"))
+    content_key = Column(String(64))  # 题库导入的稳定键
     created_at = Column(DateTime, server_default=func.now())
     
     # Relationships
     passage = relationship("Passage", back_populates="questions")
-    options = relationship("Option", back_populates="question")
-    reflection_steps = relationship("ReflectionStep", back_populates="question")
+    options = relationship("Option", back_populates="question", order_by="Option.option_label")
+    reflection_steps = relationship(
+        "ReflectionStep", back_populates="question", order_by="ReflectionStep.step_number"
+    )
     user_answers = relationship("UserAnswer", back_populates="question")
+    answer_sentence_location = relationship("PassageSentence", foreign_keys=[answer_sentence_id])
 
 class Option(Base):
     """
     Docstring for Option
     """
     __tablename__ = "options"
+    __table_args__ = (
+        Index("ix_options_question_id_is_correct", "question_id", "is_correct"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
@@ -57,6 +95,9 @@ class ReflectionStep(Base):
     Docstring for ReflectionStep
     """
     __tablename__ = "reflection_steps"
+    __table_args__ = (
+        Index("ix_reflection_steps_question_id_step_number", "question_id", "step_number"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
@@ -70,22 +111,30 @@ class ReflectionStep(Base):
     
     # Relationships
     question = relationship("Question", back_populates="reflection_steps")
-    choices = relationship("ReflectionChoice", back_populates="reflection_step")
+    choices = relationship(
+        "ReflectionChoice", back_populates="reflection_step", order_by="ReflectionChoice.choice_order"
+    )
 
 class ReflectionChoice(Base):
     """
     Docstring for ReflectionChoice
     """
     __tablename__ = "reflection_choices"
+    __table_args__ = (
+        Index("ix_reflection_choices_step_id_is_correct", "reflection_step_id", "is_correct"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     reflection_step_id = Column(Integer, ForeignKey("reflection_steps.id"), nullable=False)
     choice_text = Column(Text, nullable=False)
     is_correct = Column(Boolean, default=False)
     choice_order = Column(Integer)
+    # Step 2（sentence_location）的 choice 对应的文章句子
+    sentence_id = Column(Integer, ForeignKey("passage_sentences.id"))
     
     # Relationships
     reflection_step = relationship("ReflectionStep", back_populates="choices")
+    sentence = relationship("PassageSentence")
 
 class User(Base):
     """
@@ -96,6 +145,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String(100), nullable=False, unique=True)
     email = Column(String(200))
+    cohort = Column(String(50))  # 班级 / 学习小组，教师端 Dashboard 按它聚合
     created_at = Column(DateTime, server_default=func.now())
     
     # Relationships
@@ -107,6 +157,15 @@ class UserAnswer(Base):
     """
 
     __tablename__ = "user_answers"
+    # 索引由 app/core/migrations.py 的迁移 0005 在已有数据库上创建，名称需保持一致
+    __table_args__ = (
+        Index(
+            "ix_user_answers_user_id_created_at", "user_id", "created_at",
+            postgresql_include=["question_id", "is_correct"]
+        ),
+        Index("ix_user_answers_question_id", "question_id"),
+        Index("ix_user_answers_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -128,6 +187,10 @@ class ReflectionResponse(Base):
     """
 
     __tablename__ = "reflection_responses"
+    __table_args__ = (
+        # refresh_rollups.py 按 (created_at, id) 水位增量扫描
+        Index("ix_reflection_responses_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_answer_id = Column(Integer, ForeignKey("user_answers.id"), nullable=False, unique=True)
@@ -167,9 +230,142 @@ class ReflectionResponse(Base):
     # LLM feedback
     llm_explanation = Column(Text)
     llm_suggestion = Column(Text)
+    llm_status = Column(String(20), default="ready")  # "pending", "ready"
+    llm_prompt_version = Column(Integer)  # 生成解释所用的 PROMPT_VERSION，回退内容为 NULL
     
     created_at = Column(DateTime, server_default=func.now())
     completed_at = Column(DateTime)
     
     # Relationships
-    user_answer = relationship("UserAnswer", back_populates="reflection_response")
\ No newline at end of file
+    user_answer = relationship("UserAnswer", back_populates="reflection_response")
+
+class LLMExplanationCache(Base):
+    """
+    LLM 生成的错因解释缓存
+
+    相同的题目 + 复盘选择 + 诊断结果会得到完全相同的 prompt，
+    以 prompt 输入的稳定哈希为主键缓存 Gemini 的输出。
+    """
+
+    __tablename__ = "llm_explanation_cache"
+
+    fingerprint = Column(String(64), primary_key=True)  # sha256 hex
+    question_id = Column(Integer, ForeignKey("questions.id"))
+    error_level = Column(String(20))
+    prompt_version = Column(Integer)
+    llm_explanation = Column(Text, nullable=False)
+    llm_suggestion = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    last_used_at = Column(DateTime, server_default=func.now())
+
+class PrecomputedExplanation(Base):
+    """
+    离线预生成的错因解释矩阵
+
+    每道题的复盘选项是有限的，规则引擎把每种组合映射到五个层级之一。
+    precompute_explanations.py 遍历所有可达的
+    (题目, 所选选项, error_level, error_type, 关键 choice) 路径并预先生成解释，
+    提交复盘时没有自由输入就直接查表，不再实时调用 Gemini。
+    """
+
+    __tablename__ = "precomputed_explanations"
+    __table_args__ = (
+        UniqueConstraint(
+            "question_id", "selected_option_id", "error_level", "error_type", "salient_choice_id",
+            name="uq_precomputed_explanation_path"
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    selected_option_id = Column(Integer, ForeignKey("options.id"), nullable=False)
+    error_level = Column(String(20), nullable=False)
+    error_type = Column(String(100), nullable=False)
+    # 决定该层级诊断的那一步的 choice（level_1: step1, level_2: step2, level_3: step3,
+    # level_4: step4A 或 step4B）；level_5 没有关键 choice，为 NULL
+    salient_choice_id = Column(Integer, ForeignKey("reflection_choices.id"))
+    prompt_version = Column(Integer, nullable=False)
+    llm_explanation = Column(Text, nullable=False)
+    llm_suggestion = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+class UserErrorProfile(Base):
+    """
+    学生错误画像（每个用户一行的汇总）
+
+    提交复盘时在同一事务中增量更新（见 app/services/error_profile.py），
+    GET /api/users/{id}/profile 只需按主键读取一行；rebuild_profiles.py 可从历史记录全量重建。
+    """
+
+    __tablename__ = "user_error_profile"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_reflections = Column(Integer, nullable=False, default=0)
+    level_counts = Column(JSON, nullable=False, default=dict)  # {"level_1": 3, ...}
+    type_counts = Column(JSON, nullable=False, default=dict)  # {"定位词识别错误": 2, ...}
+    # 最近 N 次复盘的诊断（旧 -> 新）及其层级分布
+    trajectory = Column(JSON, nullable=False, default=list)
+    recent_level_counts = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class QuestionRollup(Base):
+    """
+    教师端 Dashboard 的题目级汇总（按班级）
+
+    cohort 为 ALL_COHORTS 的行是全部学生的汇总。由 refresh_rollups.py 从
+    user_answers / reflection_responses 按创建时间水位增量累加，Dashboard 只读这张表。
+    *_counts 列的 key 是 option / reflection choice 的 id（JSON key 为字符串）。
+    """
+
+    __tablename__ = "question_rollups"
+
+    cohort = Column(String(50), primary_key=True)
+    question_id = Column(Integer, ForeignKey("questions.id"), primary_key=True)
+    answer_count = Column(Integer, nullable=False, default=0)
+    correct_count = Column(Integer, nullable=False, default=0)
+    reflection_count = Column(Integer, nullable=False, default=0)
+    level_counts = Column(JSON, nullable=False, default=dict)  # {"level_1": 3, ...}
+    wrong_option_counts = Column(JSON, nullable=False, default=dict)  # {"<option_id>": n}
+    step1_wrong_counts = Column(JSON, nullable=False, default=dict)  # {"<choice_id>": n}
+    step2_wrong_counts = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class CohortRollup(Base):
+    """教师端 Dashboard 的班级级汇总（cohort 为 ALL_COHORTS 的行是全部学生）"""
+
+    __tablename__ = "cohort_rollups"
+
+    cohort = Column(String(50), primary_key=True)
+    answer_count = Column(Integer, nullable=False, default=0)
+    correct_count = Column(Integer, nullable=False, default=0)
+    reflection_count = Column(Integer, nullable=False, default=0)
+    level_counts = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class RollupWatermark(Base):
+    """汇总表已经累加到的位置：每个来源表一行，记录最后处理的 (created_at, id)"""
+
+    __tablename__ = "rollup_watermarks"
+
+    source = Column(String(50), primary_key=True)  # "user_answers" / "reflection_responses"
+    last_created_at = Column(DateTime)
+    last_id = Column(Integer, nullable=False, default=0)
+    covered_until = Column(DateTime)  # 最近一次刷新的截止时间：此前创建的行都已汇总
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class ContentVersion(Base):
+    """
+    题库内容版本号（只有一行）：导入脚本写入题库后递增，
+    各 API 进程据此清空自己的内容缓存（见 app/services/content_version.py）
+    """
+
+    __tablename__ = "content_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
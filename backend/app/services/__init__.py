@@ -3,11 +3,24 @@ Services module for TOEFL diagnosis system
 Contains rule engine and LLM integration
 """
 
-from .rule_engine import ErrorDiagnoser, DiagnosisResult
-from .gemini_service import generate_diagnosis_explanation
+from .rule_engine import (
+    ErrorDiagnoser, DiagnosisResult, ChoiceSnapshot, SentenceSnapshot,
+    load_choice_snapshot, load_correct_choices
+)
+from .gemini_service import (
+    generate_diagnosis_explanation, generate_diagnosis_explanation_async,
+    stream_diagnosis_explanation, get_llm_status
+)
 
 __all__ = [
     'ErrorDiagnoser',
     'DiagnosisResult',
-    'generate_diagnosis_explanation'
+    'ChoiceSnapshot',
+    'SentenceSnapshot',
+    'load_choice_snapshot',
+    'load_correct_choices',
+    'generate_diagnosis_explanation',
+    'generate_diagnosis_explanation_async',
+    'stream_diagnosis_explanation',
+    'get_llm_status'
 ]
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+In-memory answer key for TOEFL Reading Error Diagnosis
+
+判分只需要每道题的正确选项和合法选项集合，这些数据只在导入题库时变化。
+AnswerKeyIndex 用一条查询把全部选项加载成
+question_id -> AnswerKeyEntry 的字典，submit_answer 判分时只做字典查找，
+唯一的数据库操作是插入 UserAnswer。
+
+- 应用启动时预加载（见 app/main.py），未加载时在第一次查询时加载
+- 题库写入后 `invalidate_content_caches()` 会让索引在下次查询时重新加载；
+  其他进程写入时，本进程检查到内容版本号变化后同样标记索引过期
+- 其他进程导入的新题：查不到题目时（距上次加载超过 miss_reload_interval 秒）
+  立即重新加载一次；此外索引在 ttl 秒后过期
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.models import Option
+
+
+@dataclass(frozen=True)
+class AnswerKeyEntry:
+    """一道题的答案：正确选项和全部合法选项"""
+    question_id: int
+    correct_option_id: int
+    correct_option_label: str
+    option_ids: FrozenSet[int]
+
+
+class AnswerKeyIndex:
+    """
+    线程安全的答案索引
+
+    重新加载时整体替换字典，读取方不需要加锁。
+    """
+
+    def __init__(self, ttl: float, miss_reload_interval: float):
+        self.ttl = ttl
+        self.miss_reload_interval = miss_reload_interval
+        self._entries: Mapping[int, AnswerKeyEntry] = MappingProxyType({})
+        self._loaded_at = 0.0
+        self._stale = True
+        # invalidate() 的次数：加载期间发生的失效不会被这次加载清除
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.lookups = 0
+
+    def load(self, db: Session) -> int:
+        """从数据库加载全部题目的答案，返回题目数"""
+        with self._lock:
+            generation = self._generation
+        rows = db.query(
+            Option.id, Option.question_id, Option.option_label, Option.is_correct
+        ).all()
+
+        option_ids = {}
+        correct = {}
+        for option_id, question_id, label, is_correct in rows:
+            option_ids.setdefault(question_id, set()).add(option_id)
+            if is_correct:
+                correct[question_id] = (option_id, label)
+
+        entries = {
+            question_id: AnswerKeyEntry(
+                question_id=question_id,
+                correct_option_id=correct[question_id][0],
+                correct_option_label=correct[question_id][1],
+                option_ids=frozenset(ids),
+            )
+            for question_id, ids in option_ids.items()
+            if question_id in correct
+        }
+        with self._lock:
+            self._entries = MappingProxyType(entries)
+            self._loaded_at = time.monotonic()
+            # 读取期间又有 invalidate()：读到的可能是旧数据，保持过期状态
+            self._stale = self._generation != generation
+            self.loads += 1
+        return len(entries)
+
+    def get(self, question_id: int, db: Session) -> Optional[AnswerKeyEntry]:
+        """返回题目的答案；索引过期或未命中时按需从数据库重新加载"""
+        with self._lock:
+            self.lookups += 1
+            age = time.monotonic() - self._loaded_at
+            needs_load = self._stale or (self.ttl > 0 and age > self.ttl)
+        if needs_load:
+            self.load(db)
+            age = 0.0
+
+        entry = self._entries.get(question_id)
+        if entry is None and not needs_load and age > self.miss_reload_interval:
+            self.load(db)
+            entry = self._entries.get(question_id)
+        return entry
+
+    def invalidate(self) -> None:
+        """标记索引过期，下次查询时重新加载"""
+        with self._lock:
+            self._stale = True
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "questions": len(self._entries),
+                "loads": self.loads,
+                "lookups": self.lookups,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 3) if self.loads else None,
+                "ttl": self.ttl,
+            }
+
+
+answer_key_index = AnswerKeyIndex(
+    ttl=float(os.getenv("ANSWER_KEY_TTL", "600")),
+    miss_reload_interval=float(os.getenv("ANSWER_KEY_MISS_RELOAD_SECONDS", "5")),
+)
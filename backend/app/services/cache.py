@@ -0,0 +1,173 @@
+"""
+In-process caches for TOEFL Reading Error Diagnosis
+
+题目、文章、选项等内容只在导入题库时才会变化，但每次页面访问都要
+查询数据库。这里提供一个有界的 LRU + TTL 缓存，用于缓存已经构建好的
+响应 payload，并在内容写入后显式失效。
+
+缓存的是已经序列化的响应体（CachedPayload），ETag 在写入缓存时按内容哈希
+计算一次，命中时既不需要重新序列化，也可以直接用 If-None-Match 返回 304。
+
+注意：缓存是进程内的。`init_database.py` / `seed_questions.py` 等脚本在写入后
+调用 `invalidate_content_caches()`，它除了清空本进程的缓存，还会递增数据库中的
+内容版本号；已经在运行的 API 进程检查到版本变化后清空自己的缓存
+（见 app/services/content_version.py），TTL 只是兜底。
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+from pydantic import BaseModel
+
+# 内容类响应的 Cache-Control max-age（秒）；过期后浏览器 / 反向代理用 ETag 重新验证
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "300"))
+
+
+@dataclass(frozen=True)
+class CachedPayload:
+    """已序列化的 JSON 响应体及其强 ETag（内容的 SHA-256）"""
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_model(cls, model: BaseModel) -> "CachedPayload":
+        body = model.model_dump_json().encode("utf-8")
+        return cls(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+class TTLCache:
+    """
+    线程安全的有界 LRU 缓存，条目在 ttl 秒后过期
+
+    - maxsize: 最多保留的条目数，超出时淘汰最久未使用的条目
+    - ttl: 条目存活秒数，<= 0 表示永不过期
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """返回缓存值；未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """写入缓存，必要时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0.0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """失效单个条目；不传 key 时清空整个缓存"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        """命中/未命中计数，用于监控"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 题目 payload 缓存：question_id -> (QuestionOut, QuestionSlimOut) 的 CachedPayload
+question_cache = TTLCache(
+    maxsize=int(os.getenv("QUESTION_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("QUESTION_CACHE_TTL", "600")),
+)
+
+# 文章 payload 缓存：passage_id -> PassageOut 的 CachedPayload
+passage_cache = TTLCache(
+    maxsize=int(os.getenv("PASSAGE_CACHE_SIZE", "128")),
+    ttl=float(os.getenv("PASSAGE_CACHE_TTL", "600")),
+)
+
+# 复盘步骤 payload 缓存：(question_id, selected_option_id) -> ReflectionStepsOut 的 CachedPayload
+# （同一题选择同一错误选项的所有答题记录共享同一份复盘内容）
+reflection_steps_cache = TTLCache(
+    maxsize=int(os.getenv("REFLECTION_STEPS_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("REFLECTION_STEPS_CACHE_TTL", "600")),
+)
+
+# 预生成解释矩阵缓存：question_id -> {路径键: (explanation, suggestion)}
+precomputed_cache = TTLCache(
+    maxsize=int(os.getenv("PRECOMPUTED_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("PRECOMPUTED_CACHE_TTL", "600")),
+)
+
+
+def invalidate_content_caches() -> None:
+    """
+    题库内容（文章/题目/选项/复盘步骤）写入并提交后调用：清空本进程的内容缓存，
+    并递增数据库中的内容版本号，通知其他 API 进程
+    """
+    from app.services.content_version import bump_content_version
+
+    clear_local_content_caches()
+    bump_content_version()
+
+
+def clear_local_content_caches() -> None:
+    """清空本进程的所有内容缓存和索引"""
+    from app.services.answer_key import answer_key_index
+    from app.services.recommender import question_feature_index
+
+    question_cache.invalidate()
+    passage_cache.invalidate()
+    reflection_steps_cache.invalidate()
+    precomputed_cache.invalidate()
+    answer_key_index.invalidate()
+    question_feature_index.invalidate()
+
+
+def content_cache_stats() -> dict:
+    """汇总所有内容缓存的命中统计"""
+    from app.services.answer_key import answer_key_index
+    from app.services.content_version import content_version_watcher
+    from app.services.recommender import question_feature_index
+
+    return {
+        "question_cache": question_cache.stats(),
+        "passage_cache": passage_cache.stats(),
+        "reflection_steps_cache": reflection_steps_cache.stats(),
+        "precomputed_cache": precomputed_cache.stats(),
+        "answer_key": answer_key_index.stats(),
+        "question_features": question_feature_index.stats(),
+        "content_version": content_version_watcher.stats(),
+    }
@@ -0,0 +1,473 @@
+"""
+Bulk content importer for TOEFL Reading Error Diagnosis
+
+把 JSON / JSONL 格式的题库语料批量写入数据库（命令行入口见 import_content.py）。
+
+语料格式：每篇文章一条记录（JSONL 每行一篇；JSON 为文章数组或 {"passages": [...]}），
+字段与 seed_questions.PASSAGES 相同：
+
+    {
+      "key": "可选的稳定键",
+      "title": "...", "content": "...",
+      "questions": [{
+        "key": "可选", "question_type": "factual_information（默认）",
+        "stem": "...", "answer_sentence": "...",
+        "options": [["A", "text", false], ...] 或 [{"label", "text", "is_correct"}, ...],
+        "step1_choices": [["text", true, 1], ...] 或 [{"text", "is_correct", "order"}, ...],
+        ...
+        "step6_choices": [...]
+      }]
+    }
+
+写入前先校验整份语料：每题恰好一个正确选项，步骤 1 / 2 / 3 / 5 恰好一个正确 choice
+（步骤 4 错误选项理由和步骤 6 自我诊断没有标准答案）。
+
+按 content_key upsert：未给出 key 时，文章的键由标题生成，题目的键由文章键和题干生成。
+文章和题目用 INSERT ... ON CONFLICT (content_key) DO UPDATE ... RETURNING 批量写入；
+选项 / 复盘步骤 / choices 按自然键（题目 + 选项标签、题目 + 步骤号、步骤 + choice_order）
+匹配已有的行，已有的批量 UPDATE，新增的批量 INSERT ... RETURNING，
+因此已有答题记录引用的选项和 choice id 保持不变。
+重新导入的题目中不再出现的选项 / choice 会被删除（连同引用它们的预生成解释），
+否则改了正确答案后旧的正确行仍然留在库里；被学生的答题或复盘记录引用的行不能删除，
+此时整批回滚并抛出 ContentValidationError 列出这些行。
+
+每批写入后在同一事务中为这些文章建立句子索引（见 app/services/passage_index.py），
+并把答案句和 Step 2 的 choices 映射到句子。
+"""
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Option, Passage, PrecomputedExplanation, Question, ReflectionChoice, ReflectionResponse,
+    ReflectionStep, UserAnswer
+)
+from app.services.passage_index import SENTENCE_LOCATION_STEP_TYPE, index_sentences
+
+# (step_number, step_type, prompt_text, allow_custom_input)
+REFLECTION_STEP_SPECS = [
+    (1, "keyword_selection",            "请选择你认为的定位词：",                         False),
+    (2, "sentence_location",            "请选择你认为的答案句：",                         False),
+    (3, "sentence_understanding",       "请选择最接近你对答案句理解的选项：",              True),
+    (4, "wrong_option_understanding",   "请选择最接近你当时选择错误选项的理由：",          True),
+    (5, "correct_option_understanding", "正确答案是：请选择最接近你现在理解的选项：",      True),
+    (6, "self_diagnosis",               "回顾你的解题过程，你认为主要错在：",              True),
+]
+
+# 有唯一正确 choice 的步骤
+GRADED_STEPS = (1, 2, 3, 5)
+
+# choice 是文章句子的步骤（Step 2）
+SENTENCE_LOCATION_STEP = next(
+    number for number, step_type, _, _ in REFLECTION_STEP_SPECS if step_type == SENTENCE_LOCATION_STEP_TYPE
+)
+
+
+class ContentValidationError(ValueError):
+    """语料校验失败，errors 为带位置的错误信息列表"""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__(f"语料校验失败（{len(errors)} 处错误）：" + "；".join(errors[:5]))
+
+
+def passage_content_key(title: str) -> str:
+    """文章的默认稳定键：标题的哈希"""
+    return hashlib.sha256(f"passage\n{title.strip()}".encode("utf-8")).hexdigest()[:32]
+
+
+def question_content_key(passage_key: str, stem: str) -> str:
+    """题目的默认稳定键：文章键 + 题干的哈希"""
+    return hashlib.sha256(f"question\n{passage_key}\n{stem.strip()}".encode("utf-8")).hexdigest()[:32]
+
+
+# ---------------------------------------------------------------------------
+# Loading and validation
+# ---------------------------------------------------------------------------
+
+def load_corpus(path: str) -> List[dict]:
+    """读取 .json / .jsonl 语料文件，返回文章记录列表"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = []
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError as e:
+                        raise ContentValidationError([f"第 {line_no} 行: JSON 格式错误 ({e.msg})"])
+            return records
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("passages", [])
+    if not isinstance(data, list):
+        raise ContentValidationError(["JSON 语料必须是文章数组或 {\"passages\": [...]}"])
+    return data
+
+
+def validate_corpus(records: Iterable[dict]) -> List[dict]:
+    """
+    校验并规范化全部文章记录；有任何错误时抛出 ContentValidationError（列出所有错误）
+    """
+    errors: List[str] = []
+    passages = []
+    seen_passages = set()
+    seen_questions = set()
+    for index, record in enumerate(records, start=1):
+        where = f"文章 #{index}"
+        passage = _normalize_passage(record, where, errors)
+        if passage is None:
+            continue
+        if passage["key"] in seen_passages:
+            errors.append(f"{where}: content_key 重复 ({passage['key']})")
+        seen_passages.add(passage["key"])
+        for q_index, question in enumerate(passage["questions"], start=1):
+            if question["key"] in seen_questions:
+                errors.append(f"{where} 题目 #{q_index}: content_key 重复 ({question['key']})")
+            seen_questions.add(question["key"])
+        passages.append(passage)
+    if errors:
+        raise ContentValidationError(errors)
+    return passages
+
+
+def _text(value) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+def _normalize_passage(record, where: str, errors: List[str]) -> Optional[dict]:
+    if not isinstance(record, dict):
+        errors.append(f"{where}: 记录必须是 JSON 对象")
+        return None
+    title, content = _text(record.get("title")), _text(record.get("content"))
+    if not title or not content:
+        errors.append(f"{where}: 缺少 title 或 content")
+        return None
+    if len(title) > 200:
+        errors.append(f"{where}: title 超过 200 个字符")
+    key = _text(record.get("key")) or passage_content_key(title)
+    if len(key) > 64:
+        errors.append(f"{where}: key 超过 64 个字符")
+
+    questions_data = record.get("questions")
+    if not isinstance(questions_data, list) or not questions_data:
+        errors.append(f"{where}: questions 不能为空")
+        return None
+    questions = []
+    for q_index, q_data in enumerate(questions_data, start=1):
+        question = _normalize_question(q_data, key, f"{where} 题目 #{q_index}", errors)
+        if question is not None:
+            questions.append(question)
+    return {"key": key, "title": title, "content": content, "questions": questions}
+
+
+def _normalize_question(q_data, passage_key: str, where: str, errors: List[str]) -> Optional[dict]:
+    if not isinstance(q_data, dict):
+        errors.append(f"{where}: 记录必须是 JSON 对象")
+        return None
+    stem = _text(q_data.get("stem"))
+    if not stem:
+        errors.append(f"{where}: 缺少 stem")
+        return None
+    key = _text(q_data.get("key")) or question_content_key(passage_key, stem)
+    if len(key) > 64:
+        errors.append(f"{where}: key 超过 64 个字符")
+
+    options = []
+    for item in q_data.get("options") or []:
+        if isinstance(item, dict):
+            item = (item.get("label"), item.get("text"), item.get("is_correct", False))
+        if not isinstance(item, (list, tuple)) or len(item) != 3:
+            errors.append(f"{where}: 选项格式错误 {item!r}")
+            continue
+        label, text, is_correct = item
+        if not isinstance(label, str) or len(label) != 1 or not _text(text):
+            errors.append(f"{where}: 选项标签必须是单个字母且文本不能为空 {item!r}")
+            continue
+        options.append((label, _text(text), bool(is_correct)))
+    labels = [label for label, _, _ in options]
+    if len(options) < 2:
+        errors.append(f"{where}: 至少需要 2 个选项")
+    if len(set(labels)) != len(labels):
+        errors.append(f"{where}: 选项标签重复")
+    correct_count = sum(is_correct for _, _, is_correct in options)
+    if correct_count != 1:
+        errors.append(f"{where}: 必须恰好有一个正确选项（当前 {correct_count} 个）")
+
+    steps = {}
+    for step_number, _, _, _ in REFLECTION_STEP_SPECS:
+        step_where = f"{where} step{step_number}"
+        choices = []
+        for order, item in enumerate(q_data.get(f"step{step_number}_choices") or [], start=1):
+            if isinstance(item, dict):
+                item = (item.get("text"), item.get("is_correct", False), item.get("order", order))
+            if not isinstance(item, (list, tuple)) or len(item) != 3 or not _text(item[0]):
+                errors.append(f"{step_where}: choice 格式错误 {item!r}")
+                continue
+            text, is_correct, choice_order = item
+            if not isinstance(choice_order, int):
+                errors.append(f"{step_where}: choice_order 必须是整数 {item!r}")
+                continue
+            choices.append((_text(text), bool(is_correct), choice_order))
+        orders = [order for _, _, order in choices]
+        if not choices:
+            errors.append(f"{step_where}: 缺少 choices")
+        elif len(set(orders)) != len(orders):
+            errors.append(f"{step_where}: choice_order 重复")
+        if step_number in GRADED_STEPS:
+            correct_count = sum(is_correct for _, is_correct, _ in choices)
+            if correct_count != 1:
+                errors.append(f"{step_where}: 必须恰好有一个正确 choice（当前 {correct_count} 个）")
+        steps[step_number] = choices
+
+    return {
+        "key": key,
+        "question_type": _text(q_data.get("question_type")) or "factual_information",
+        "stem": stem,
+        "answer_sentence": _text(q_data.get("answer_sentence")) or None,
+        "options": options,
+        "steps": steps,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ImportStats:
+    """导入统计：各表写入的行数（插入 + 更新）和耗时"""
+    rows: Dict[str, int] = field(default_factory=lambda: {
+        "passages": 0, "questions": 0, "options": 0, "reflection_steps": 0, "reflection_choices": 0,
+        "passage_sentences": 0,
+    })
+    seconds: float = 0.0
+    question_ids: List[int] = field(default_factory=list)
+
+    @property
+    def total_rows(self) -> int:
+        return sum(self.rows.values())
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total_rows / self.seconds if self.seconds else 0.0
+
+
+def import_passages(
+    db: Session,
+    passages: List[dict],
+    batch_size: int = 100,
+    on_batch: Optional[Callable[[int, ImportStats], None]] = None
+) -> ImportStats:
+    """
+    写入已校验的文章（validate_corpus 的结果），每 batch_size 篇文章一个事务
+
+    每批提交一次，中途失败时已提交的批次保留；按 content_key upsert，重新运行是安全的。
+    on_batch(已处理文章数, stats) 在每批提交后调用，可用于打印进度。
+    """
+    stats = ImportStats()
+    started = time.perf_counter()
+    for start in range(0, len(passages), batch_size):
+        batch = passages[start:start + batch_size]
+        try:
+            _import_batch(db, batch, stats)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        stats.seconds = time.perf_counter() - started
+        if on_batch:
+            on_batch(start + len(batch), stats)
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def _dialect_insert(db: Session):
+    """ON CONFLICT 需要方言专用的 insert()"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise RuntimeError(f"import_content 不支持的数据库: {dialect}")
+    return dialect_insert
+
+
+def _upsert_by_key(db: Session, model, rows: List[dict], update_columns: Tuple[str, ...]) -> Dict[str, int]:
+    """按 content_key 批量 upsert，返回 content_key -> id"""
+    dialect_insert = _dialect_insert(db)
+    statement = dialect_insert(model)
+    statement = statement.on_conflict_do_update(
+        index_elements=["content_key"],
+        set_={column: getattr(statement.excluded, column) for column in update_columns}
+    ).returning(model.id, model.content_key)
+    return {content_key: row_id for row_id, content_key in db.execute(statement, rows)}
+
+
+# 引用选项 / choice 的列：学生数据（被引用的行不能删除）和可重新生成的派生数据（随之删除）
+CHILD_REFERENCES = {
+    Option: ([UserAnswer.selected_option_id], [PrecomputedExplanation.selected_option_id]),
+    ReflectionChoice: (
+        [
+            ReflectionResponse.step1_choice_id, ReflectionResponse.step2_choice_id,
+            ReflectionResponse.step3_choice_id, ReflectionResponse.step4a_choice_id,
+            ReflectionResponse.step4b_choice_id, ReflectionResponse.step5_choice_id,
+        ],
+        [PrecomputedExplanation.salient_choice_id],
+    ),
+}
+
+
+def _sync_children(db: Session, model, parent_column, natural_column, parent_ids, rows: List[dict]):
+    """
+    按 (父 id, 自然键) 写入子表：已有的行批量 UPDATE（保留 id），新行批量 INSERT ... RETURNING，
+    本次没有出现的已有行删除（见 _delete_stale_children）
+
+    返回 (父 id, 自然键) -> id
+    """
+    parent_key, natural_key = parent_column.key, natural_column.key
+    ids = {
+        (parent_id, natural): row_id
+        for row_id, parent_id, natural in db.query(model.id, parent_column, natural_column)
+        .filter(parent_column.in_(parent_ids))
+    }
+    stale = dict(ids)
+    for row in rows:
+        stale.pop((row[parent_key], row[natural_key]), None)
+    if stale:
+        _delete_stale_children(db, model, stale)
+        for natural in stale:
+            del ids[natural]
+
+    updates, inserts = [], []
+    for row in rows:
+        row_id = ids.get((row[parent_key], row[natural_key]))
+        if row_id is None:
+            inserts.append(row)
+        else:
+            updates.append({"id": row_id, **row})
+    if updates:
+        db.execute(update(model), updates)
+    if inserts:
+        statement = insert(model).returning(model.id, parent_column, natural_column)
+        for row_id, parent_id, natural in db.execute(statement, inserts):
+            ids[(parent_id, natural)] = row_id
+    return ids
+
+
+def _delete_stale_children(db: Session, model, stale: Dict[tuple, int]) -> None:
+    """
+    删除语料中已不存在的选项 / choice；仍被学生数据引用时抛出 ContentValidationError
+
+    stale: (父 id, 自然键) -> id
+    """
+    student_columns, derived_columns = CHILD_REFERENCES.get(model, ([], []))
+    stale_ids = list(stale.values())
+    referenced = set()
+    for column in student_columns:
+        referenced.update(
+            row_id for row_id, in db.query(column).filter(column.in_(stale_ids)).distinct()
+        )
+    if referenced:
+        raise ContentValidationError([
+            f"{model.__tablename__} id={row_id}（父 id={parent_id}, {natural!r}）已从语料中删除，"
+            f"但仍被学生的答题或复盘记录引用"
+            for (parent_id, natural), row_id in sorted(stale.items(), key=lambda item: item[1])
+            if row_id in referenced
+        ])
+    for column in derived_columns:
+        db.execute(delete(column.class_).where(column.in_(stale_ids)))
+    db.execute(delete(model).where(model.id.in_(stale_ids)))
+
+
+def _import_batch(db: Session, batch: List[dict], stats: ImportStats) -> None:
+    passage_ids = _upsert_by_key(db, Passage, [
+        {"content_key": p["key"], "title": p["title"], "content": p["content"]} for p in batch
+    ], ("title", "content"))
+
+    questions = [(passage_ids[p["key"]], q) for p in batch for q in p["questions"]]
+    question_ids = _upsert_by_key(db, Question, [
+        {
+            "content_key": q["key"],
+            "passage_id": passage_id,
+            "question_type": q["question_type"],
+            "stem": q["stem"],
+            "answer_sentence": q["answer_sentence"],
+        }
+        for passage_id, q in questions
+    ], ("passage_id", "question_type", "stem", "answer_sentence"))
+    stats.rows["passages"] += len(passage_ids)
+    stats.rows["questions"] += len(question_ids)
+
+    option_rows = [
+        {"question_id": question_ids[q["key"]], "option_label": label, "option_text": text, "is_correct": is_correct}
+        for _, q in questions for label, text, is_correct in q["options"]
+    ]
+    option_ids = _sync_children(
+        db, Option, Option.question_id, Option.option_label, list(question_ids.values()), option_rows
+    )
+    stats.rows["options"] += len(option_rows)
+
+    # 题目的 correct_option_id 指向本次写入的正确选项
+    db.execute(update(Question), [
+        {
+            "id": question_ids[q["key"]],
+            "correct_option_id": option_ids[(question_ids[q["key"]], next(
+                label for label, _, is_correct in q["options"] if is_correct
+            ))],
+        }
+        for _, q in questions
+    ])
+
+    step_rows = [
+        {
+            "question_id": question_ids[q["key"]],
+            "step_number": step_number,
+            "step_type": step_type,
+            "prompt_text": prompt_text,
+            "allow_custom_input": allow_custom_input,
+        }
+        for _, q in questions for step_number, step_type, prompt_text, allow_custom_input in REFLECTION_STEP_SPECS
+    ]
+    step_ids = _sync_children(
+        db, ReflectionStep, ReflectionStep.question_id, ReflectionStep.step_number,
+        list(question_ids.values()), step_rows
+    )
+    stats.rows["reflection_steps"] += len(step_rows)
+
+    choice_rows = [
+        {
+            "reflection_step_id": step_ids[(question_ids[q["key"]], step_number)],
+            "choice_text": text,
+            "is_correct": is_correct,
+            "choice_order": order,
+        }
+        for _, q in questions for step_number, choices in q["steps"].items()
+        for text, is_correct, order in choices
+    ]
+    choice_ids = _sync_children(
+        db, ReflectionChoice, ReflectionChoice.reflection_step_id, ReflectionChoice.choice_order,
+        list(step_ids.values()), choice_rows
+    )
+    stats.rows["reflection_choices"] += len(choice_rows)
+
+    # 句子索引：答案句和 Step 2 choices 映射到文章中的句子
+    stats.rows["passage_sentences"] += index_sentences(
+        db,
+        {passage_ids[p["key"]]: p["content"] for p in batch},
+        [(question_ids[q["key"]], passage_id, q["answer_sentence"]) for passage_id, q in questions],
+        [
+            (choice_ids[(step_ids[(question_ids[q["key"]], SENTENCE_LOCATION_STEP)], order)], passage_id, text)
+            for passage_id, q in questions
+            for text, _, order in q["steps"].get(SENTENCE_LOCATION_STEP, [])
+        ],
+    )
+
+    stats.question_ids.extend(question_ids.values())
@@ -0,0 +1,125 @@
+"""
+Cross-process content version
+
+内容缓存、答案索引和推荐特征索引都是进程内的，而题库由 `import_content.py` /
+`seed_questions.py` 等脚本在另一个进程里写入。脚本提交后递增数据库里的
+content_version（单行表），每个 API 进程的 ContentVersionWatcher 在请求到来时
+最多每 interval 秒读一次这个版本号，发现变化就清空本进程的内容缓存。
+
+- 没到检查时间的请求只比较一次 time.monotonic()，不访问数据库
+- 内容变更对运行中的 API 最多延迟 interval 秒可见（CONTENT_VERSION_CHECK_SECONDS，
+  <= 0 表示不检查，只依赖各缓存的 TTL）
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy.sql import func
+
+from app.core.database import SessionLocal
+from app.models.models import ContentVersion
+
+CONTENT_VERSION_ROW_ID = 1
+
+
+def read_content_version() -> Optional[int]:
+    """当前内容版本号；content_version 表中没有这一行时返回 None"""
+    db = SessionLocal()
+    try:
+        return db.query(ContentVersion.version).filter(
+            ContentVersion.id == CONTENT_VERSION_ROW_ID
+        ).scalar()
+    finally:
+        db.close()
+
+
+def bump_content_version() -> int:
+    """递增内容版本号（原子 UPDATE，多个脚本同时写入也不会丢失），返回新版本号"""
+    db = SessionLocal()
+    try:
+        updated = db.query(ContentVersion).filter(
+            ContentVersion.id == CONTENT_VERSION_ROW_ID
+        ).update(
+            {ContentVersion.version: ContentVersion.version + 1, ContentVersion.updated_at: func.now()},
+            synchronize_session=False
+        )
+        if not updated:
+            # 用 init_db() / create_all 建的库没有迁移 0013 插入的那一行
+            db.add(ContentVersion(id=CONTENT_VERSION_ROW_ID, version=1))
+        db.commit()
+        return db.query(ContentVersion.version).filter(
+            ContentVersion.id == CONTENT_VERSION_ROW_ID
+        ).scalar()
+    finally:
+        db.close()
+
+
+class ContentVersionWatcher:
+    """
+    按间隔检查内容版本号，变化时调用 on_change 清空本进程的缓存
+
+    第一次检查只记录版本号（启动时缓存本来就是空的）。
+    """
+
+    def __init__(self, interval: float, on_change: Callable[[], None]):
+        self.interval = interval
+        self.on_change = on_change
+        self._version: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.changes = 0
+
+    def due(self) -> bool:
+        """是否到了下一次检查时间（不访问数据库）"""
+        if self.interval <= 0:
+            return False
+        checked_at = self._checked_at
+        return checked_at is None or time.monotonic() - checked_at >= self.interval
+
+    def check(self) -> bool:
+        """读取数据库中的版本号，返回是否发生变化（并已清空缓存）"""
+        with self._lock:
+            # 并发请求可能同时判断 due()，只让第一个去查数据库
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.interval:
+                return False
+            self._checked_at = time.monotonic()
+        try:
+            version = read_content_version()
+        except Exception as e:
+            # 数据库尚未迁移到 0013 等情况：下一个间隔再试
+            print(f"⚠️ 读取内容版本号失败: {e}")
+            return False
+
+        with self._lock:
+            self.checks += 1
+            changed = self._version is not None and version != self._version
+            self._version = version
+            if changed:
+                self.changes += 1
+        if changed:
+            print(f"🔄 题库内容版本变为 {version}，清空内容缓存")
+            self.on_change()
+        return changed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self._version,
+                "interval": self.interval,
+                "checks": self.checks,
+                "changes": self.changes,
+            }
+
+
+def _clear_content_caches() -> None:
+    from app.services.cache import clear_local_content_caches
+    clear_local_content_caches()
+
+
+content_version_watcher = ContentVersionWatcher(
+    interval=float(os.getenv("CONTENT_VERSION_CHECK_SECONDS", "2")),
+    on_change=_clear_content_caches,
+)
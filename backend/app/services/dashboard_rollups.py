@@ -0,0 +1,367 @@
+"""
+Teacher dashboard rollups for TOEFL Reading Error Diagnosis
+
+教师端 Dashboard 需要按题目 / 按班级的聚合：答题数与正确率、错误层级分布、
+最常选的错误选项、Step 1 / Step 2 最常见的错误 choice。每次打开页面都对
+user_answers / reflection_responses 做 GROUP BY 的代价随历史增长，
+这里改为维护汇总表（question_rollups / cohort_rollups），Dashboard 只按主键分页读取。
+
+refresh_rollups 按来源表的 (created_at, id) 水位增量累加：
+- 每批按 (created_at, id) 顺序读取水位之后的 batch_size 行，在内存中聚合后
+  合并进汇总行，并在同一事务中推进水位；中途失败重跑不会重复计数
+- 只处理 created_at 早于 "数据库当前时间 - ROLLUP_SAFETY_LAG_SECONDS" 的行：
+  created_at 取自事务开始时间，较晚提交的长事务可能写入比水位更早的时间，
+  安全延迟内的行留到下一次刷新
+- 水位行加行锁，多个刷新进程同时运行也不会重复计数（新建汇总行冲突时本批回滚，重跑即可）
+- 覆盖提交的复盘会删除旧记录并新增一条：删除前由 remove_reflection_from_rollups
+  扣除旧记录已累加的计数（水位之后的旧记录尚未计入，不需要扣除）
+
+已知限制（需要时用 --full 全量重建）：
+- 用户更换班级后，历史记录仍计在原班级（覆盖提交的复盘按当前班级扣除）
+"""
+
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import DateTime, and_, delete, func, literal, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    CohortRollup, QuestionRollup, ReflectionResponse, RollupWatermark, User, UserAnswer
+)
+
+# 汇总全部学生的 cohort 键；没有设置班级的学生计入 UNASSIGNED_COHORT
+ALL_COHORTS = "__all__"
+UNASSIGNED_COHORT = "unassigned"
+
+# 只汇总创建时间早于 now - lag 的行，避免漏掉较晚提交的事务
+ROLLUP_SAFETY_LAG_SECONDS = int(os.getenv("ROLLUP_SAFETY_LAG_SECONDS", "60"))
+
+
+@dataclass
+class RollupDelta:
+    """一批记录对一个汇总行的增量"""
+    answer_count: int = 0
+    correct_count: int = 0
+    reflection_count: int = 0
+    level_counts: Counter = field(default_factory=Counter)
+    wrong_option_counts: Counter = field(default_factory=Counter)
+    step1_wrong_counts: Counter = field(default_factory=Counter)
+    step2_wrong_counts: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class RefreshStats:
+    """一次刷新处理的行数（按来源表）与耗时"""
+    rows: Dict[str, int] = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def total_rows(self) -> int:
+        return sum(self.rows.values())
+
+
+def _cohorts(cohort: Optional[str]) -> Tuple[str, str]:
+    return (cohort or UNASSIGNED_COHORT, ALL_COHORTS)
+
+
+def _accumulate_answers(rows: Iterable[tuple], questions: dict, cohorts: dict) -> None:
+    for question_id, cohort, is_correct, selected_option_id in rows:
+        for key in _cohorts(cohort):
+            for delta in (questions.setdefault((key, question_id), RollupDelta()),
+                          cohorts.setdefault(key, RollupDelta())):
+                delta.answer_count += 1
+                if is_correct:
+                    delta.correct_count += 1
+                else:
+                    delta.wrong_option_counts[str(selected_option_id)] += 1
+
+
+def _accumulate_reflections(rows: Iterable[tuple], questions: dict, cohorts: dict) -> None:
+    for question_id, cohort, error_level, step1_choice_id, step1_ok, step2_choice_id, step2_ok in rows:
+        for key in _cohorts(cohort):
+            for delta in (questions.setdefault((key, question_id), RollupDelta()),
+                          cohorts.setdefault(key, RollupDelta())):
+                delta.reflection_count += 1
+                if error_level:
+                    delta.level_counts[error_level] += 1
+                if step1_ok is False and step1_choice_id:
+                    delta.step1_wrong_counts[str(step1_choice_id)] += 1
+                if step2_ok is False and step2_choice_id:
+                    delta.step2_wrong_counts[str(step2_choice_id)] += 1
+
+
+@dataclass(frozen=True)
+class RollupSource:
+    """一个被汇总的来源表：按 (created_at, id) 水位扫描的查询和聚合函数"""
+    name: str
+    id_column: object
+    created_at_column: object
+    statement: Callable[[], object]
+    accumulate: Callable[[Iterable[tuple], dict, dict], None]
+
+
+ROLLUP_SOURCES = [
+    RollupSource(
+        "user_answers", UserAnswer.id, UserAnswer.created_at,
+        lambda: (
+            select(UserAnswer.question_id, User.cohort, UserAnswer.is_correct, UserAnswer.selected_option_id)
+            .join(User, User.id == UserAnswer.user_id)
+        ),
+        _accumulate_answers,
+    ),
+    RollupSource(
+        "reflection_responses", ReflectionResponse.id, ReflectionResponse.created_at,
+        lambda: (
+            select(
+                UserAnswer.question_id, User.cohort, ReflectionResponse.rule_error_level,
+                ReflectionResponse.step1_choice_id, ReflectionResponse.step1_is_correct,
+                ReflectionResponse.step2_choice_id, ReflectionResponse.step2_is_correct
+            )
+            .join(UserAnswer, UserAnswer.id == ReflectionResponse.user_answer_id)
+            .join(User, User.id == UserAnswer.user_id)
+        ),
+        _accumulate_reflections,
+    ),
+]
+
+
+def _locked_watermark(db: Session, source: str) -> RollupWatermark:
+    watermark = db.get(RollupWatermark, source, with_for_update=True, populate_existing=True)
+    if watermark is not None:
+        return watermark
+    try:
+        with db.begin_nested():
+            watermark = RollupWatermark(source=source, last_created_at=None, last_id=0)
+            db.add(watermark)
+    except IntegrityError:
+        watermark = db.get(RollupWatermark, source, with_for_update=True, populate_existing=True)
+    return watermark
+
+
+def _merge_counts(existing: Optional[dict], delta: Counter) -> dict:
+    """返回合并后的新 dict（JSON 列只有重新赋值才会被识别为已修改；扣减到 0 的键被移除）"""
+    merged = Counter(existing or {})
+    merged.update(delta)
+    return {key: count for key, count in merged.items() if count > 0}
+
+
+def _apply(row, delta: RollupDelta, question_level: bool) -> None:
+    row.answer_count = (row.answer_count or 0) + delta.answer_count
+    row.correct_count = (row.correct_count or 0) + delta.correct_count
+    row.reflection_count = (row.reflection_count or 0) + delta.reflection_count
+    row.level_counts = _merge_counts(row.level_counts, delta.level_counts)
+    if question_level:
+        row.wrong_option_counts = _merge_counts(row.wrong_option_counts, delta.wrong_option_counts)
+        row.step1_wrong_counts = _merge_counts(row.step1_wrong_counts, delta.step1_wrong_counts)
+        row.step2_wrong_counts = _merge_counts(row.step2_wrong_counts, delta.step2_wrong_counts)
+
+
+def _merge_deltas(db: Session, questions: Dict[tuple, RollupDelta], cohorts: Dict[str, RollupDelta]) -> None:
+    """把一批增量合并进汇总行（一次 IN 查询取出已有的行，其余新建）"""
+    cohort_keys = list(cohorts)
+    question_ids = sorted({question_id for _, question_id in questions})
+    # populate_existing: 其他刷新进程可能在上一批之后更新过这些行
+    existing_questions = {
+        (row.cohort, row.question_id): row
+        for row in db.scalars(
+            select(QuestionRollup)
+            .where(
+                QuestionRollup.cohort.in_(cohort_keys),
+                QuestionRollup.question_id.in_(question_ids)
+            )
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+    }
+    for (cohort, question_id), delta in questions.items():
+        row = existing_questions.get((cohort, question_id))
+        if row is None:
+            row = QuestionRollup(cohort=cohort, question_id=question_id)
+            db.add(row)
+        _apply(row, delta, question_level=True)
+
+    existing_cohorts = {
+        row.cohort: row
+        for row in db.scalars(
+            select(CohortRollup)
+            .where(CohortRollup.cohort.in_(cohort_keys))
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+    }
+    for cohort, delta in cohorts.items():
+        row = existing_cohorts.get(cohort)
+        if row is None:
+            row = CohortRollup(cohort=cohort)
+            db.add(row)
+        _apply(row, delta, question_level=False)
+
+
+def _timestamp_comparator(db: Session) -> Callable:
+    """
+    created_at 比较表达式
+
+    SQLite 的 CURRENT_TIMESTAMP 存为不带微秒的文本（"2026-01-01 08:00:00"），
+    而绑定的 datetime 参数带微秒（"... 08:00:00.000000"），按文本比较时相等的时间
+    会被判为不等；SQLite 上两侧都用 datetime() 规范化后再比较和排序。
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return lambda value: func.datetime(value)
+    return lambda value: value
+
+
+def _after_watermark(db: Session, source: RollupSource, watermark: RollupWatermark):
+    """来源表中位于水位之后（尚未汇总）的行的条件；从未刷新过时为 None"""
+    if watermark.last_created_at is None:
+        return None
+    ts = _timestamp_comparator(db)
+    created_at = ts(source.created_at_column)
+    last_created_at = ts(literal(watermark.last_created_at, DateTime))
+    return or_(
+        created_at > last_created_at,
+        and_(created_at == last_created_at, source.id_column > watermark.last_id)
+    )
+
+
+def _refresh_source(
+    db: Session,
+    source: RollupSource,
+    cutoff: datetime,
+    batch_size: int,
+    on_batch: Optional[Callable[[str, int], None]]
+) -> int:
+    ts = _timestamp_comparator(db)
+    created_at = ts(source.created_at_column)
+    processed = 0
+    while True:
+        watermark = _locked_watermark(db, source.name)
+        statement = (
+            source.statement()
+            .add_columns(source.created_at_column, source.id_column)
+            .where(created_at <= ts(literal(cutoff, DateTime)))
+            .order_by(created_at, source.id_column)
+            .limit(batch_size)
+        )
+        after_watermark = _after_watermark(db, source, watermark)
+        if after_watermark is not None:
+            statement = statement.where(after_watermark)
+        rows = db.execute(statement).all()
+        if not rows:
+            watermark.covered_until = cutoff
+            db.commit()
+            return processed
+
+        questions: Dict[tuple, RollupDelta] = {}
+        cohorts: Dict[str, RollupDelta] = {}
+        source.accumulate((row[:-2] for row in rows), questions, cohorts)
+        _merge_deltas(db, questions, cohorts)
+        watermark.last_created_at, watermark.last_id = rows[-1][-2], rows[-1][-1]
+        if len(rows) < batch_size:
+            watermark.covered_until = cutoff
+        # 汇总行与水位在同一事务中提交
+        db.commit()
+
+        processed += len(rows)
+        if on_batch:
+            on_batch(source.name, processed)
+        if len(rows) < batch_size:
+            return processed
+
+
+def _negate(delta: RollupDelta) -> RollupDelta:
+    return RollupDelta(
+        answer_count=-delta.answer_count,
+        correct_count=-delta.correct_count,
+        reflection_count=-delta.reflection_count,
+        level_counts=Counter({key: -count for key, count in delta.level_counts.items()}),
+        wrong_option_counts=Counter({key: -count for key, count in delta.wrong_option_counts.items()}),
+        step1_wrong_counts=Counter({key: -count for key, count in delta.step1_wrong_counts.items()}),
+        step2_wrong_counts=Counter({key: -count for key, count in delta.step2_wrong_counts.items()}),
+    )
+
+
+def remove_reflection_from_rollups(db: Session, reflection: ReflectionResponse) -> bool:
+    """
+    从汇总表中扣除一条即将删除（被覆盖）的复盘记录（不提交事务），返回是否扣除
+
+    只有已被汇总（位于水位之前）的记录需要扣除；水位行加锁，
+    与正在运行的刷新进程互斥，避免同一条记录在扣除与累加之间被漏算或重复计算。
+    """
+    source = next(s for s in ROLLUP_SOURCES if s.name == "reflection_responses")
+    watermark = db.get(RollupWatermark, source.name, with_for_update=True, populate_existing=True)
+    if watermark is None:
+        return False
+    after_watermark = _after_watermark(db, source, watermark)
+    if after_watermark is None:
+        return False
+    row = db.execute(
+        source.statement().where(source.id_column == reflection.id, ~after_watermark)
+    ).first()
+    if row is None:
+        return False
+
+    questions: Dict[tuple, RollupDelta] = {}
+    cohorts: Dict[str, RollupDelta] = {}
+    source.accumulate([row], questions, cohorts)
+    _merge_deltas(
+        db,
+        {key: _negate(delta) for key, delta in questions.items()},
+        {key: _negate(delta) for key, delta in cohorts.items()},
+    )
+    return True
+
+
+def reset_rollups(db: Session) -> None:
+    """清空汇总表和水位（下一次刷新从头全量汇总）"""
+    db.execute(delete(QuestionRollup))
+    db.execute(delete(CohortRollup))
+    db.execute(delete(RollupWatermark))
+    db.commit()
+
+
+def refresh_rollups(
+    db: Session,
+    batch_size: int = 5000,
+    lag_seconds: int = ROLLUP_SAFETY_LAG_SECONDS,
+    full: bool = False,
+    on_batch: Optional[Callable[[str, int], None]] = None
+) -> RefreshStats:
+    """
+    把水位之后的新记录累加进汇总表，返回每个来源表处理的行数
+
+    full=True 先清空汇总表再从头汇总（刷新完成前 Dashboard 看到的是部分数据）。
+    """
+    started = time.monotonic()
+    if full:
+        reset_rollups(db)
+    # 以数据库时间为准计算截止时间，与 created_at 的 server_default 同源
+    cutoff = db.scalar(select(func.now())) - timedelta(seconds=lag_seconds)
+    db.commit()
+
+    stats = RefreshStats()
+    for source in ROLLUP_SOURCES:
+        stats.rows[source.name] = _refresh_source(db, source, cutoff, batch_size, on_batch)
+    stats.seconds = time.monotonic() - started
+    return stats
+
+
+def rollups_refreshed_through(db: Session) -> Optional[datetime]:
+    """汇总表已覆盖到的时间点（各来源表刷新截止时间的最小值；尚未刷新过为 None）"""
+    covered = db.scalars(select(RollupWatermark.covered_until)).all()
+    if len(covered) < len(ROLLUP_SOURCES) or any(c is None for c in covered):
+        return None
+    return min(covered)
+
+
+def top_count(counts: Optional[dict]) -> Tuple[Optional[int], int]:
+    """计数 dict 中次数最多的 id 及其次数（并列时取 id 较小者）"""
+    if not counts:
+        return None, 0
+    key, count = min(counts.items(), key=lambda item: (-item[1], int(item[0])))
+    return int(key), count
@@ -0,0 +1,196 @@
+"""
+Per-user error profile (学生错误画像) for TOEFL Reading Error Diagnosis
+
+每个用户在 user_error_profile 表中有一行汇总：
+- total_reflections: 复盘总数
+- level_counts / type_counts: 按错误层级 / 错误类型的累计次数
+- trajectory: 最近 PROFILE_TRAJECTORY_SIZE 次复盘的诊断（旧 -> 新）
+- recent_level_counts: trajectory 窗口内的层级分布
+
+提交复盘时由 record_reflection / remove_reflection 在同一事务中增量维护，
+读取画像只需按主键取一行，与历史记录条数无关。
+rebuild_profiles 从 reflection_responses 全量重建（迁移后回填、修复漂移时使用）。
+"""
+
+import os
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import ReflectionResponse, UserAnswer, UserErrorProfile
+
+# 画像中保留的最近复盘条数
+PROFILE_TRAJECTORY_SIZE = int(os.getenv("PROFILE_TRAJECTORY_SIZE", "20"))
+
+
+def _trajectory_entry(user_answer_id: int, question_id: int, error_level: str, error_type: str) -> dict:
+    return {
+        "user_answer_id": user_answer_id,
+        "question_id": question_id,
+        "error_level": error_level,
+        "error_type": error_type,
+    }
+
+
+def _recent_level_counts(trajectory: List[dict]) -> Dict[str, int]:
+    return dict(Counter(entry["error_level"] for entry in trajectory))
+
+
+def _adjust(counts: Optional[dict], key: str, delta: int) -> Dict[str, int]:
+    """返回调整后的新 dict（JSON 列只有重新赋值才会被识别为已修改）"""
+    counts = dict(counts or {})
+    value = counts.get(key, 0) + delta
+    if value > 0:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+    return counts
+
+
+def _locked_profile(db: Session, user_id: int) -> UserErrorProfile:
+    """
+    取出（必要时创建）用户画像并加行锁，保证并发提交的复盘不会互相覆盖计数
+
+    两个请求同时为新用户创建画像时，后插入的一方在 savepoint 内遇到主键冲突，
+    回滚 savepoint 后重新读取对方创建的行。
+    """
+    profile = db.get(UserErrorProfile, user_id, with_for_update=True, populate_existing=True)
+    if profile is not None:
+        return profile
+    try:
+        with db.begin_nested():
+            profile = UserErrorProfile(
+                user_id=user_id, total_reflections=0,
+                level_counts={}, type_counts={}, trajectory=[], recent_level_counts={}
+            )
+            db.add(profile)
+    except IntegrityError:
+        profile = db.get(UserErrorProfile, user_id, with_for_update=True, populate_existing=True)
+    return profile
+
+
+def record_reflection(
+    db: Session,
+    user_id: int,
+    user_answer_id: int,
+    question_id: int,
+    error_level: str,
+    error_type: str
+) -> UserErrorProfile:
+    """把一次复盘诊断计入用户画像（不提交事务，由调用方和复盘记录一起提交）"""
+    profile = _locked_profile(db, user_id)
+    profile.total_reflections = (profile.total_reflections or 0) + 1
+    profile.level_counts = _adjust(profile.level_counts, error_level, 1)
+    profile.type_counts = _adjust(profile.type_counts, error_type, 1)
+    trajectory = [
+        entry for entry in (profile.trajectory or []) if entry["user_answer_id"] != user_answer_id
+    ]
+    trajectory.append(_trajectory_entry(user_answer_id, question_id, error_level, error_type))
+    profile.trajectory = trajectory[-PROFILE_TRAJECTORY_SIZE:]
+    profile.recent_level_counts = _recent_level_counts(profile.trajectory)
+    return profile
+
+
+def remove_reflection(db: Session, user_id: int, reflection: ReflectionResponse) -> None:
+    """
+    从用户画像中扣除一条即将删除（被覆盖）的复盘记录（不提交事务）
+
+    trajectory 中对应的条目被移除后窗口暂时少一条，之后的复盘会继续填满；
+    需要精确窗口时可运行 rebuild_profiles.py。
+    """
+    profile = _locked_profile(db, user_id)
+    if not profile.total_reflections:
+        return
+    profile.total_reflections -= 1
+    if reflection.rule_error_level:
+        profile.level_counts = _adjust(profile.level_counts, reflection.rule_error_level, -1)
+    if reflection.rule_error_type:
+        profile.type_counts = _adjust(profile.type_counts, reflection.rule_error_type, -1)
+    profile.trajectory = [
+        entry for entry in (profile.trajectory or [])
+        if entry["user_answer_id"] != reflection.user_answer_id
+    ]
+    profile.recent_level_counts = _recent_level_counts(profile.trajectory)
+
+
+def _profile_row(user_id: int, rows: Iterable[tuple]) -> dict:
+    """把一个用户按时间排序的 (user_answer_id, question_id, level, type) 聚合为画像行"""
+    level_counts, type_counts = Counter(), Counter()
+    trajectory = deque(maxlen=PROFILE_TRAJECTORY_SIZE)
+    total = 0
+    for user_answer_id, question_id, error_level, error_type in rows:
+        total += 1
+        if error_level:
+            level_counts[error_level] += 1
+        if error_type:
+            type_counts[error_type] += 1
+        trajectory.append(_trajectory_entry(user_answer_id, question_id, error_level, error_type))
+    trajectory = list(trajectory)
+    return {
+        "user_id": user_id,
+        "total_reflections": total,
+        "level_counts": dict(level_counts),
+        "type_counts": dict(type_counts),
+        "trajectory": trajectory,
+        "recent_level_counts": _recent_level_counts(trajectory),
+    }
+
+
+def rebuild_profiles(
+    db: Session,
+    user_ids: Optional[Sequence[int]] = None,
+    batch_size: int = 1000
+) -> int:
+    """
+    从复盘历史全量重建画像，返回重建的用户数
+
+    按 (user_id, 复盘 id) 顺序以服务端游标（yield_per）读取，逐个用户聚合，
+    每 batch_size 个用户执行一次批量 INSERT；删除旧画像与写入新画像在同一事务中提交，
+    重建期间读取画像的请求看到的始终是完整的旧数据或新数据。
+    """
+    statement = (
+        select(
+            UserAnswer.user_id, ReflectionResponse.user_answer_id, UserAnswer.question_id,
+            ReflectionResponse.rule_error_level, ReflectionResponse.rule_error_type
+        )
+        .join(UserAnswer, UserAnswer.id == ReflectionResponse.user_answer_id)
+        .order_by(UserAnswer.user_id, ReflectionResponse.id)
+    )
+    clear = delete(UserErrorProfile)
+    if user_ids:
+        statement = statement.where(UserAnswer.user_id.in_(list(user_ids)))
+        clear = clear.where(UserErrorProfile.user_id.in_(list(user_ids)))
+
+    rebuilt = 0
+    pending: List[dict] = []
+
+    def flush():
+        nonlocal rebuilt
+        if pending:
+            db.execute(insert(UserErrorProfile), pending)
+            rebuilt += len(pending)
+            pending.clear()
+
+    try:
+        db.execute(clear)
+        result = db.execute(statement.execution_options(yield_per=batch_size))
+        current_user, current_rows = None, []
+        for user_id, *row in result:
+            if user_id != current_user:
+                if current_user is not None:
+                    pending.append(_profile_row(current_user, current_rows))
+                    if len(pending) >= batch_size:
+                        flush()
+                current_user, current_rows = user_id, []
+            current_rows.append(row)
+        if current_user is not None:
+            pending.append(_profile_row(current_user, current_rows))
+        flush()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rebuilt
@@ -0,0 +1,237 @@
+"""
+LLM Explanation Cache for TOEFL Reading Error Diagnosis
+
+没有自由输入时，发给 Gemini 的 prompt 完全由
+(question_id, 复盘选择, error_level, error_type) 决定。同一道题上犯同样
+错误的学生会得到相同的 prompt，这里把 Gemini 的输出按 prompt 输入的
+稳定哈希缓存起来：
+
+- 内存层：进程内 TTLCache，命中时不访问数据库
+- 持久层：llm_explanation_cache 表，跨进程、跨重启共享
+
+学生填写了 step3/step5 自由输入时绕过缓存（prompt 个性化，不可复用）。
+只缓存 LLM 成功返回的内容，回退文案不会被缓存。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from app.core.database import SessionLocal
+from app.models.models import LLMExplanationCache
+from app.services.cache import TTLCache
+
+# 持久层条目存活秒数（<= 0 表示永不过期）和最多保留的行数
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
+# 内存层
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "2048"))
+LLM_CACHE_MEMORY_TTL = float(os.getenv("LLM_CACHE_MEMORY_TTL", "3600"))
+# 每写入多少条检查一次持久层容量
+_EVICT_EVERY = 100
+
+
+def explanation_fingerprint(
+    question_id: int,
+    selected_option_id: Optional[int],
+    step1_choice_id: Optional[int],
+    step2_choice_id: Optional[int],
+    step3_choice_id: Optional[int],
+    step5_choice_id: Optional[int],
+    error_level: str,
+    error_type: str,
+    prompt_version: int,
+    model_name: str
+) -> str:
+    """
+    计算 prompt 输入的稳定哈希
+
+    只包含会进入 prompt 的字段（学生所选选项会出现在 prompt 中；
+    step4A/4B 只通过 error_level/error_type 影响 prompt），
+    并带上 prompt 版本和模型名，prompt 或模型变更后旧缓存自然失效。
+    """
+    payload = {
+        "question_id": question_id,
+        "selected_option_id": selected_option_id,
+        "choices": [step1_choice_id, step2_choice_id, step3_choice_id, step5_choice_id],
+        "error_level": error_level,
+        "error_type": error_type,
+        "prompt_version": prompt_version,
+        "model": model_name,
+    }
+    normalized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(step3_custom_input: Optional[str], step5_custom_input: Optional[str]) -> bool:
+    """学生填写了自由输入时 prompt 是个性化的，不走缓存"""
+    return not ((step3_custom_input or "").strip() or (step5_custom_input or "").strip())
+
+
+class ExplanationCache:
+    """
+    两级（内存 + 数据库）LLM 解释缓存
+
+    持久层使用独立的短生命周期 session，因此同步路由、异步路由和后台任务
+    都可以直接调用，无需传递请求的 session。
+    """
+
+    def __init__(self, ttl: float, max_rows: int, memory_size: int, memory_ttl: float):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.memory = TTLCache(maxsize=memory_size, ttl=memory_ttl)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+        self.errors = 0
+
+    def get(self, fingerprint: str) -> Optional[Tuple[str, str]]:
+        """
+        返回缓存的 (explanation, suggestion)，未命中返回 None
+
+        持久层读取失败时按未命中处理；命中计数写入失败时仍返回读到的内容，
+        缓存故障不会让复盘请求失败。
+        """
+        cached = self.memory.get(fingerprint)
+        if cached is not None:
+            self._count("memory_hits")
+            return cached
+
+        db = SessionLocal()
+        try:
+            row = db.query(LLMExplanationCache).filter(
+                LLMExplanationCache.fingerprint == fingerprint
+            ).first()
+            if row is None or self._expired(row):
+                self._count("misses")
+                return None
+            result = (row.llm_explanation, row.llm_suggestion)
+            try:
+                row.hit_count = (row.hit_count or 0) + 1
+                row.last_used_at = datetime.utcnow()
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                self._count("errors")
+                print(f"LLM 解释缓存命中计数写入失败: {e}")
+        except Exception as e:
+            db.rollback()
+            self._count("errors")
+            self._count("misses")
+            print(f"LLM 解释缓存读取失败: {e}")
+            return None
+        finally:
+            db.close()
+
+        self.memory.set(fingerprint, result)
+        self._count("db_hits")
+        return result
+
+    def put(
+        self,
+        fingerprint: str,
+        explanation: str,
+        suggestion: str,
+        question_id: Optional[int] = None,
+        error_level: Optional[str] = None,
+        prompt_version: Optional[int] = None
+    ) -> None:
+        """写入两级缓存（已存在时覆盖）"""
+        self.memory.set(fingerprint, (explanation, suggestion))
+
+        db = SessionLocal()
+        try:
+            row = db.get(LLMExplanationCache, fingerprint)
+            if row is None:
+                row = LLMExplanationCache(fingerprint=fingerprint, hit_count=0)
+                db.add(row)
+            row.question_id = question_id
+            row.error_level = error_level
+            row.prompt_version = prompt_version
+            row.llm_explanation = explanation
+            row.llm_suggestion = suggestion
+            row.created_at = datetime.utcnow()
+            row.last_used_at = datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            # 并发写入同一 fingerprint 等情况下放弃持久化，不影响本次请求
+            db.rollback()
+            print(f"LLM 解释缓存写入失败: {e}")
+            return
+        finally:
+            db.close()
+
+        if self._count("stores") % _EVICT_EVERY == 0:
+            self.evict()
+
+    def record_bypass(self) -> None:
+        """记录一次因自由输入而绕过缓存的请求"""
+        self._count("bypasses")
+
+    def evict(self) -> int:
+        """删除过期条目，并按 last_used_at 淘汰超出 max_rows 的条目，返回删除行数"""
+        db = SessionLocal()
+        try:
+            deleted = 0
+            if self.ttl > 0:
+                cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+                deleted += db.query(LLMExplanationCache).filter(
+                    LLMExplanationCache.created_at < cutoff
+                ).delete(synchronize_session=False)
+            total = db.query(LLMExplanationCache).count()
+            if total > self.max_rows:
+                stale = db.query(LLMExplanationCache.fingerprint).order_by(
+                    LLMExplanationCache.last_used_at
+                ).limit(total - self.max_rows).subquery()
+                deleted += db.query(LLMExplanationCache).filter(
+                    LLMExplanationCache.fingerprint.in_(stale.select())
+                ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def invalidate(self) -> None:
+        """清空内存层（持久层通过 prompt_version 变更或 evict() 失效）"""
+        self.memory.invalidate()
+
+    def stats(self) -> dict:
+        """命中率统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            hits = self.memory_hits + self.db_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "stores": self.stores,
+                "errors": self.errors,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory": self.memory.stats(),
+            }
+
+    def _expired(self, row: LLMExplanationCache) -> bool:
+        if self.ttl <= 0 or row.created_at is None:
+            return False
+        return row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def _count(self, name: str) -> int:
+        with self._lock:
+            value = getattr(self, name) + 1
+            setattr(self, name, value)
+            return value
+
+
+explanation_cache = ExplanationCache(
+    ttl=LLM_CACHE_TTL,
+    max_rows=LLM_CACHE_MAX_ROWS,
+    memory_size=LLM_CACHE_MEMORY_SIZE,
+    memory_ttl=LLM_CACHE_MEMORY_TTL,
+)
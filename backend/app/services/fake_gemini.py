@@ -0,0 +1,318 @@
+"""
+Fake Gemini backend for TOEFL Reading Error Diagnosis
+
+离线的 Gemini 替身，接口与 google-genai 的 genai.Client 中本项目用到的部分一致：
+
+- client.models.generate_content(model, contents, config)
+- client.aio.models.generate_content(model, contents, config)
+- client.aio.models.generate_content_stream(model, contents, config)
+
+设置 GEMINI_BACKEND=fake 后 gemini_service 使用本模块的客户端（不需要 GEMINI_API_KEY），
+用于在没有网络的环境中测试和压测缓存、限流、熔断与异步路径。
+
+响应遵守调用方的 response_schema：config 要求 application/json 时按 schema 生成 JSON，
+否则输出 "EXPLANATION: ... SUGGESTION: ..." 格式的文本（流式接口按块输出）。
+相同 prompt 的正常响应内容相同。
+
+通过环境变量注入延迟和故障（比例为 0~1，按顺序依次判定）：
+
+- FAKE_GEMINI_LATENCY_MS / FAKE_GEMINI_LATENCY_JITTER_MS：延迟均值和标准差（毫秒）
+- FAKE_GEMINI_LATENCY_DIST：fixed / normal（截断正态，默认）/ lognormal / uniform
+- FAKE_GEMINI_RATE_LIMIT_RATE：返回 429 RESOURCE_EXHAUSTED 的比例
+- FAKE_GEMINI_ERROR_RATE：返回 500 INTERNAL 的比例
+- FAKE_GEMINI_TIMEOUT_RATE：不响应直到超时的比例（同步调用在 http_options.timeout 到期后
+  抛出超时异常；异步调用挂起 FAKE_GEMINI_HANG_SECONDS 秒，由调用方的 wait_for 取消）
+- FAKE_GEMINI_MALFORMED_RATE：返回无法解析的内容（截断的 JSON / 缺少标记的文本）的比例
+- FAKE_GEMINI_STREAM_CHUNK_CHARS / FAKE_GEMINI_STREAM_CHUNK_DELAY_MS：流式输出的块大小和块间隔
+- FAKE_GEMINI_SEED：随机数种子（不设置时每次运行不同）
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from google.genai import errors
+
+LATENCY_DISTRIBUTIONS = ("fixed", "normal", "lognormal", "uniform")
+
+
+class FakeGeminiTimeout(Exception):
+    """模拟的请求超时（类名包含 Timeout，metrics 归类为 timeout）"""
+
+
+@dataclass
+class FakeGeminiConfig:
+    latency_ms: float = 800.0
+    jitter_ms: float = 200.0
+    latency_dist: str = "normal"
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    malformed_rate: float = 0.0
+    hang_seconds: float = 60.0
+    stream_chunk_chars: int = 16
+    stream_chunk_delay_ms: float = 30.0
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiConfig":
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        config = cls(
+            latency_ms=float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800")),
+            jitter_ms=float(os.getenv("FAKE_GEMINI_LATENCY_JITTER_MS", "200")),
+            latency_dist=os.getenv("FAKE_GEMINI_LATENCY_DIST", "normal").lower(),
+            rate_limit_rate=float(os.getenv("FAKE_GEMINI_RATE_LIMIT_RATE", "0")),
+            error_rate=float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+            timeout_rate=float(os.getenv("FAKE_GEMINI_TIMEOUT_RATE", "0")),
+            malformed_rate=float(os.getenv("FAKE_GEMINI_MALFORMED_RATE", "0")),
+            hang_seconds=float(os.getenv("FAKE_GEMINI_HANG_SECONDS", "60")),
+            stream_chunk_chars=int(os.getenv("FAKE_GEMINI_STREAM_CHUNK_CHARS", "16")),
+            stream_chunk_delay_ms=float(os.getenv("FAKE_GEMINI_STREAM_CHUNK_DELAY_MS", "30")),
+            seed=int(seed) if seed else None,
+        )
+        if config.latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"FAKE_GEMINI_LATENCY_DIST 必须是 {'/'.join(LATENCY_DISTRIBUTIONS)} 之一: {config.latency_dist}"
+            )
+        return config
+
+
+class FakeResponse:
+    """与 GenerateContentResponse 一样通过 .text 读取内容"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeModels:
+    """client.models：同步接口"""
+
+    def __init__(self, backend: "FakeGeminiClient"):
+        self._backend = backend
+
+    def generate_content(self, model: str, contents, config=None) -> FakeResponse:
+        backend = self._backend
+        outcome = backend._draw_outcome()
+        if outcome == "rate_limited":
+            backend._raise_rate_limited()
+        if outcome == "timeout":
+            timeout_ms = getattr(getattr(config, "http_options", None), "timeout", None)
+            if timeout_ms:
+                time.sleep(timeout_ms / 1000)
+                raise FakeGeminiTimeout(f"fake Gemini request timed out after {timeout_ms}ms")
+            time.sleep(backend.config.hang_seconds)
+            raise FakeGeminiTimeout("fake Gemini request hung")
+        time.sleep(backend._sample_latency())
+        return backend._respond(outcome, contents, config)
+
+
+class _FakeAsyncModels:
+    """client.aio.models：异步接口"""
+
+    def __init__(self, backend: "FakeGeminiClient"):
+        self._backend = backend
+
+    async def generate_content(self, model: str, contents, config=None) -> FakeResponse:
+        backend = self._backend
+        outcome = backend._draw_outcome()
+        await backend._wait_async(outcome)
+        return backend._respond(outcome, contents, config)
+
+    async def generate_content_stream(self, model: str, contents, config=None) -> AsyncIterator[FakeResponse]:
+        """与 SDK 一样先 await 建立流（首块延迟），再异步迭代各块"""
+        backend = self._backend
+        outcome = backend._draw_outcome()
+        await backend._wait_async(outcome)
+        text = backend._respond(outcome, contents, config).text
+        return backend._stream_chunks(text)
+
+
+class _FakeAio:
+    def __init__(self, backend: "FakeGeminiClient"):
+        self.models = _FakeAsyncModels(backend)
+
+
+class FakeGeminiClient:
+    """
+    本地 Gemini 替身（线程安全），stats() 返回各类结果的次数
+    """
+
+    def __init__(self, config: Optional[FakeGeminiConfig] = None):
+        self.config = config or FakeGeminiConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._outcomes = {}
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiClient":
+        return cls(FakeGeminiConfig.from_env())
+
+    def stats(self) -> dict:
+        with self._lock:
+            outcomes = dict(self._outcomes)
+        return {
+            "calls": sum(outcomes.values()),
+            "outcomes": outcomes,
+            "latency_ms": self.config.latency_ms,
+            "jitter_ms": self.config.jitter_ms,
+            "latency_dist": self.config.latency_dist,
+        }
+
+    # -- fault injection ---------------------------------------------------
+
+    def _draw_outcome(self) -> str:
+        """按配置的比例决定本次调用的结果"""
+        config = self.config
+        with self._lock:
+            draw = self._rng.random()
+            outcome = "success"
+            for name, rate in (
+                ("rate_limited", config.rate_limit_rate),
+                ("error", config.error_rate),
+                ("timeout", config.timeout_rate),
+                ("malformed", config.malformed_rate),
+            ):
+                if draw < rate:
+                    outcome = name
+                    break
+                draw -= rate
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+        return outcome
+
+    def _sample_latency(self) -> float:
+        """按配置的分布采样一次延迟（秒）"""
+        config = self.config
+        mean, jitter = config.latency_ms, config.jitter_ms
+        with self._lock:
+            if config.latency_dist == "fixed" or jitter <= 0 or mean <= 0:
+                value = mean
+            elif config.latency_dist == "normal":
+                value = self._rng.gauss(mean, jitter)
+            elif config.latency_dist == "lognormal":
+                # 由目标均值和标准差换算对数正态参数
+                sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2))
+                mu = math.log(mean) - sigma ** 2 / 2
+                value = self._rng.lognormvariate(mu, sigma)
+            else:
+                value = self._rng.uniform(mean - jitter, mean + jitter)
+        return max(0.0, value) / 1000
+
+    async def _wait_async(self, outcome: str) -> None:
+        if outcome == "rate_limited":
+            self._raise_rate_limited()
+        if outcome == "timeout":
+            await asyncio.sleep(self.config.hang_seconds)
+            raise FakeGeminiTimeout("fake Gemini request hung")
+        await asyncio.sleep(self._sample_latency())
+
+    @staticmethod
+    def _raise_rate_limited():
+        raise errors.ClientError(429, {"error": {
+            "code": 429,
+            "message": "Resource has been exhausted (fake Gemini rate limit).",
+            "status": "RESOURCE_EXHAUSTED",
+        }})
+
+    # -- responses ---------------------------------------------------------
+
+    def _respond(self, outcome: str, contents, config) -> FakeResponse:
+        if outcome == "error":
+            raise errors.ServerError(500, {"error": {
+                "code": 500,
+                "message": "Internal error encountered (fake Gemini).",
+                "status": "INTERNAL",
+            }})
+
+        prompt = contents if isinstance(contents, str) else str(contents)
+        explanation, suggestion = _compose(prompt)
+        schema = _json_schema(config)
+        if schema is not None:
+            text = json.dumps(
+                _value_for_schema(schema, {"explanation": explanation, "suggestion": suggestion}),
+                ensure_ascii=False
+            )
+            if outcome == "malformed":
+                text = text[:len(text) // 2]
+        elif outcome == "malformed":
+            text = f"{explanation}\n{suggestion}"
+        else:
+            text = f"EXPLANATION: {explanation}\nSUGGESTION: {suggestion}"
+        return FakeResponse(text)
+
+    async def _stream_chunks(self, text: str) -> AsyncIterator[FakeResponse]:
+        size = max(1, self.config.stream_chunk_chars)
+        delay = self.config.stream_chunk_delay_ms / 1000
+        for start in range(0, len(text), size):
+            if start:
+                await asyncio.sleep(delay)
+            yield FakeResponse(text[start:start + size])
+
+
+def _json_schema(config) -> Optional[dict]:
+    """config 要求 JSON 输出时返回 response_schema（未给出 schema 时返回空 dict）"""
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        mime_type, schema = config.get("response_mime_type"), config.get("response_schema")
+    else:
+        mime_type, schema = getattr(config, "response_mime_type", None), getattr(config, "response_schema", None)
+    if mime_type != "application/json":
+        return None
+    if schema is not None and not isinstance(schema, dict):
+        # types.Schema 等 pydantic 对象
+        schema = schema.model_dump(exclude_none=True)
+    return schema or {}
+
+
+def _schema_type(schema: dict) -> str:
+    value = schema.get("type", "OBJECT" if "properties" in schema else "STRING")
+    return str(getattr(value, "value", value)).upper()
+
+
+def _value_for_schema(schema: dict, texts: dict, name: str = ""):
+    """按 schema 生成一个合法的值，字符串字段优先使用 texts 中同名的内容"""
+    kind = _schema_type(schema)
+    if kind == "OBJECT":
+        properties = schema.get("properties") or {}
+        if not properties:
+            return dict(texts)
+        return {key: _value_for_schema(sub, texts, key) for key, sub in properties.items()}
+    if kind == "ARRAY":
+        return [_value_for_schema(schema.get("items") or {}, texts, name)]
+    if kind == "INTEGER":
+        return 0
+    if kind == "NUMBER":
+        return 0.0
+    if kind == "BOOLEAN":
+        return False
+    if schema.get("enum"):
+        return schema["enum"][0]
+    return texts.get(name, f"（模拟）{name}")
+
+
+def _compose(prompt: str):
+    """根据 prompt 中的诊断信息生成确定性的解释和建议"""
+    level = re.search(r"错误层级：\s*(\S+)", prompt)
+    error_type = re.search(r"错误类型：\s*(.+)", prompt)
+    level = level.group(1) if level else "unknown"
+    error_type = error_type.group(1).strip() if error_type else "未知错误"
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    explanation = (
+        f"（模拟 {digest}）本题的错误出现在 {level}：{error_type}。"
+        f"你在这一环节的判断偏离了原文的 key information，导致最终选择了干扰项。"
+    )
+    suggestion = (
+        f"（模拟 {digest}）针对 {level} 的问题，建议每次作答后回到原文核对定位句，"
+        f"并用自己的话 paraphrase 答案句，再与选项逐一比对。"
+    )
+    return explanation, suggestion
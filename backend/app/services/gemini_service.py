@@ -9,24 +9,48 @@ Updated to use the new google-genai package (google.generativeai is deprecated)
 
 import os
 import re
+import sys
 import json
-from typing import Tuple
+import asyncio
+import hashlib
+import time
+from typing import AsyncIterator, Optional, Tuple
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+from app.services.explanation_cache import explanation_cache
+from app.services.singleflight import SingleFlight
+from app.services.llm_guard import llm_guard, LLMUnavailable
+from app.core.metrics import record_llm_call, record_llm_rejection
 
 # 加载环境变量
 load_dotenv()
 
 # 配置 Gemini API
+# GEMINI_BACKEND=fake 时使用本地替身（见 fake_gemini.py），不需要 API key，用于离线测试和压测
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "gemini").lower()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("警告: GEMINI_API_KEY 未设置，将无法使用 LLM 功能")
+if GEMINI_BACKEND == "fake":
+    from app.services.fake_gemini import FakeGeminiClient
+    client = FakeGeminiClient.from_env()
+    print("提示: GEMINI_BACKEND=fake，LLM 调用由本地 Fake Gemini 响应", file=sys.stderr)
+elif not GEMINI_API_KEY:
+    # 写到 stderr：导入本模块的命令行工具（如 export_history.py）可能把数据输出到 stdout
+    print("警告: GEMINI_API_KEY 未设置，将无法使用 LLM 功能", file=sys.stderr)
     client = None
 else:
     client = genai.Client(api_key=GEMINI_API_KEY)
 
 MODEL_NAME = "gemini-2.5-flash"
+# prompt 模板版本：修改 _build_prompt / SYSTEM_INSTRUCTION 时递增，旧的缓存解释随之失效，
+# 已保存的解释可用 regenerate_explanations.py --older-than 重新生成
+PROMPT_VERSION = 1
+
+# 合并相同 prompt 的并发 Gemini 请求
+_inflight = SingleFlight()
+
+
+SYSTEM_INSTRUCTION = """你是一位经验丰富的托福阅读教师，正在帮助学生分析错题。请用友好、鼓励的语气，生成简洁的错因解释和改进建议。使用中英结合的方式：关键术语用英文，解释用中文。"""
 
 
 def generate_diagnosis_explanation(
@@ -34,7 +58,8 @@ def generate_diagnosis_explanation(
     error_type: str,
     rule_details: dict,
     question_data: dict,
-    user_responses: dict
+    user_responses: dict,
+    cache_key: Optional[str] = None
 ) -> Tuple[str, str]:
     """
     使用 Gemini LLM 生成个性化的错误诊断解释和改进建议
@@ -45,6 +70,8 @@ def generate_diagnosis_explanation(
         rule_details: 规则引擎的详细分析结果
         question_data: 题目信息 (stem, passage_content, correct_answer, user_answer)
         user_responses: 学生的复盘回答内容
+        cache_key: 可选的 prompt 指纹（见 explanation_cache.explanation_fingerprint），
+                   传入时先查缓存，LLM 成功返回后写入缓存
     
     Returns:
         Tuple[str, str]: (explanation, suggestion)
@@ -52,12 +79,108 @@ def generate_diagnosis_explanation(
         - suggestion: 50-100字的改进建议
     """
     
-    # 如果没有配置 API key，返回占位符
-    if not GEMINI_API_KEY or not client:
+    if cache_key:
+        cached = explanation_cache.get(cache_key)
+        if cached:
+            return cached
+    
+    # 如果没有配置 API key（也没有使用 fake 后端），返回占位符
+    if not client:
         return _generate_fallback_response(error_level, error_type, rule_details)
     
-    try:
-        # 构建 prompt
+    # 构建 prompt
+    prompt = _build_prompt(
+        error_level=error_level,
+        error_type=error_type,
+        rule_details=rule_details,
+        question_data=question_data,
+        user_responses=user_responses
+    )
+    
+    def call():
+        result = _request_explanation(prompt)
+        if result and cache_key:
+            _store_cached(cache_key, result, error_level, question_data)
+        return result
+    
+    # 相同 prompt 的并发请求只调用一次 Gemini，结果（包括失败）共享
+    result = _inflight.do(_prompt_key(prompt), call)
+    if not result:
+        # 失败或解析为空时返回基于规则的回退内容
+        return _generate_fallback_response(error_level, error_type, rule_details)
+    return result
+
+
+async def generate_diagnosis_explanation_async(
+    error_level: str,
+    error_type: str,
+    rule_details: dict,
+    question_data: dict,
+    user_responses: dict,
+    cache_key: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    generate_diagnosis_explanation 的异步版本
+    
+    使用 google-genai 的异步客户端 (client.aio)，等待 LLM 响应期间不占用
+    线程池线程，适合在 async 路由中大量并发调用。参数和返回值与同步版本一致。
+    """
+    
+    if cache_key:
+        cached = await asyncio.to_thread(explanation_cache.get, cache_key)
+        if cached:
+            return cached
+    
+    if not client:
+        return _generate_fallback_response(error_level, error_type, rule_details)
+    
+    prompt = _build_prompt(
+        error_level=error_level,
+        error_type=error_type,
+        rule_details=rule_details,
+        question_data=question_data,
+        user_responses=user_responses
+    )
+    
+    async def call():
+        result = await _request_explanation_async(prompt)
+        if result and cache_key:
+            await asyncio.to_thread(_store_cached, cache_key, result, error_level, question_data)
+        return result
+    
+    result = await _inflight.do_async(_prompt_key(prompt), call)
+    if not result:
+        return _generate_fallback_response(error_level, error_type, rule_details)
+    return result
+
+
+async def stream_diagnosis_explanation(
+    error_level: str,
+    error_type: str,
+    rule_details: dict,
+    question_data: dict,
+    user_responses: dict,
+    cache_key: Optional[str] = None
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    流式生成错因解释和改进建议（generate_content_stream）
+    
+    参数与 generate_diagnosis_explanation 一致。逐段产出 (field, delta)：
+    - ("explanation", 文本增量) / ("suggestion", 文本增量)
+    - ("reset", "")：流式生成中途失败，之前产出的文本作废，随后产出完整的回退内容
+    
+    缓存命中、未配置 API key 或失败时，整段产出缓存内容或回退内容。
+    """
+    
+    if cache_key:
+        cached = await asyncio.to_thread(explanation_cache.get, cache_key)
+        if cached:
+            yield ("explanation", cached[0])
+            yield ("suggestion", cached[1])
+            return
+    
+    fallback = None
+    if client:
         prompt = _build_prompt(
             error_level=error_level,
             error_type=error_type,
@@ -65,47 +188,258 @@ def generate_diagnosis_explanation(
             question_data=question_data,
             user_responses=user_responses
         )
-        # 构建系统指令
-        system_instruction = """你是一位经验丰富的托福阅读教师，正在帮助学生分析错题。请用友好、鼓励的语气，生成简洁的错因解释和改进建议。使用中英结合的方式：关键术语用英文，解释用中文。"""
-        
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                response_mime_type="application/json",
-                response_schema={
-                    "type": types.Type.OBJECT,
-                    "properties": {
-                        "explanation": {
-                            "type": types.Type.STRING,
-                            "description": "50-100字的错因解释，清晰指出学生在哪个环节、为什么会犯错"
-                        },
-                        "suggestion": {
-                            "type": types.Type.STRING,
-                            "description": "50-100字的改进建议，给出具体的、可操作的学习建议"
-                        }
-                    },
-                    "required": ["explanation", "suggestion"]
-                }
-            )
-        )
+        parser = _StreamParser()
+        emitted = False
+        result = None
+        try:
+            await llm_guard.acquire_async()
+        except LLMUnavailable as e:
+            record_llm_rejection(e.reason)
+            guarded = False
+        else:
+            guarded = True
         
-        # 直接解析 JSON 响应（不需要正则表达式）
-        result = json.loads(response.text)
-        explanation = result.get("explanation", "")
-        suggestion = result.get("suggestion", "")
+        success = False
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            if guarded:
+                # 截止时间只约束建立流式连接，之后的生成速度由模型决定
+                stream = await asyncio.wait_for(
+                    client.aio.models.generate_content_stream(
+                        model=MODEL_NAME,
+                        contents=prompt,
+                        config=types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+                    ),
+                    timeout=llm_guard.timeout
+                )
+                # 客户端中途断开（GeneratorExit / CancelledError）不计入熔断失败；
+                # 生成中途出错或结果无法解析时计为失败
+                success = True
+                outcome = "cancelled"
+                async for chunk in stream:
+                    for delta in parser.feed(chunk.text or ""):
+                        emitted = True
+                        yield delta
+                for delta in parser.finish():
+                    emitted = True
+                    yield delta
+                result = parser.result()
+                success = result is not None
+                outcome = "success" if result else "invalid"
+        except Exception as e:
+            success = False
+            outcome = _error_outcome(e)
+            print(f"Gemini API 流式调用失败: {e!r}")
+        finally:
+            if guarded:
+                llm_guard.release(success)
+                record_llm_call("stream", outcome, time.perf_counter() - started)
         
-        # 如果解析失败或为空，使用 fallback
+        if result:
+            if cache_key:
+                await asyncio.to_thread(_store_cached, cache_key, result, error_level, question_data)
+            return
+        if emitted:
+            yield ("reset", "")
+    
+    fallback = _generate_fallback_response(error_level, error_type, rule_details)
+    yield ("explanation", fallback[0])
+    yield ("suggestion", fallback[1])
+
+
+class _StreamParser:
+    """
+    增量解析 "EXPLANATION: ... SUGGESTION: ..." 格式的流式输出
+    
+    为避免把半截 "SUGGESTION:" 标记当作解释文本发出，在看到标记前保留
+    末尾 len(标记) 个字符不发送。
+    """
+    
+    EXPLANATION_MARK = "EXPLANATION:"
+    SUGGESTION_MARK = "SUGGESTION:"
+    
+    def __init__(self):
+        self.text = ""
+        self.sent = {"explanation": 0, "suggestion": 0}
+    
+    def feed(self, chunk: str) -> list[Tuple[str, str]]:
+        self.text += chunk
+        return self._deltas(final=False)
+    
+    def finish(self) -> list[Tuple[str, str]]:
+        return self._deltas(final=True)
+    
+    def result(self) -> Optional[Tuple[str, str]]:
+        explanation, suggestion, _ = self._split()
+        explanation, suggestion = explanation.strip(), suggestion.strip()
         if not explanation or not suggestion:
-            return _generate_fallback_response(error_level, error_type, rule_details)
-        
+            return None
         return (explanation, suggestion)
     
+    def _split(self) -> Tuple[str, str, bool]:
+        """返回 (explanation 部分, suggestion 部分, 是否已看到 SUGGESTION 标记)"""
+        start = self.text.find(self.EXPLANATION_MARK)
+        if start < 0:
+            return ("", "", False)
+        body = self.text[start + len(self.EXPLANATION_MARK):]
+        split = body.find(self.SUGGESTION_MARK)
+        if split < 0:
+            return (body, "", False)
+        return (body[:split], body[split + len(self.SUGGESTION_MARK):], True)
+    
+    def _deltas(self, final: bool) -> list[Tuple[str, str]]:
+        explanation, suggestion, has_suggestion = self._split()
+        explanation = explanation.lstrip()
+        if not has_suggestion and not final:
+            explanation = explanation[:max(0, len(explanation) - len(self.SUGGESTION_MARK))]
+        deltas = []
+        # 末尾空白等后续文本到达后再发送，保证拼接结果与 result() 一致
+        for field, text in (("explanation", explanation.rstrip()), ("suggestion", suggestion.strip())):
+            if len(text) > self.sent[field]:
+                deltas.append((field, text[self.sent[field]:]))
+                self.sent[field] = len(text)
+        return deltas
+
+
+def _request_explanation(prompt: str) -> Optional[Tuple[str, str]]:
+    """
+    同步调用 Gemini 并解析结果，失败、被限流/熔断或内容为空时返回 None
+    """
+    try:
+        llm_guard.acquire()
+    except LLMUnavailable as e:
+        record_llm_rejection(e.reason)
+        return None
+    
+    success = False
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=prompt,
+            config=_build_generation_config(timeout=llm_guard.timeout)
+        )
+        # 无法解析或内容为空的响应同样计为失败，持续返回坏结果时熔断器会打开
+        result = _parse_response(response.text)
+        success = result is not None
+        outcome = "success" if result else "invalid"
+        return result
     except Exception as e:
+        outcome = _error_outcome(e)
         print(f"Gemini API 调用失败: {e}")
-        # 失败时返回基于规则的回退内容
-        return _generate_fallback_response(error_level, error_type, rule_details)
+        return None
+    finally:
+        llm_guard.release(success)
+        record_llm_call("sync", outcome, time.perf_counter() - started)
+
+
+async def _request_explanation_async(prompt: str) -> Optional[Tuple[str, str]]:
+    """
+    异步调用 Gemini 并解析结果，失败、超时、被限流/熔断或内容为空时返回 None
+    """
+    try:
+        await llm_guard.acquire_async()
+    except LLMUnavailable as e:
+        record_llm_rejection(e.reason)
+        return None
+    
+    success = False
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            client.aio.models.generate_content(
+                model=MODEL_NAME,
+                contents=prompt,
+                config=_build_generation_config()
+            ),
+            timeout=llm_guard.timeout
+        )
+        # 无法解析或内容为空的响应同样计为失败，持续返回坏结果时熔断器会打开
+        result = _parse_response(response.text)
+        success = result is not None
+        outcome = "success" if result else "invalid"
+        return result
+    except Exception as e:
+        outcome = _error_outcome(e)
+        print(f"Gemini API 调用失败: {e!r}")
+        return None
+    finally:
+        llm_guard.release(success)
+        record_llm_call("async", outcome, time.perf_counter() - started)
+
+
+def _error_outcome(error: Exception) -> str:
+    """把调用异常归类为 metrics 的 outcome 标签"""
+    if isinstance(error, asyncio.TimeoutError) or "timeout" in type(error).__name__.lower():
+        return "timeout"
+    if isinstance(error, json.JSONDecodeError):
+        return "invalid"
+    return "error"
+
+
+def _prompt_key(prompt: str) -> str:
+    """in-flight 合并使用的 prompt 指纹"""
+    return hashlib.sha256(f"{MODEL_NAME}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def _build_generation_config(timeout: Optional[float] = None) -> types.GenerateContentConfig:
+    """
+    构建 Gemini 生成配置（系统指令 + JSON 输出格式），同步和异步调用共用
+    
+    timeout: 可选的请求超时秒数（同步调用通过 SDK 的 http_options 设置截止时间）
+    """
+    return types.GenerateContentConfig(
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+        system_instruction=SYSTEM_INSTRUCTION,
+        response_mime_type="application/json",
+        response_schema={
+            "type": types.Type.OBJECT,
+            "properties": {
+                "explanation": {
+                    "type": types.Type.STRING,
+                    "description": "50-100字的错因解释，清晰指出学生在哪个环节、为什么会犯错"
+                },
+                "suggestion": {
+                    "type": types.Type.STRING,
+                    "description": "50-100字的改进建议，给出具体的、可操作的学习建议"
+                }
+            },
+            "required": ["explanation", "suggestion"]
+        }
+    )
+
+
+def _parse_response(text: str) -> Optional[Tuple[str, str]]:
+    """
+    解析 Gemini 返回的 JSON，解释或建议为空时返回 None
+    """
+    # 直接解析 JSON 响应（不需要正则表达式）
+    result = json.loads(text)
+    explanation = result.get("explanation", "")
+    suggestion = result.get("suggestion", "")
+    
+    if not explanation or not suggestion:
+        return None
+    
+    return (explanation, suggestion)
+
+
+def _store_cached(cache_key: str, result: Tuple[str, str], error_level: str, question_data: dict) -> None:
+    """
+    将 LLM 成功生成的解释写入缓存（回退文案不会走到这里）
+    """
+    explanation, suggestion = result
+    explanation_cache.put(
+        cache_key,
+        explanation,
+        suggestion,
+        question_id=question_data.get("question_id"),
+        error_level=error_level,
+        prompt_version=PROMPT_VERSION
+    )
 
 
 def _build_prompt(
@@ -217,6 +551,35 @@ def _generate_fallback_response(
     return (explanation, suggestion)
 
 
+def get_llm_status() -> dict:
+    """
+    LLM 服务状态：是否已配置、使用的后端（gemini / fake）、熔断器 / 限流 / 并发状态、in-flight 合并统计
+    """
+    status = {
+        "configured": client is not None,
+        "backend": GEMINI_BACKEND,
+        "model": MODEL_NAME,
+        "prompt_version": PROMPT_VERSION,
+        "guard": llm_guard.status(),
+        "inflight": _inflight.stats(),
+    }
+    if GEMINI_BACKEND == "fake" and client is not None:
+        status["fake"] = client.stats()
+    return status
+
+
+def is_fallback_response(
+    result: Tuple[str, str],
+    error_level: str,
+    error_type: str,
+    rule_details: dict
+) -> bool:
+    """
+    判断 (explanation, suggestion) 是否是基于规则的回退内容（回退文案是确定性的）
+    """
+    return tuple(result) == _generate_fallback_response(error_level, error_type, rule_details)
+
+
 def test_gemini_connection() -> bool:
     """
     测试 Gemini API 连接是否正常
@@ -224,7 +587,7 @@ def test_gemini_connection() -> bool:
     Returns:
         bool: True 表示连接正常，False 表示连接失败
     """
-    if not GEMINI_API_KEY or not client:
+    if not client:
         print("❌ GEMINI_API_KEY 未设置")
         return False
     
@@ -0,0 +1,117 @@
+"""
+Answer / reflection history export for TOEFL Reading Error Diagnosis
+
+把 user_answers LEFT JOIN reflection_responses 逐行导出为 NDJSON 或 CSV，
+供 GET /api/users/{id}/history/export 和 export_history.py 使用。
+
+导出只使用 Core 查询（不构造 ORM 对象），并通过 yield_per 执行：
+PostgreSQL 上使用服务端游标（stream_results），每次只从数据库取 batch_size 行，
+内存占用与导出的总行数无关。输出同样按批产出文本块，适合 StreamingResponse 或直接写文件。
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.models import ReflectionResponse, UserAnswer
+
+EXPORT_FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# 导出的列：(输出列名, 数据库列)
+EXPORT_COLUMNS = [
+    ("user_answer_id", UserAnswer.id),
+    ("user_id", UserAnswer.user_id),
+    ("question_id", UserAnswer.question_id),
+    ("selected_option_id", UserAnswer.selected_option_id),
+    ("is_correct", UserAnswer.is_correct),
+    ("needs_reflection", UserAnswer.needs_reflection),
+    ("answered_at", UserAnswer.created_at),
+    ("step1_choice_id", ReflectionResponse.step1_choice_id),
+    ("step1_is_correct", ReflectionResponse.step1_is_correct),
+    ("step2_choice_id", ReflectionResponse.step2_choice_id),
+    ("step2_is_correct", ReflectionResponse.step2_is_correct),
+    ("step3_choice_id", ReflectionResponse.step3_choice_id),
+    ("step3_quality", ReflectionResponse.step3_quality),
+    ("step3_custom_input", ReflectionResponse.step3_custom_input),
+    ("step4a_choice_id", ReflectionResponse.step4a_choice_id),
+    ("step4a_custom_input", ReflectionResponse.step4a_custom_input),
+    ("step4b_choice_id", ReflectionResponse.step4b_choice_id),
+    ("step4b_custom_input", ReflectionResponse.step4b_custom_input),
+    ("step5_choice_id", ReflectionResponse.step5_choice_id),
+    ("step5_custom_input", ReflectionResponse.step5_custom_input),
+    ("step6_notes", ReflectionResponse.step6_notes),
+    ("rule_error_level", ReflectionResponse.rule_error_level),
+    ("rule_error_type", ReflectionResponse.rule_error_type),
+    ("llm_status", ReflectionResponse.llm_status),
+    ("llm_explanation", ReflectionResponse.llm_explanation),
+    ("llm_suggestion", ReflectionResponse.llm_suggestion),
+    ("reflection_completed_at", ReflectionResponse.completed_at),
+]
+EXPORT_FIELDS = [name for name, _ in EXPORT_COLUMNS]
+
+
+def history_query(
+    user_ids: Optional[Sequence[int]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """答题 + 复盘历史查询，按 user_answer id 排序；不指定 user_ids 时导出全部用户"""
+    statement = (
+        select(*[column.label(name) for name, column in EXPORT_COLUMNS])
+        .select_from(UserAnswer)
+        .outerjoin(ReflectionResponse, ReflectionResponse.user_answer_id == UserAnswer.id)
+        .order_by(UserAnswer.id)
+    )
+    if user_ids:
+        statement = statement.where(UserAnswer.user_id.in_(list(user_ids)))
+    if since is not None:
+        statement = statement.where(UserAnswer.created_at >= since)
+    if until is not None:
+        statement = statement.where(UserAnswer.created_at < until)
+    return statement
+
+
+def iter_history_batches(db: Session, statement, batch_size: int = 1000) -> Iterator[List[tuple]]:
+    """以服务端游标执行查询，每次产出最多 batch_size 行"""
+    result = db.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def format_batches(batches: Iterator[List[tuple]], export_format: str) -> Iterator[str]:
+    """把行批次转换为 NDJSON / CSV 文本块（CSV 先输出表头）"""
+    if export_format == "ndjson":
+        for rows in batches:
+            yield "".join(
+                json.dumps(
+                    {name: _json_value(value) for name, value in zip(EXPORT_FIELDS, row)},
+                    ensure_ascii=False
+                ) + "\n"
+                for row in rows
+            )
+    elif export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for rows in batches:
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        raise ValueError(f"不支持的导出格式: {export_format}")
@@ -0,0 +1,264 @@
+"""
+LLM call guard: concurrency limit, rate limit, deadline and circuit breaker
+
+Gemini 调用前先经过 LLMGuard：
+- 熔断器 (CircuitBreaker)：连续失败达到阈值后打开，打开期间直接走规则回退；
+  冷却时间过后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+- 令牌桶 (TokenBucket)：按配额限制每分钟调用次数
+- 并发上限：同时进行中的 Gemini 调用数
+- 截止时间：单次调用的超时秒数（由调用方传给 SDK / asyncio.wait_for）
+
+令牌或并发名额不足时最多等待 queue_timeout 秒，仍拿不到则拒绝，
+调用方应直接使用回退内容。所有状态通过 status() 暴露。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+
+class LLMUnavailable(Exception):
+    """LLM 调用被拒绝（熔断打开 / 限流 / 并发已满），调用方应使用回退内容"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    """线程安全的令牌桶：rate 个令牌/秒，最多积累 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """拿到令牌返回 0，否则返回还需等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def available(self) -> float:
+        with self._lock:
+            elapsed = time.monotonic() - self._updated
+            return min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+class CircuitBreaker:
+    """
+    熔断器：closed -> open（连续 failure_threshold 次失败）
+            open -> half_open（reset_timeout 秒后）
+            half_open -> closed（探测成功）/ open（探测失败）
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+
+    def allow(self) -> Tuple[bool, bool]:
+        """
+        返回 (是否放行本次调用, 是否占用了半开探测名额)；
+        半开状态下同一时间只放行一个探测
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True, False
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False, False
+                self._state = self.HALF_OPEN
+            if self._probe_in_flight:
+                return False, False
+            self._probe_in_flight = True
+            return True, True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def cancel_probe(self) -> None:
+        """半开探测在真正发出请求前被取消时归还探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def status(self) -> dict:
+        with self._lock:
+            state = self._state
+            retry_in = 0.0
+            if state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_in_seconds": round(retry_in, 3),
+                "times_opened": self.times_opened,
+            }
+
+
+class LLMGuard:
+    """
+    组合熔断器、令牌桶和并发上限；同一个实例同时服务同步和异步调用
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        rate_per_minute: float,
+        burst: float,
+        timeout: float,
+        queue_timeout: float,
+        failure_threshold: int,
+        reset_timeout: float
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.bucket = TokenBucket(rate=rate_per_minute / 60.0, capacity=burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._active = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "admitted": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "rejected_circuit_open": 0,
+            "rejected_rate_limited": 0,
+            "rejected_concurrency": 0,
+        }
+
+    def acquire(self) -> None:
+        """同步获取调用许可，失败抛出 LLMUnavailable"""
+        probe = self._check_breaker()
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while True:
+                reason, wait = self._try_admit()
+                if reason is None:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(reason)
+                time.sleep(min(wait, remaining))
+        except LLMUnavailable:
+            self._abandon_probe(probe)
+            raise
+
+    async def acquire_async(self) -> None:
+        """异步获取调用许可（等待期间不占用线程），失败抛出 LLMUnavailable"""
+        probe = self._check_breaker()
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while True:
+                reason, wait = self._try_admit()
+                if reason is None:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(reason)
+                await asyncio.sleep(min(wait, remaining))
+        except (LLMUnavailable, asyncio.CancelledError):
+            # 排队超时或等待期间调用方被取消（如客户端断开）：还没占用并发名额，
+            # 但可能已经拿到半开探测名额，不归还的话熔断器会一直停在半开状态
+            self._abandon_probe(probe)
+            raise
+
+    def release(self, success: bool) -> None:
+        """调用结束后释放许可，并把结果报告给熔断器"""
+        with self._lock:
+            self._active -= 1
+            self.stats["succeeded" if success else "failed"] += 1
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def status(self) -> dict:
+        with self._lock:
+            active = self._active
+            stats = dict(self.stats)
+        return {
+            "circuit": self.breaker.status(),
+            "active_calls": active,
+            "max_concurrency": self.max_concurrency,
+            "rate_limit_tokens": round(self.bucket.available(), 3),
+            "rate_per_minute": self.bucket.rate * 60,
+            "timeout_seconds": self.timeout,
+            "queue_timeout_seconds": self.queue_timeout,
+            **stats,
+        }
+
+    def _check_breaker(self) -> bool:
+        """熔断器拒绝时抛出 LLMUnavailable；返回本次调用是否占用了半开探测名额"""
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            self._reject("circuit_open")
+        return probe
+
+    def _abandon_probe(self, probe: bool) -> None:
+        """放弃本次调用：归还本次占用的半开探测名额（其他调用的探测不受影响）"""
+        if probe:
+            self.breaker.cancel_probe()
+
+    def _try_admit(self) -> "tuple[Optional[str], float]":
+        """返回 (拒绝原因, 建议等待秒数)；原因为 None 表示已放行并占用一个并发名额"""
+        with self._lock:
+            if self._active >= self.max_concurrency:
+                return "concurrency", 0.01
+            wait = self.bucket.try_acquire()
+            if wait > 0:
+                return "rate_limited", wait
+            self._active += 1
+            self.stats["admitted"] += 1
+            return None, 0.0
+
+    def _reject(self, reason: str) -> None:
+        with self._lock:
+            self.stats[f"rejected_{reason}"] += 1
+        raise LLMUnavailable(reason)
+
+
+llm_guard = LLMGuard(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+    rate_per_minute=float(os.getenv("LLM_RATE_PER_MINUTE", "600")),
+    burst=float(os.getenv("LLM_RATE_BURST", "20")),
+    timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "15")),
+    queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "2")),
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+)
@@ -0,0 +1,243 @@
+"""
+Passage sentence index for TOEFL Reading Error Diagnosis
+
+导入题库时把每篇文章切分成句子，写入 passage_sentences：
+句子在文章中的序号、所在段落、字符偏移（[start_offset, end_offset) 对应 Passage.content）
+以及规范化后的词集合（tokens）。同时把 Question.answer_sentence 和
+Step 2（sentence_location）的每个 choice 映射到句子 id。
+
+规则引擎诊断 Level 2 时直接比较学生所选句子与答案句的位置
+（相差几句、是否在同一段），不再在每次请求时扫描原文。
+
+- 段落：以换行分隔的非空行
+- 句子：句末标点（. ! ?，可跟引号 / 括号）后接空白和大写字母 / 数字 / 引号处切分，
+  跳过常见缩写（Dr. / e.g. / U.S. 等）和单个大写字母的姓名缩写
+- tokens：小写、去掉所有格 's、简单的复数还原（studies -> study，stresses -> stress，trees -> tree）、去停用词
+- choice 文本与句子的匹配：choice 的词有 SENTENCE_MATCH_THRESHOLD 以上出现在句子中即视为同一句
+  （允许 choice 对原句做删节），取覆盖率最高的句子
+
+新导入的语料在 import_content 中同步建索引；已有的数据由 build_sentence_index.py 回填。
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    Passage, PassageSentence, Question, ReflectionChoice, ReflectionStep
+)
+
+# Step 2 的步骤类型：choice 是文章中的句子
+SENTENCE_LOCATION_STEP_TYPE = "sentence_location"
+
+# choice 的词至少有这一比例出现在句子中，才认为 choice 指的是该句
+SENTENCE_MATCH_THRESHOLD = 0.6
+
+_ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "st", "sr", "jr", "vs", "etc", "e.g", "i.e",
+    "u.s", "u.k", "no", "fig", "approx", "ca", "cf", "al",
+}
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "by", "for", "with",
+    "from", "as", "is", "are", "was", "were", "be", "been", "being", "it", "its", "this",
+    "that", "these", "those", "which", "who", "whom", "whose", "than", "then", "such",
+}
+_PARAGRAPH = re.compile(r"[^\n]*\S[^\n]*")
+_SENTENCE_END = re.compile(r"[.!?]+[\"'”’)\]]*(?=\s+[\"'“‘(\[]?[A-Z0-9])")
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+@dataclass(frozen=True)
+class SentenceSpan:
+    """文章中的一个句子"""
+    sentence_index: int  # 在整篇文章中的序号（从 0 开始）
+    paragraph_index: int  # 所在段落（从 0 开始）
+    start_offset: int
+    end_offset: int
+    tokens: FrozenSet[str]
+
+
+def _stem(word: str) -> str:
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "ches", "shes", "xes", "zes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_tokens(text: Optional[str]) -> FrozenSet[str]:
+    """规范化词集合（小写、去所有格和复数、去停用词）"""
+    if not text:
+        return frozenset()
+    text = text.lower().replace("’", "'")
+    return frozenset(
+        stem for stem in (_stem(word) for word in _WORD.findall(text))
+        if stem and stem not in _STOPWORDS
+    )
+
+
+def _is_abbreviation(paragraph: str, end: int) -> bool:
+    """paragraph[end] 处的句点是否属于缩写"""
+    start = end
+    while start > 0 and not paragraph[start - 1].isspace():
+        start -= 1
+    word = paragraph[start:end].lstrip("(\"'“‘").lower()
+    return word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+
+def split_sentences(content: str) -> List[SentenceSpan]:
+    """把文章切分为句子，偏移量相对于整篇 content"""
+    spans = []
+    for paragraph_index, paragraph in enumerate(_PARAGRAPH.finditer(content or "")):
+        text, base = paragraph.group(), paragraph.start()
+        start = 0
+        boundaries = [
+            match.end() for match in _SENTENCE_END.finditer(text)
+            if not (text[match.start()] == "." and _is_abbreviation(text, match.start()))
+        ]
+        for end in boundaries + [len(text)]:
+            sentence = text[start:end]
+            stripped = sentence.strip()
+            if stripped:
+                left = start + (len(sentence) - len(sentence.lstrip()))
+                spans.append(SentenceSpan(
+                    sentence_index=len(spans),
+                    paragraph_index=paragraph_index,
+                    start_offset=base + left,
+                    end_offset=base + left + len(stripped),
+                    tokens=normalize_tokens(stripped),
+                ))
+            start = end
+    return spans
+
+
+def match_sentence(text: Optional[str], spans: Sequence[SentenceSpan]) -> Optional[SentenceSpan]:
+    """找出 text 指的是哪一句（choice 可能是删节后的原句）；没有足够相似的句子时返回 None"""
+    tokens = normalize_tokens(text)
+    if not tokens:
+        return None
+    best, best_score = None, (0.0, 0.0)
+    for span in spans:
+        common = len(tokens & span.tokens)
+        if not common:
+            continue
+        score = (common / len(tokens), common / len(span.tokens))
+        if score > best_score:
+            best, best_score = span, score
+    return best if best_score[0] >= SENTENCE_MATCH_THRESHOLD else None
+
+
+def index_sentences(
+    db: Session,
+    passages: Dict[int, str],
+    answer_sentences: Iterable[Tuple[int, int, Optional[str]]],
+    location_choices: Iterable[Tuple[int, int, Optional[str]]]
+) -> int:
+    """
+    为一批文章重建句子索引（不提交事务），返回写入的句子数
+
+    passages: passage_id -> content
+    answer_sentences: (question_id, passage_id, answer_sentence)
+    location_choices: Step 2 的 (choice_id, passage_id, choice_text)
+
+    按 (passage_id, sentence_index) 更新已有的句子行，内容不变时句子 id 保持不变；
+    文章变短后多出的句子在解除引用后删除。
+    """
+    if not passages:
+        return 0
+    spans = {passage_id: split_sentences(content) for passage_id, content in passages.items()}
+    passage_ids = list(passages)
+
+    existing = {
+        (passage_id, sentence_index): sentence_id
+        for sentence_id, passage_id, sentence_index in db.query(
+            PassageSentence.id, PassageSentence.passage_id, PassageSentence.sentence_index
+        ).filter(PassageSentence.passage_id.in_(passage_ids))
+    }
+    rows = [
+        {
+            "passage_id": passage_id,
+            "sentence_index": span.sentence_index,
+            "paragraph_index": span.paragraph_index,
+            "start_offset": span.start_offset,
+            "end_offset": span.end_offset,
+            "tokens": sorted(span.tokens),
+        }
+        for passage_id, passage_spans in spans.items() for span in passage_spans
+    ]
+    updates = [
+        {"id": existing[(row["passage_id"], row["sentence_index"])], **row}
+        for row in rows if (row["passage_id"], row["sentence_index"]) in existing
+    ]
+    inserts = [row for row in rows if (row["passage_id"], row["sentence_index"]) not in existing]
+    sentence_ids = dict(existing)
+    if updates:
+        db.execute(update(PassageSentence), updates)
+    if inserts:
+        statement = insert(PassageSentence).returning(
+            PassageSentence.id, PassageSentence.passage_id, PassageSentence.sentence_index
+        )
+        for sentence_id, passage_id, sentence_index in db.execute(statement, inserts):
+            sentence_ids[(passage_id, sentence_index)] = sentence_id
+
+    def sentence_id_for(passage_id: int, text: Optional[str]) -> Optional[int]:
+        span = match_sentence(text, spans.get(passage_id, ()))
+        return sentence_ids[(passage_id, span.sentence_index)] if span else None
+
+    question_rows = [
+        {"id": question_id, "answer_sentence_id": sentence_id_for(passage_id, text)}
+        for question_id, passage_id, text in answer_sentences
+    ]
+    choice_rows = [
+        {"id": choice_id, "sentence_id": sentence_id_for(passage_id, text)}
+        for choice_id, passage_id, text in location_choices
+    ]
+    if question_rows:
+        db.execute(update(Question), question_rows)
+    if choice_rows:
+        db.execute(update(ReflectionChoice), choice_rows)
+
+    # 文章变短后多出的句子：先解除仍引用它们的题目 / choice（如语料中已删除的题），再删除
+    surplus = [
+        sentence_id for (passage_id, sentence_index), sentence_id in existing.items()
+        if sentence_index >= len(spans[passage_id])
+    ]
+    if surplus:
+        db.execute(
+            update(Question).where(Question.answer_sentence_id.in_(surplus))
+            .values(answer_sentence_id=None)
+        )
+        db.execute(
+            update(ReflectionChoice).where(ReflectionChoice.sentence_id.in_(surplus))
+            .values(sentence_id=None)
+        )
+        db.execute(delete(PassageSentence).where(PassageSentence.id.in_(surplus)))
+    return len(rows)
+
+
+def index_passages(db: Session, passage_ids: Sequence[int]) -> int:
+    """从数据库读取文章、答案句和 Step 2 choices 并重建句子索引（不提交事务）"""
+    passages = dict(
+        db.query(Passage.id, Passage.content).filter(Passage.id.in_(list(passage_ids))).all()
+    )
+    answer_sentences = db.query(Question.id, Question.passage_id, Question.answer_sentence).filter(
+        Question.passage_id.in_(list(passages))
+    ).all()
+    location_choices = (
+        db.query(ReflectionChoice.id, Question.passage_id, ReflectionChoice.choice_text)
+        .join(ReflectionStep, ReflectionStep.id == ReflectionChoice.reflection_step_id)
+        .join(Question, Question.id == ReflectionStep.question_id)
+        .filter(
+            Question.passage_id.in_(list(passages)),
+            ReflectionStep.step_type == SENTENCE_LOCATION_STEP_TYPE
+        )
+        .all()
+    )
+    return index_sentences(db, passages, answer_sentences, location_choices)
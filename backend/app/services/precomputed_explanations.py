@@ -0,0 +1,184 @@
+"""
+Precomputed explanation matrix for TOEFL Reading Error Diagnosis
+
+每道题的复盘选项是有限的（题库导入器 content_import.py 写入的
+step1-step5 choices），ErrorDiagnoser 把每种组合映射到五个层级之一。
+诊断结果真正取决于的是"关键 choice"：
+
+- level_1: Step 1 选择的定位词
+- level_2: Step 2 选择的答案句
+- level_3: Step 3 选择的理解
+- level_4: 误判错误选项吸引力 -> Step 4A；正确选项理解不足 -> Step 4B
+- level_5: 无
+
+precompute_explanations.py 离线遍历所有可达的
+(题目, 所选错误选项, error_level, error_type, 关键 choice) 路径，预先生成解释
+写入 precomputed_explanations 表。提交复盘时没有自由输入就按路径查表，
+只有填写了自由输入的复盘才需要实时调用 LLM。
+"""
+
+import threading
+from dataclasses import dataclass
+from itertools import product
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.models import PrecomputedExplanation, Question
+from app.services.cache import precomputed_cache
+from app.services.gemini_service import PROMPT_VERSION
+from app.services.rule_engine import (
+    ChoiceSnapshot, DiagnosisResult, ErrorDiagnoser, SentenceSnapshot, evaluate_steps
+)
+
+# 路径键：(selected_option_id, error_level, error_type, salient_choice_id)
+PathKey = Tuple[int, str, str, Optional[int]]
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def salient_choice_id(
+    diagnosis_result: DiagnosisResult,
+    step1_choice_id: Optional[int],
+    step2_choice_id: Optional[int],
+    step3_choice_id: Optional[int],
+    step4a_choice_id: Optional[int],
+    step4b_choice_id: Optional[int]
+) -> Optional[int]:
+    """返回决定该诊断结果的那一步的 choice ID（level_5 返回 None）"""
+    level = diagnosis_result.error_level
+    if level == "level_1":
+        return step1_choice_id
+    if level == "level_2":
+        return step2_choice_id
+    if level == "level_3":
+        return step3_choice_id
+    if level == "level_4":
+        if diagnosis_result.error_type == "误判错误选项吸引力":
+            return step4a_choice_id
+        return step4b_choice_id
+    return None
+
+
+@dataclass
+class DiagnosisPath:
+    """一条可达的诊断路径及其代表性的复盘选择（用于生成 prompt）"""
+    error_level: str
+    error_type: str
+    salient_choice_id: Optional[int]
+    diagnosis_result: DiagnosisResult
+    llm_context: dict
+
+
+def enumerate_paths(question: Question) -> List[DiagnosisPath]:
+    """
+    遍历一道题 Step 1-5 所有 choice 组合，返回去重后的诊断路径
+
+    question 需要已加载 reflection_steps 及其 choices（以及 choice 的 sentence、
+    question 的 answer_sentence_location，未加载时按需懒加载）。同一路径取第一个出现的
+    组合作为代表：每一步的 choices 按"正确的在前"排序，因此代表组合里
+    非关键步骤尽量是正确选择，prompt 聚焦在关键 choice 上。
+    Step 6（自我诊断）不影响诊断结果，代表组合中留空。
+    """
+    steps = {}
+    for step in question.reflection_steps:
+        steps[step.step_number] = sorted(
+            (ChoiceSnapshot.from_model(choice, choice.sentence) for choice in step.choices),
+            key=lambda c: (not c.is_correct, c.choice_order or 0)
+        )
+    choices = MappingProxyType({c.id: c for step_choices in steps.values() for c in step_choices})
+    answer_sentence = SentenceSnapshot.from_model(question.answer_sentence_location)
+
+    paths = {}
+    for step1, step2, step3, step4a, step4b in product(*(steps.get(n, [None]) for n in range(1, 6))):
+        step1_is_correct, step2_is_correct, step3_quality = evaluate_steps(step1, step2, step3)
+        ids = [c.id if c else None for c in (step1, step2, step3, step4a, step4b)]
+        diagnoser = ErrorDiagnoser(
+            choices=choices,
+            step1_is_correct=step1_is_correct,
+            step1_choice_id=ids[0],
+            step2_is_correct=step2_is_correct,
+            step2_choice_id=ids[1],
+            step3_quality=step3_quality,
+            step3_choice_id=ids[2],
+            step3_custom_input=None,
+            step4a_choice_id=ids[3],
+            step4b_choice_id=ids[4],
+            step5_choice_id=None,
+            answer_sentence=answer_sentence
+        )
+        result = diagnoser.diagnose()
+        salient = salient_choice_id(result, *ids)
+        key = (result.error_level, result.error_type, salient)
+        if key not in paths:
+            paths[key] = DiagnosisPath(
+                error_level=result.error_level,
+                error_type=result.error_type,
+                salient_choice_id=salient,
+                diagnosis_result=result,
+                llm_context=diagnoser.get_context_for_llm()
+            )
+    return list(paths.values())
+
+
+def load_question_matrix(db: Session, question_id: int) -> Mapping[PathKey, Tuple[str, str]]:
+    """加载一道题当前 PROMPT_VERSION 的预生成解释（按题缓存在进程内）"""
+    matrix = precomputed_cache.get(question_id)
+    if matrix is not None:
+        return matrix
+    rows = db.query(PrecomputedExplanation).filter(
+        PrecomputedExplanation.question_id == question_id,
+        PrecomputedExplanation.prompt_version == PROMPT_VERSION
+    ).all()
+    matrix = MappingProxyType({
+        (row.selected_option_id, row.error_level, row.error_type, row.salient_choice_id):
+            (row.llm_explanation, row.llm_suggestion)
+        for row in rows
+    })
+    precomputed_cache.set(question_id, matrix)
+    return matrix
+
+
+def lookup_precomputed(
+    db: Session,
+    question_id: int,
+    selected_option_id: int,
+    diagnosis_result: DiagnosisResult,
+    reflection
+) -> Optional[Tuple[str, str]]:
+    """
+    按诊断路径查找预生成的 (explanation, suggestion)，未命中返回 None
+
+    reflection 可以是 ReflectionSubmit 或 ReflectionResponse。
+    调用方负责只在没有自由输入时查表。
+    """
+    matrix = load_question_matrix(db, question_id)
+    key = (
+        selected_option_id,
+        diagnosis_result.error_level,
+        diagnosis_result.error_type,
+        salient_choice_id(
+            diagnosis_result,
+            reflection.step1_choice_id,
+            reflection.step2_choice_id,
+            reflection.step3_choice_id,
+            reflection.step4a_choice_id,
+            reflection.step4b_choice_id
+        )
+    )
+    result = matrix.get(key)
+    with _stats_lock:
+        _stats["hits" if result is not None else "misses"] += 1
+    return result
+
+
+def precomputed_stats() -> dict:
+    """查表命中统计"""
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,256 @@
+"""
+Weakness-driven next-question recommender for TOEFL Reading Error Diagnosis
+
+GET /api/users/{id}/next-questions 按学生的错误画像对整个题库打分排序。
+每道题的特征在内存中保存为 NumPy 数组（QuestionFeatures），请求时只做向量运算：
+
+- difficulty: 平滑后的错误率（题目答错次数 / 答题次数）
+- level_rates: 平滑后的各层级错误率（该层级诊断次数 / 答题次数），N x 5 矩阵
+- type_index: question_type 在类型表中的下标
+
+特征来自 refresh_rollups.py 维护的全体学生题目汇总（question_rollups 中
+cohort = ALL_COHORTS 的行），一条查询加载；答题数少的题向全局均值平滑。
+
+打分（越高越优先）：
+    score = level_rates @ w_level
+          + TYPE_WEIGHT * w_type[type_index]
+          - DIFFICULTY_WEIGHT * |difficulty - TARGET_DIFFICULTY|
+w_level 是画像中累计与最近窗口层级分布的平均，w_type 是最近窗口中各题型的错误占比；
+没有画像的学生 w_level 取均匀分布。最近答过的题在排序前屏蔽。
+
+索引的加载与失效方式与 AnswerKeyIndex 相同：启动时预加载，ttl 秒后过期，
+题库写入后 `invalidate_content_caches()`（其他进程写入时经内容版本号通知）
+使其在下次请求时重新加载。
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from app.models.models import Question, QuestionRollup, UserErrorProfile
+from app.services.dashboard_rollups import ALL_COHORTS
+
+LEVELS = ("level_1", "level_2", "level_3", "level_4", "level_5")
+
+# 平滑强度：相当于额外加入 SMOOTHING 次按全局均值分布的答题
+SMOOTHING = 5.0
+TYPE_WEIGHT = 0.2
+DIFFICULTY_WEIGHT = 0.5
+TARGET_DIFFICULTY = float(os.getenv("RECOMMENDER_TARGET_DIFFICULTY", "0.5"))
+# 排序时屏蔽的最近答过的题目数
+RECENT_EXCLUDE = int(os.getenv("RECOMMENDER_RECENT_EXCLUDE", "200"))
+
+
+@dataclass(frozen=True)
+class QuestionFeatures:
+    """题库特征矩阵（按 question_id 升序排列）"""
+    question_ids: np.ndarray  # (N,) int64
+    question_types: Tuple[str, ...]  # 题型表
+    type_index: np.ndarray  # (N,) int64，下标指向 question_types
+    difficulty: np.ndarray  # (N,) float64
+    level_rates: np.ndarray  # (N, len(LEVELS)) float64
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+
+@dataclass(frozen=True)
+class Recommendation:
+    question_id: int
+    question_type: str
+    score: float
+    difficulty: float
+    focus_level: str  # 该题对学生薄弱层级贡献最大的层级
+
+
+def build_features(rows: Iterable[tuple]) -> QuestionFeatures:
+    """
+    由 (question_id, question_type, answer_count, correct_count, level_counts) 行构建特征矩阵
+
+    rows 需按 question_id 升序；没有汇总数据的题目 answer_count 为 None。
+    """
+    rows = list(rows)
+    n = len(rows)
+    question_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+    types = sorted({row[1] for row in rows})
+    type_lookup = {t: i for i, t in enumerate(types)}
+    type_index = np.fromiter((type_lookup[row[1]] for row in rows), dtype=np.int64, count=n)
+    answers = np.fromiter((row[2] or 0 for row in rows), dtype=np.float64, count=n)
+    correct = np.fromiter((row[3] or 0 for row in rows), dtype=np.float64, count=n)
+    level_counts = np.array(
+        [[(row[4] or {}).get(level, 0) for level in LEVELS] for row in rows], dtype=np.float64
+    ).reshape(n, len(LEVELS))
+
+    total_answers = answers.sum()
+    global_error = (total_answers - correct.sum()) / total_answers if total_answers else 0.5
+    global_levels = (
+        level_counts.sum(axis=0) / total_answers if total_answers
+        else np.full(len(LEVELS), global_error / len(LEVELS))
+    )
+    denominator = answers + SMOOTHING
+    difficulty = (answers - correct + SMOOTHING * global_error) / denominator
+    level_rates = (level_counts + SMOOTHING * global_levels) / denominator[:, None]
+
+    return QuestionFeatures(
+        question_ids=question_ids,
+        question_types=tuple(types),
+        type_index=type_index,
+        difficulty=difficulty,
+        level_rates=level_rates,
+    )
+
+
+def _distribution(counts: Optional[dict]) -> Optional[np.ndarray]:
+    vector = np.array([(counts or {}).get(level, 0) for level in LEVELS], dtype=np.float64)
+    total = vector.sum()
+    return vector / total if total else None
+
+
+def profile_weights(
+    profile: Optional[UserErrorProfile],
+    features: QuestionFeatures
+) -> Tuple[np.ndarray, np.ndarray]:
+    """由错误画像得到 (w_level, w_type)；w_type 按最近窗口中各题型的错误占比计算"""
+    w_type = np.zeros(len(features.question_types))
+    if profile is None:
+        return np.full(len(LEVELS), 1.0 / len(LEVELS)), w_type
+
+    shares = [d for d in (_distribution(profile.level_counts), _distribution(profile.recent_level_counts))
+              if d is not None]
+    w_level = np.mean(shares, axis=0) if shares else np.full(len(LEVELS), 1.0 / len(LEVELS))
+
+    trajectory = profile.trajectory or []
+    if trajectory:
+        ids = np.array([entry["question_id"] for entry in trajectory], dtype=np.int64)
+        rows = _rows_of(features, ids)
+        rows = rows[rows >= 0]
+        if len(rows):
+            w_type = np.bincount(features.type_index[rows], minlength=len(w_type)) / len(trajectory)
+    return w_level, w_type
+
+
+def _rows_of(features: QuestionFeatures, question_ids: np.ndarray) -> np.ndarray:
+    """question_id -> 行号（不在题库中的为 -1）"""
+    if not len(features):
+        return np.full(len(question_ids), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(features.question_ids, question_ids), len(features) - 1)
+    return np.where(features.question_ids[positions] == question_ids, positions, -1)
+
+
+def rank(
+    features: QuestionFeatures,
+    w_level: np.ndarray,
+    w_type: np.ndarray,
+    exclude_ids: Sequence[int] = (),
+    limit: int = 10
+) -> List[Recommendation]:
+    """对全部题目向量化打分，屏蔽 exclude_ids 后返回得分最高的 limit 道题"""
+    if not len(features) or limit <= 0:
+        return []
+
+    weighted = features.level_rates * w_level
+    scores = (
+        weighted.sum(axis=1)
+        + TYPE_WEIGHT * w_type[features.type_index]
+        - DIFFICULTY_WEIGHT * np.abs(features.difficulty - TARGET_DIFFICULTY)
+    )
+    if len(exclude_ids):
+        rows = _rows_of(features, np.asarray(exclude_ids, dtype=np.int64))
+        scores[rows[rows >= 0]] = -np.inf
+
+    if limit < len(scores):
+        top = np.argpartition(-scores, limit)[:limit]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    top = top[np.isfinite(scores[top])]
+
+    focus = weighted[top].argmax(axis=1)
+    return [
+        Recommendation(
+            question_id=int(features.question_ids[row]),
+            question_type=features.question_types[features.type_index[row]],
+            score=round(float(scores[row]), 4),
+            difficulty=round(float(features.difficulty[row]), 4),
+            focus_level=LEVELS[level],
+        )
+        for row, level in zip(top, focus)
+    ]
+
+
+class QuestionFeatureIndex:
+    """
+    线程安全的题库特征索引
+
+    重新加载时整体替换 QuestionFeatures，读取方不需要加锁。
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._features = build_features([])
+        self._loaded_at = 0.0
+        self._stale = True
+        # invalidate() 的次数：加载期间发生的失效不会被这次加载清除
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_seconds = 0.0
+
+    def load(self, db: Session) -> int:
+        """从题目表和全体学生的题目汇总加载特征，返回题目数"""
+        started = time.monotonic()
+        with self._lock:
+            generation = self._generation
+        rows = (
+            db.query(
+                Question.id, Question.question_type, QuestionRollup.answer_count,
+                QuestionRollup.correct_count, QuestionRollup.level_counts
+            )
+            .outerjoin(QuestionRollup, and_(
+                QuestionRollup.question_id == Question.id, QuestionRollup.cohort == ALL_COHORTS
+            ))
+            .order_by(Question.id)
+            .all()
+        )
+        features = build_features(rows)
+        with self._lock:
+            self._features = features
+            self._loaded_at = time.monotonic()
+            self._stale = self._generation != generation
+            self.loads += 1
+            self.load_seconds = self._loaded_at - started
+        return len(features)
+
+    def get(self, db: Session) -> QuestionFeatures:
+        """返回当前特征；索引过期时先从数据库重新加载"""
+        with self._lock:
+            age = time.monotonic() - self._loaded_at
+            needs_load = self._stale or (self.ttl > 0 and age > self.ttl)
+        if needs_load:
+            self.load(db)
+        return self._features
+
+    def invalidate(self) -> None:
+        """标记索引过期，下次请求时重新加载"""
+        with self._lock:
+            self._stale = True
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "questions": len(self._features),
+                "loads": self.loads,
+                "load_seconds": round(self.load_seconds, 3),
+                "age_seconds": round(time.monotonic() - self._loaded_at, 3) if self.loads else None,
+                "ttl": self.ttl,
+            }
+
+
+question_feature_index = QuestionFeatureIndex(ttl=float(os.getenv("RECOMMENDER_TTL", "600")))
@@ -0,0 +1,175 @@
+"""
+Reflection diagnosis context for TOEFL Reading Error Diagnosis
+
+把一次复盘（ReflectionSubmit 或已保存的 ReflectionResponse）转换成调用 LLM
+之前需要的全部上下文：各步骤正误、题目信息、规则引擎诊断结果、LLM prompt
+上下文和解释缓存键。API 路由、流式诊断和离线批处理脚本共用这一逻辑。
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from app.core.metrics import track_phase
+from app.models.models import Passage, PassageSentence, Question, Option, UserAnswer
+from app.services.rule_engine import (
+    ErrorDiagnoser, DiagnosisResult, SentenceSnapshot, evaluate_steps,
+    load_choice_snapshot, load_correct_choices
+)
+from app.services.gemini_service import MODEL_NAME, PROMPT_VERSION, is_fallback_response
+from app.services.explanation_cache import explanation_cache, explanation_fingerprint, is_cacheable
+from app.services.precomputed_explanations import lookup_precomputed
+
+
+@dataclass
+class PreparedReflection:
+    """复盘提交在调用 LLM 之前的中间结果（规则诊断 + 前端对比文本）"""
+    step1_is_correct: bool
+    step2_is_correct: bool
+    step3_quality: str
+    question_data: dict
+    diagnosis_result: DiagnosisResult
+    llm_context: dict
+    cache_key: Optional[str]
+    step1_student_choice: str
+    step1_correct_answer: str
+    step2_student_choice: str
+    step2_correct_answer: str
+    step3_student_understanding: str
+    step3_correct_understanding: str
+    # 预生成解释矩阵命中时的 (explanation, suggestion)，无需再调用 LLM
+    precomputed: Optional[Tuple[str, str]] = None
+    # 答题的用户（保存复盘时更新其错误画像）
+    user_id: Optional[int] = None
+
+    def prompt_version_for(self, llm_explanation: str, llm_suggestion: str) -> Optional[int]:
+        """解释由 LLM 生成（或来自 LLM 缓存）时返回当前 PROMPT_VERSION，回退内容返回 None"""
+        if is_fallback_response(
+            (llm_explanation, llm_suggestion),
+            self.diagnosis_result.error_level,
+            self.diagnosis_result.error_type,
+            self.diagnosis_result.details
+        ):
+            return None
+        return PROMPT_VERSION
+
+
+def build_question_data(question: Question, passage: Passage, selected_option: Option, correct_option: Option) -> dict:
+    """构建规则引擎和 LLM prompt 使用的题目信息"""
+    return {
+        "question_id": question.id,
+        "stem": question.stem,
+        "passage_content": passage.content,
+        "correct_answer": f"{correct_option.option_label}: {correct_option.option_text}",
+        "user_answer": f"{selected_option.option_label}: {selected_option.option_text}"
+    }
+
+
+def diagnose_reflection(reflection, user_answer: UserAnswer, db: Session) -> PreparedReflection:
+    """
+    加载题目上下文并执行规则引擎诊断
+    
+    reflection 可以是 ReflectionSubmit，也可以是已保存的 ReflectionResponse
+    （两者的 stepN_choice_id / stepN_custom_input 字段同名）。
+    """
+    
+    # 一次性加载学生选择的 6 个 choices（单条 IN 查询），后续判断不再访问数据库
+    choices = load_choice_snapshot(db, [
+        reflection.step1_choice_id, reflection.step2_choice_id, reflection.step3_choice_id,
+        reflection.step4a_choice_id, reflection.step4b_choice_id, reflection.step5_choice_id
+    ])
+    
+    # 判断各步骤的正误
+    step1_choice = choices.get(reflection.step1_choice_id)
+    step2_choice = choices.get(reflection.step2_choice_id)
+    step3_choice = choices.get(reflection.step3_choice_id)
+    
+    step1_is_correct, step2_is_correct, step3_quality = evaluate_steps(
+        step1_choice, step2_choice, step3_choice
+    )
+        
+    # 获取题目完整上下文（用于规则引擎和 LLM）
+    question = db.query(Question).filter(Question.id == user_answer.question_id).first()
+    passage = db.query(Passage).filter(Passage.id == question.passage_id).first()
+    selected_option = db.query(Option).filter(Option.id == user_answer.selected_option_id).first()
+    correct_option = db.query(Option).filter(
+        Option.question_id == question.id,
+        Option.is_correct == True
+    ).first()
+    
+    question_data = build_question_data(question, passage, selected_option, correct_option)
+    answer_sentence = (
+        db.get(PassageSentence, question.answer_sentence_id) if question.answer_sentence_id else None
+    )
+    
+    # 规则引擎诊断
+    diagnoser = ErrorDiagnoser(
+        choices=choices,
+        step1_is_correct=step1_is_correct,
+        step1_choice_id=reflection.step1_choice_id,
+        step2_is_correct=step2_is_correct,
+        step2_choice_id=reflection.step2_choice_id,
+        step3_quality=step3_quality,
+        step3_choice_id=reflection.step3_choice_id,
+        step3_custom_input=reflection.step3_custom_input,
+        step4a_choice_id=reflection.step4a_choice_id,
+        step4b_choice_id=reflection.step4b_choice_id,
+        step5_choice_id=reflection.step5_choice_id,
+        question_data=question_data,
+        answer_sentence=SentenceSnapshot.from_model(answer_sentence)
+    )
+    
+    # 执行诊断
+    with track_phase("rule_engine"):
+        diagnosis_result = diagnoser.diagnose()
+    
+    # LLM 解释缓存键和预生成解释（有自由输入时绕过缓存，需要实时调用 LLM）
+    cache_key = None
+    precomputed = None
+    if is_cacheable(reflection.step3_custom_input, reflection.step5_custom_input):
+        cache_key = explanation_fingerprint(
+            question_id=question.id,
+            selected_option_id=user_answer.selected_option_id,
+            step1_choice_id=reflection.step1_choice_id,
+            step2_choice_id=reflection.step2_choice_id,
+            step3_choice_id=reflection.step3_choice_id,
+            step5_choice_id=reflection.step5_choice_id,
+            error_level=diagnosis_result.error_level,
+            error_type=diagnosis_result.error_type,
+            prompt_version=PROMPT_VERSION,
+            model_name=MODEL_NAME
+        )
+        precomputed = lookup_precomputed(
+            db, question.id, user_answer.selected_option_id, diagnosis_result, reflection
+        )
+    else:
+        explanation_cache.record_bypass()
+    
+    # 获取每个步骤的学生选择和正确答案（用于前端对比展示）
+    correct_choices = load_correct_choices(
+        db, [c.reflection_step_id for c in (step1_choice, step2_choice, step3_choice) if c]
+    )
+    
+    def correct_text(choice):
+        correct = correct_choices.get(choice.reflection_step_id) if choice else None
+        return correct.choice_text if correct else "未找到正确答案"
+    
+    return PreparedReflection(
+        step1_is_correct=step1_is_correct,
+        step2_is_correct=step2_is_correct,
+        step3_quality=step3_quality,
+        question_data=question_data,
+        diagnosis_result=diagnosis_result,
+        llm_context=diagnoser.get_context_for_llm(),
+        cache_key=cache_key,
+        # Step 1: 定位词识别
+        step1_student_choice=step1_choice.choice_text if step1_choice else "",
+        step1_correct_answer=correct_text(step1_choice),
+        # Step 2: 答案句定位
+        step2_student_choice=step2_choice.choice_text if step2_choice else "",
+        step2_correct_answer=correct_text(step2_choice),
+        # Step 3: 答案句理解
+        step3_student_understanding=step3_choice.choice_text if step3_choice else "",
+        step3_correct_understanding=correct_text(step3_choice),
+        precomputed=precomputed,
+        user_id=user_answer.user_id,
+    )
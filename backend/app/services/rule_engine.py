@@ -3,12 +3,18 @@ Rule Engine for TOEFL Reading Error Diagnosis
 
 This module implements a rule-based system to diagnose student errors
 in TOEFL reading comprehension questions through structured reflection.
+
+诊断本身是纯 CPU 计算：调用方先用 `load_choice_snapshot()` 一次性
+（单条 IN 查询）取出学生选择的 choices，再交给 `ErrorDiagnoser`。
+Step 2 的 choice 快照带有其在文章句子索引中的位置（见 app/services/passage_index.py），
+Level 2 诊断直接比较句子序号和段落，不再扫描原文。
 """
 
 from dataclasses import dataclass
-from typing import Optional
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
 from sqlalchemy.orm import Session
-from app.models.models import ReflectionChoice
+from app.models.models import PassageSentence, ReflectionChoice
 
 
 @dataclass
@@ -19,6 +25,116 @@ class DiagnosisResult:
     details: dict     # 详细分析信息（用于 LLM prompt）
 
 
+@dataclass(frozen=True)
+class SentenceSnapshot:
+    """文章句子索引中一个句子的位置"""
+    id: int
+    sentence_index: int
+    paragraph_index: int
+
+    @classmethod
+    def from_model(cls, sentence: Optional[PassageSentence]) -> "Optional[SentenceSnapshot]":
+        if sentence is None:
+            return None
+        return cls(
+            id=sentence.id,
+            sentence_index=sentence.sentence_index,
+            paragraph_index=sentence.paragraph_index,
+        )
+
+
+@dataclass(frozen=True)
+class ChoiceSnapshot:
+    """复盘 choice 的只读快照，与数据库 session 无关"""
+    id: int
+    reflection_step_id: int
+    choice_text: str
+    is_correct: bool
+    choice_order: Optional[int]
+    # Step 2 choice 对应的文章句子（未建索引或不是句子时为 None）
+    sentence: Optional[SentenceSnapshot] = None
+
+    @classmethod
+    def from_model(
+        cls, choice: ReflectionChoice, sentence: Optional[PassageSentence] = None
+    ) -> "ChoiceSnapshot":
+        return cls(
+            id=choice.id,
+            reflection_step_id=choice.reflection_step_id,
+            choice_text=choice.choice_text,
+            is_correct=bool(choice.is_correct),
+            choice_order=choice.choice_order,
+            sentence=SentenceSnapshot.from_model(sentence),
+        )
+
+
+def load_choice_snapshot(db: Session, choice_ids: Iterable[Optional[int]]) -> Mapping[int, ChoiceSnapshot]:
+    """
+    用一条 IN 查询加载学生选择的 choices
+
+    Args:
+        db: 数据库 session
+        choice_ids: 各步骤选择的 choice ID（None 会被忽略）
+
+    Returns:
+        Mapping[int, ChoiceSnapshot]: 只读的 choice_id -> 快照 映射
+    """
+    ids = {choice_id for choice_id in choice_ids if choice_id}
+    if not ids:
+        return MappingProxyType({})
+    rows = (
+        db.query(ReflectionChoice, PassageSentence)
+        .outerjoin(PassageSentence, PassageSentence.id == ReflectionChoice.sentence_id)
+        .filter(ReflectionChoice.id.in_(ids))
+        .all()
+    )
+    return MappingProxyType({
+        choice.id: ChoiceSnapshot.from_model(choice, sentence) for choice, sentence in rows
+    })
+
+
+def load_correct_choices(db: Session, step_ids: Iterable[int]) -> Mapping[int, ChoiceSnapshot]:
+    """
+    用一条 IN 查询加载若干复盘步骤的正确 choice
+
+    Returns:
+        Mapping[int, ChoiceSnapshot]: 只读的 reflection_step_id -> 正确 choice 快照 映射
+    """
+    ids = {step_id for step_id in step_ids if step_id}
+    if not ids:
+        return MappingProxyType({})
+    rows = db.query(ReflectionChoice).filter(
+        ReflectionChoice.reflection_step_id.in_(ids),
+        ReflectionChoice.is_correct == True
+    ).all()
+    return MappingProxyType({row.reflection_step_id: ChoiceSnapshot.from_model(row) for row in rows})
+
+
+def evaluate_steps(
+    step1_choice: Optional[ChoiceSnapshot],
+    step2_choice: Optional[ChoiceSnapshot],
+    step3_choice: Optional[ChoiceSnapshot]
+) -> "tuple[bool, bool, str]":
+    """
+    根据学生在 Step 1-3 的选择判断各步骤正误
+
+    Returns:
+        (step1_is_correct, step2_is_correct, step3_quality)
+        step3_quality 为 "correct" / "wrong" / "unknown"（选择了"以上都不对"）
+    """
+    step1_is_correct = step1_choice.is_correct if step1_choice else False
+    step2_is_correct = step2_choice.is_correct if step2_choice else False
+
+    # Step 3 理解质量判断
+    if step3_choice and step3_choice.is_correct:
+        step3_quality = "correct"
+    elif step3_choice and step3_choice.choice_order == 4:  # "以上都不对"
+        step3_quality = "unknown"
+    else:
+        step3_quality = "wrong"
+    return step1_is_correct, step2_is_correct, step3_quality
+
+
 class ErrorDiagnoser:
     """
     错误诊断规则引擎
@@ -33,7 +149,7 @@ class ErrorDiagnoser:
     
     def __init__(
         self,
-        db: Session,
+        choices: Mapping[int, ChoiceSnapshot],
         step1_is_correct: bool,
         step1_choice_id: int,
         step2_is_correct: bool,
@@ -44,13 +160,14 @@ class ErrorDiagnoser:
         step4a_choice_id: int,
         step4b_choice_id: int,
         step5_choice_id: int,
-        question_data: dict = None
+        question_data: dict = None,
+        answer_sentence: Optional[SentenceSnapshot] = None
     ):
         """
         初始化诊断器
         
         Args:
-            db: 数据库 session
+            choices: 预先加载的 choice 快照（choice_id -> ChoiceSnapshot），见 load_choice_snapshot()
             step1_is_correct: Step 1 是否正确
             step1_choice_id: Step 1 选择的 choice ID
             step2_is_correct: Step 2 是否正确
@@ -62,8 +179,9 @@ class ErrorDiagnoser:
             step4b_choice_id: Step 4B (正确选项) 选择的 choice ID
             step5_choice_id: Step 5 自我诊断选择的 choice ID
             question_data: 可选的题目上下文信息
+            answer_sentence: 答案句在文章句子索引中的位置（用于 Level 2 定位偏差分析）
         """
-        self.db = db
+        self.choices = choices
         self.step1_is_correct = step1_is_correct
         self.step1_choice_id = step1_choice_id
         self.step2_is_correct = step2_is_correct
@@ -75,6 +193,11 @@ class ErrorDiagnoser:
         self.step4b_choice_id = step4b_choice_id
         self.step5_choice_id = step5_choice_id
         self.question_data = question_data or {}
+        self.answer_sentence = answer_sentence
+    
+    def _choice(self, choice_id: Optional[int]) -> Optional[ChoiceSnapshot]:
+        """从快照中取 choice，不访问数据库"""
+        return self.choices.get(choice_id) if choice_id else None
     
     def diagnose(self) -> DiagnosisResult:
         """
@@ -105,9 +228,7 @@ class ErrorDiagnoser:
         核心问题：学生不能准确判断题干中的关键定位信息
         """
         # 获取学生选择的关键词
-        step1_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step1_choice_id
-        ).first()
+        step1_choice = self._choice(self.step1_choice_id)
         
         student_keyword = step1_choice.choice_text if step1_choice else "unknown"
         
@@ -132,21 +253,21 @@ class ErrorDiagnoser:
         细分两种情况：
         1. 选择的句子不包含关键词 → 根本没有应用定位词
         2. 选择的句子包含关键词但仍错误 → 误判了同义替换或定位范围
+        
+        所选句子和答案句都在句子索引中时，再给出位置偏差：
+        不在同一段（段落定位错误），或同一段内相差几句。
         """
         # 获取学生选择的句子
-        step2_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step2_choice_id
-        ).first()
+        step2_choice = self._choice(self.step2_choice_id)
         
         student_sentence = step2_choice.choice_text if step2_choice else ""
+        located = step2_choice.sentence if step2_choice else None
         
         # 获取 Step 1 的关键词用于分析
-        step1_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step1_choice_id
-        ).first()
+        step1_choice = self._choice(self.step1_choice_id)
         keyword = step1_choice.choice_text if step1_choice else ""
         
-        # 简单判断：句子是否包含关键词（简化版，实际可以更复杂）
+        # 检查学生选择的句子是否包含关键词
         contains_keyword = keyword.lower() in student_sentence.lower() if keyword else False
         
         if not contains_keyword:
@@ -164,6 +285,27 @@ class ErrorDiagnoser:
             "recommendation_focus": "定位训练、同义替换识别"
         }
         
+        answer = self.answer_sentence
+        if located and answer and located.id != answer.id:
+            offset = located.sentence_index - answer.sentence_index
+            same_paragraph = located.paragraph_index == answer.paragraph_index
+            direction = "之后" if offset > 0 else "之前"
+            if same_paragraph:
+                location_issue = f"所选句子与答案句在同一段，但在答案句{direction} {abs(offset)} 句"
+            else:
+                location_issue = (
+                    f"所选句子在第 {located.paragraph_index + 1} 段，"
+                    f"而答案句在第 {answer.paragraph_index + 1} 段（段落定位错误）"
+                )
+            details.update({
+                "analysis": f"{details['analysis']}{location_issue}。",
+                "issue": f"{sub_issue}；{location_issue}",
+                "sentence_offset": offset,
+                "same_paragraph": same_paragraph,
+                "student_paragraph": located.paragraph_index + 1,
+                "answer_paragraph": answer.paragraph_index + 1,
+            })
+        
         return DiagnosisResult(
             error_level="level_2",
             error_type=error_type,
@@ -178,9 +320,7 @@ class ErrorDiagnoser:
         可能涉及：因果关系、转折逻辑、限定条件等
         """
         # 获取学生选择的理解模板
-        step3_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step3_choice_id
-        ).first()
+        step3_choice = self._choice(self.step3_choice_id)
         
         student_understanding = step3_choice.choice_text if step3_choice else ""
         
@@ -214,12 +354,8 @@ class ErrorDiagnoser:
         Step 1-3 都正确，问题出在选项理解或比对环节
         """
         # 获取 Step 4A 和 4B 的选择
-        step4a_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step4a_choice_id
-        ).first()
-        step4b_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step4b_choice_id
-        ).first()
+        step4a_choice = self._choice(self.step4a_choice_id)
+        step4b_choice = self._choice(self.step4b_choice_id)
         
         # 简化判断：根据 choice_order 判断是否选择了"正确"的理解
         # 通常 choice_order 较小的是正确理解，较大的是错误理解
@@ -275,24 +411,12 @@ class ErrorDiagnoser:
             dict: 包含所有诊断相关信息的字典
         """
         # 获取所有 choices 的文本
-        step1_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step1_choice_id
-        ).first()
-        step2_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step2_choice_id
-        ).first()
-        step3_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step3_choice_id
-        ).first()
-        step4a_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step4a_choice_id
-        ).first()
-        step4b_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step4b_choice_id
-        ).first()
-        step5_choice = self.db.query(ReflectionChoice).filter(
-            ReflectionChoice.id == self.step5_choice_id
-        ).first()
+        step1_choice = self._choice(self.step1_choice_id)
+        step2_choice = self._choice(self.step2_choice_id)
+        step3_choice = self._choice(self.step3_choice_id)
+        step4a_choice = self._choice(self.step4a_choice_id)
+        step4b_choice = self._choice(self.step4b_choice_id)
+        step5_choice = self._choice(self.step5_choice_id)
         
         return {
             "step1": {
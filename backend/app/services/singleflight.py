@@ -0,0 +1,105 @@
+"""
+Single-flight request coalescing
+
+同一时刻对同一个 key 的多个调用只真正执行一次：第一个调用者（leader）
+执行函数，其余并发调用者（follower）等待同一个 future 并共享结果。
+失败同样共享——leader 抛出的异常（Exception）会原样抛给所有 follower。
+leader 被取消（CancelledError 等 BaseException）时不把取消传给 follower：
+follower 重新加入，其中一个成为新的 leader 重新执行；某个 follower 被取消
+也不影响 leader 和其他 follower。
+
+同步和异步调用使用同一个 concurrent.futures.Future，因此线程池中的同步
+调用和事件循环中的异步调用也能互相合并。
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class _LeaderAbandoned(Exception):
+    """leader 没有产生结果就退出（被取消），follower 应重新加入"""
+
+
+class SingleFlight:
+    """按 key 合并并发中的相同调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        """返回 (future, is_leader)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = Future()
+            # 标记为运行中：follower 取消等待（asyncio.wrap_future 会转发取消）时不能取消共享的 future
+            future.set_running_or_notify_cancel()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(
+        self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None
+    ) -> None:
+        """先移除 key 再发布结果，被唤醒的 follower 重新加入时不会拿到同一个 future"""
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.set_exception(_LeaderAbandoned())
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """同步执行 fn()；相同 key 已在执行时阻塞等待其结果"""
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                return future.result()
+            except _LeaderAbandoned:
+                continue
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """异步执行 await fn()；相同 key 已在执行时等待其结果（不占用线程）"""
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                break
+            try:
+                return await asyncio.wrap_future(future)
+            except _LeaderAbandoned:
+                continue
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
@@ -0,0 +1,101 @@
+"""
+recommender_benchmark.py — Ranking latency of the next-question recommender over a large item bank.
+
+Builds a synthetic QuestionFeatures matrix (default 50k questions, random answer
+counts / level distributions / question types), then times `rank()` for random
+error profiles with RECENT_EXCLUDE recently answered questions masked out.
+No database is needed: this measures the per-request work the API does after
+the feature index is loaded.
+
+Run:
+    cd backend && python benchmarks/recommender_benchmark.py
+    cd backend && python benchmarks/recommender_benchmark.py --questions 200000 --repeat 500
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# 导入模型需要 DATABASE_URL；基准测试本身不访问数据库
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.services.recommender import (  # noqa: E402
+    LEVELS, RECENT_EXCLUDE, build_features, profile_weights, rank
+)
+
+QUESTION_TYPES = [
+    "factual_information", "negative_factual", "inference", "rhetorical_purpose",
+    "vocabulary", "reference", "sentence_simplification", "insert_text", "prose_summary",
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="推荐排序延迟基准测试")
+    parser.add_argument("--questions", type=int, default=50000, help="题库大小")
+    parser.add_argument("--repeat", type=int, default=200, help="排序次数")
+    parser.add_argument("--limit", type=int, default=10, help="每次推荐的题目数")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args(argv)
+
+
+def synthetic_rows(rng, n):
+    rows = []
+    for question_id in range(1, n + 1):
+        answers = rng.randint(0, 400)
+        correct = rng.randint(0, answers)
+        wrong = answers - correct
+        levels = {}
+        for level in LEVELS:
+            count = rng.randint(0, wrong)
+            wrong -= count
+            if count:
+                levels[level] = count
+        rows.append((question_id, rng.choice(QUESTION_TYPES), answers, correct, levels))
+    return rows
+
+
+def synthetic_profile(rng, n):
+    level_counts = {level: rng.randint(0, 30) for level in LEVELS}
+    trajectory = [
+        {"user_answer_id": i, "question_id": rng.randint(1, n),
+         "error_level": rng.choice(LEVELS), "error_type": ""}
+        for i in range(20)
+    ]
+    recent = {}
+    for entry in trajectory:
+        recent[entry["error_level"]] = recent.get(entry["error_level"], 0) + 1
+    return SimpleNamespace(level_counts=level_counts, recent_level_counts=recent, trajectory=trajectory)
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    features = build_features(synthetic_rows(rng, args.questions))
+    print(f"特征矩阵: {len(features)} 道题，{len(features.question_types)} 种题型，"
+          f"构建耗时 {time.perf_counter() - started:.2f}s")
+
+    timings = []
+    for _ in range(args.repeat):
+        profile = synthetic_profile(rng, args.questions)
+        recent = [rng.randint(1, args.questions) for _ in range(RECENT_EXCLUDE)]
+        started = time.perf_counter()
+        w_level, w_type = profile_weights(profile, features)
+        rank(features, w_level, w_type, exclude_ids=recent, limit=args.limit)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"排序 {args.repeat} 次（top {args.limit}，屏蔽 {RECENT_EXCLUDE} 道最近答过的题）：")
+    print(f"  p50 {statistics.median(timings):.2f} ms   p99 {p99:.2f} ms   max {timings[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
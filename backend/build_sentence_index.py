@@ -0,0 +1,64 @@
+"""
+build_sentence_index.py — Build the passage sentence index for existing content (see app/services/passage_index.py).
+
+Content imported through import_content.py / seed_questions.py is indexed at
+ingest time; run this once after upgrading (migration 12 creates an empty
+passage_sentences table), or after editing passages outside the importer.
+Each batch of passages is split into sentences, answer sentences and Step 2
+choices are mapped to sentence ids, and the batch is committed.
+
+Run:
+    cd backend && python build_sentence_index.py                  # 全部文章
+    cd backend && python build_sentence_index.py --passage-id 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.models.models import Passage, Question, ReflectionChoice
+from app.services.cache import invalidate_content_caches
+from app.services.passage_index import index_passages
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="为已有文章建立句子索引")
+    parser.add_argument("--passage-id", type=int, action="append", help="只处理指定文章（可重复指定多个）")
+    parser.add_argument("--batch-size", type=int, default=100, help="每个事务处理的文章数")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    db = SessionLocal()
+    started = time.monotonic()
+    sentences = 0
+    try:
+        passage_ids = args.passage_id or [row.id for row in db.query(Passage.id).order_by(Passage.id)]
+        for start in range(0, len(passage_ids), args.batch_size):
+            batch = passage_ids[start:start + args.batch_size]
+            try:
+                sentences += index_passages(db, batch)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            print(f"  {start + len(batch)}/{len(passage_ids)} 篇文章，{sentences} 个句子")
+
+        mapped_questions = db.query(Question).filter(Question.answer_sentence_id.isnot(None)).count()
+        mapped_choices = db.query(ReflectionChoice).filter(ReflectionChoice.sentence_id.isnot(None)).count()
+    finally:
+        db.close()
+    invalidate_content_caches()
+
+    print(f"✅ 句子索引完成，耗时 {time.monotonic() - started:.2f}s")
+    print(f"  - 已映射答案句的题目: {mapped_questions}")
+    print(f"  - 已映射到句子的 Step 2 choices: {mapped_choices}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+export_history.py — Export answer + reflection history as NDJSON or CSV (see app/services/history_export.py).
+
+Rows are read through a server-side cursor (yield_per) and written as they
+arrive, so exporting a whole cohort or the full table runs in constant memory.
+
+Run:
+    cd backend && python export_history.py --output history.ndjson                # 全部用户
+    cd backend && python export_history.py --user-id 3 --user-id 7 --format csv --output cohort.csv
+    cd backend && python export_history.py --since 2026-09-01 --until 2026-10-01 > september.ndjson
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.services.history_export import (
+    EXPORT_FORMATS, format_batches, history_query, iter_history_batches
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="导出答题 + 复盘历史（NDJSON / CSV）")
+    parser.add_argument("--user-id", type=int, action="append", help="只导出指定用户（可重复指定多个）")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="答题时间下限（含），ISO 格式")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="答题时间上限（不含），ISO 格式")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="输出格式")
+    parser.add_argument("--output", help="输出文件（默认写到标准输出）")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每次从游标读取的行数")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    statement = history_query(args.user_id, args.since, args.until)
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    db = SessionLocal()
+    started = time.monotonic()
+    rows = 0
+    try:
+        def counted(batches):
+            nonlocal rows
+            for batch in batches:
+                rows += len(batch)
+                yield batch
+
+        batches = counted(iter_history_batches(db, statement, args.batch_size))
+        for chunk in format_batches(batches, args.format):
+            out.write(chunk)
+    finally:
+        db.close()
+        if args.output:
+            out.close()
+
+    elapsed = time.monotonic() - started
+    # 进度信息写到 stderr，标准输出只包含导出数据
+    print(f"✅ 导出 {rows} 条记录，耗时 {elapsed:.2f}s"
+          f"（{rows / elapsed if elapsed else 0:,.0f} rows/s）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
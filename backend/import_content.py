@@ -0,0 +1,82 @@
+"""
+import_content.py — Bulk-import a JSON / JSONL item bank (see app/services/content_import.py).
+
+Validates the whole corpus first (exactly one correct option per question and one
+correct choice on each graded reflection step), then upserts passages / questions /
+options / reflection steps / choices in batches by content key and reports rows/s.
+
+Run:
+    cd backend && python import_content.py corpus.jsonl
+    cd backend && python import_content.py corpus.json --batch-size 200
+    cd backend && python import_content.py corpus.jsonl --dry-run      # 只校验，不写入
+    cd backend && python import_content.py corpus.jsonl --precompute   # 同时预生成解释矩阵（需要 GEMINI_API_KEY）
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.services.cache import invalidate_content_caches
+from app.services.content_import import (
+    ContentValidationError, import_passages, load_corpus, validate_corpus
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入 JSON / JSONL 题库语料")
+    parser.add_argument("path", help="语料文件（.json 或 .jsonl）")
+    parser.add_argument("--batch-size", type=int, default=100, help="每个事务写入的文章数")
+    parser.add_argument("--dry-run", action="store_true", help="只校验语料，不写入数据库")
+    parser.add_argument("--precompute", action="store_true", help="导入后为新题目预生成解释矩阵")
+    return parser.parse_args(argv)
+
+
+def print_progress(done, stats):
+    print(f"  {done} 篇文章，{stats.total_rows} 行，{stats.rows_per_second:,.0f} rows/s")
+
+
+def main():
+    args = parse_args()
+    try:
+        passages = validate_corpus(load_corpus(args.path))
+    except ContentValidationError as e:
+        print(f"❌ 语料校验失败（{len(e.errors)} 处错误）：")
+        for error in e.errors[:50]:
+            print(f"  - {error}")
+        if len(e.errors) > 50:
+            print(f"  ... 另有 {len(e.errors) - 50} 处")
+        sys.exit(1)
+
+    question_count = sum(len(p["questions"]) for p in passages)
+    print(f"✅ 校验通过: {len(passages)} 篇文章，{question_count} 道题")
+    if args.dry_run:
+        return
+
+    db = SessionLocal()
+    try:
+        stats = import_passages(db, passages, batch_size=args.batch_size, on_batch=print_progress)
+    except ContentValidationError as e:
+        # 已提交的批次保留，失败的批次已回滚
+        print(f"❌ 导入中止（{len(e.errors)} 处冲突）：")
+        for error in e.errors[:50]:
+            print(f"  - {error}")
+        sys.exit(1)
+    finally:
+        db.close()
+        invalidate_content_caches()
+
+    print(f"\n导入完成，耗时 {stats.seconds:.2f}s，{stats.total_rows} 行，{stats.rows_per_second:,.0f} rows/s")
+    for table, rows in stats.rows.items():
+        print(f"  - {table}: {rows} 行")
+
+    if args.precompute:
+        import asyncio
+        from precompute_explanations import precompute
+        asyncio.run(precompute(stats.question_ids))
+
+
+if __name__ == "__main__":
+    main()
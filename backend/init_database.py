@@ -4,18 +4,22 @@ import os
 # add backend directory to sys.path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app.core.database import engine, Base, SessionLocal
+from app.core.database import engine, SessionLocal
 from app.models.models import (
     Passage, Question, Option, ReflectionStep, 
     ReflectionChoice, User
 )
+from app.core.migrations import upgrade
+from app.services.cache import invalidate_content_caches
+from app.services.content_import import passage_content_key, question_content_key
+from app.services.passage_index import index_passages
 
 
 def create_tables():
-    """Create database tables based on the defined models."""
-    print("正在创建数据库表...")
-    Base.metadata.create_all(bind=engine)
-    print("数据库表创建完成")
+    """Create or upgrade database tables by running pending schema migrations."""
+    print("正在执行数据库迁移...")
+    applied = upgrade(engine)
+    print(f"数据库迁移完成（本次执行 {len(applied)} 个）")
 
 
 def insert_test_data():
@@ -31,6 +35,7 @@ def insert_test_data():
         # 1. 创建文章
         passage = Passage(
             title="The Impact of Sports on Social Integration",
+            content_key=passage_content_key("The Impact of Sports on Social Integration"),
             content="""Sports can promote social integration by bridging gaps between people of various backgrounds. Participation in sports can lead to increased social cohesion and improved relationships among diverse groups.
 
 For example, community soccer leagues often bring together people from different ethnicities, creating an environment where cultural differences are celebrated and mutual respect is cultivated. However, the impact of sports on social integration is not without challenges. Competitive environments can sometimes exacerbate social tensions, particularly when favoritism or exclusionary practices are present.
@@ -45,6 +50,9 @@ Despite these issues, many initiatives aim to use sports as a platform for socia
             passage_id=passage.id,
             question_type="factual_information",
             stem="What does the passage suggest about the sport for peace program?",
+            content_key=question_content_key(
+                passage.content_key, "What does the passage suggest about the sport for peace program?"
+            ),
             answer_sentence="One such initiative is the sport for peace program, which focuses on conflict resolution through team-building activities and collaborative sports events."
         )
         db.add(question)
@@ -232,7 +240,12 @@ Despite these issues, many initiatives aim to use sports as a platform for socia
         user = User(username="test_student", email="test@example.com")
         db.add(user)
         
+        # 6. 建立句子索引（答案句和 Step 2 choices 映射到文章句子）
+        db.flush()
+        index_passages(db, [passage.id])
+        
         db.commit()
+        invalidate_content_caches()
         print("测试数据插入完成")
         
     except Exception as e:
@@ -271,4 +284,8 @@ if __name__ == "__main__":
     create_tables()
     insert_test_data()
     verify_data()
+    if "--precompute" in sys.argv:
+        import asyncio
+        from precompute_explanations import precompute
+        asyncio.run(precompute())
     print("\n数据库初始化完成！")
\ No newline at end of file
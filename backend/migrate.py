@@ -0,0 +1,42 @@
+"""
+migrate.py — Apply versioned schema migrations (see app/core/migrations.py).
+
+Run:
+    cd backend && python migrate.py              # 执行所有未执行的迁移
+    cd backend && python migrate.py --status     # 查看已执行 / 待执行的迁移
+    cd backend && python migrate.py --target 4   # 只升级到指定版本
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import engine
+from app.core.migrations import MIGRATIONS, applied_versions, pending_migrations, upgrade
+
+
+def print_status():
+    applied = set(applied_versions(engine))
+    for migration in MIGRATIONS:
+        mark = "✓" if migration.version in applied else " "
+        print(f"  [{mark}] {migration.version:04d} {migration.name}")
+    pending = pending_migrations(engine)
+    print(f"\n已执行 {len(applied)} 个，待执行 {len(pending)} 个")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="执行数据库 schema 迁移")
+    parser.add_argument("--status", action="store_true", help="只显示迁移状态")
+    parser.add_argument("--target", type=int, help="升级到指定版本（默认最新）")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.status:
+        print_status()
+    else:
+        applied = upgrade(engine, args.target)
+        print(f"\n迁移完成，本次执行 {len(applied)} 个" if applied else "数据库已是最新版本")
@@ -0,0 +1,171 @@
+"""
+precompute_explanations.py — Precompute the explanation matrix for every question.
+
+For each question, enumerates every combination of step1-step5 reflection
+choices, runs ErrorDiagnoser on it, and keeps one representative per reachable
+(selected wrong option, error_level, error_type, salient choice) path. The
+explanation for each path is generated with bounded parallel Gemini calls and
+stored in precomputed_explanations, so submit_reflection can serve reflections
+without free-text input from a lookup table.
+
+Paths are upserted one by one; rule-based fallback text is never stored, so
+paths that failed keep their previous explanation (or fall back to a live LLM
+call) until the next run.
+
+Run:
+    cd backend && python precompute_explanations.py
+    cd backend && python precompute_explanations.py --question-id 3 --concurrency 16
+    cd backend && python seed_questions.py --precompute
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.orm import selectinload
+
+from app.core.database import SessionLocal
+from app.models.models import PrecomputedExplanation, Question, ReflectionChoice, ReflectionStep
+from app.services.cache import invalidate_content_caches
+from app.services.gemini_service import (
+    generate_diagnosis_explanation_async, get_llm_status, is_fallback_response, PROMPT_VERSION
+)
+from app.services.precomputed_explanations import enumerate_paths
+from app.services.reflection_service import build_question_data
+
+
+def load_questions(db, question_ids):
+    """加载题目及其文章、选项、答案句位置、复盘步骤和 choices（含句子位置）"""
+    query = db.query(Question).options(
+        selectinload(Question.passage),
+        selectinload(Question.options),
+        selectinload(Question.answer_sentence_location),
+        selectinload(Question.reflection_steps).selectinload(ReflectionStep.choices)
+        .selectinload(ReflectionChoice.sentence),
+    )
+    if question_ids:
+        query = query.filter(Question.id.in_(question_ids))
+    return query.order_by(Question.id).all()
+
+
+def build_jobs(question):
+    """一道题的所有 (错误选项, 诊断路径) 组合，附带生成解释所需的上下文"""
+    correct_option = next(opt for opt in question.options if opt.is_correct)
+    jobs = []
+    for path in enumerate_paths(question):
+        for option in question.options:
+            if option.is_correct:
+                continue
+            question_data = build_question_data(question, question.passage, option, correct_option)
+            jobs.append((option.id, path, question_data, {**path.llm_context, "question_data": question_data}))
+    return jobs
+
+
+async def generate_jobs(jobs, concurrency):
+    """并发（最多 concurrency 个）生成解释，返回 [(job, (explanation, suggestion))]"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(job):
+        _, path, question_data, llm_context = job
+        async with semaphore:
+            result = await generate_diagnosis_explanation_async(
+                error_level=path.error_level,
+                error_type=path.error_type,
+                rule_details=path.diagnosis_result.details,
+                question_data=question_data,
+                user_responses=llm_context
+            )
+            return job, result
+
+    return await asyncio.gather(*(generate(job) for job in jobs))
+
+
+def store_matrix(db, question_id, results) -> int:
+    """
+    写入一道题新生成的解释（按路径覆盖），删除旧 PROMPT_VERSION 的记录，返回写入行数
+    """
+    db.query(PrecomputedExplanation).filter(
+        PrecomputedExplanation.question_id == question_id,
+        PrecomputedExplanation.prompt_version != PROMPT_VERSION
+    ).delete(synchronize_session=False)
+    existing = {
+        (row.selected_option_id, row.error_level, row.error_type, row.salient_choice_id): row
+        for row in db.query(PrecomputedExplanation).filter(PrecomputedExplanation.question_id == question_id)
+    }
+    for (option_id, path, _, _), (explanation, suggestion) in results:
+        key = (option_id, path.error_level, path.error_type, path.salient_choice_id)
+        row = existing.get(key)
+        if row is None:
+            row = PrecomputedExplanation(
+                question_id=question_id,
+                selected_option_id=option_id,
+                error_level=path.error_level,
+                error_type=path.error_type,
+                salient_choice_id=path.salient_choice_id,
+            )
+            db.add(row)
+        row.prompt_version = PROMPT_VERSION
+        row.llm_explanation = explanation
+        row.llm_suggestion = suggestion
+    db.commit()
+    return len(results)
+
+
+async def precompute(question_ids=None, concurrency=8, dry_run=False):
+    if not dry_run and not get_llm_status()["configured"]:
+        print("⚠️ 未配置 GEMINI_API_KEY，跳过预生成解释")
+        return
+
+    started = time.monotonic()
+    stats = {"questions": 0, "paths": 0, "stored": 0, "failed": 0}
+
+    db = SessionLocal()
+    try:
+        for question in load_questions(db, question_ids):
+            jobs = build_jobs(question)
+            stats["questions"] += 1
+            stats["paths"] += len(jobs)
+            if dry_run:
+                print(f"  question_id={question.id}: {len(jobs)} 条路径")
+                continue
+
+            results = await generate_jobs(jobs, concurrency)
+            # 回退内容不写入；缺失的路径在线上会实时调用 LLM，下次运行再补
+            generated = [
+                (job, result) for job, result in results
+                if not is_fallback_response(result, job[1].error_level, job[1].error_type, job[1].diagnosis_result.details)
+            ]
+            stored = store_matrix(db, question.id, generated)
+            stats["stored"] += stored
+            stats["failed"] += len(jobs) - stored
+            print(f"  ✓ question_id={question.id}: {stored}/{len(jobs)} 条路径")
+    finally:
+        db.close()
+
+    if not dry_run:
+        invalidate_content_caches()
+
+    elapsed = time.monotonic() - started
+    print("\n预生成完成：")
+    print(f"  - 题目: {stats['questions']} 道")
+    print(f"  - 路径: {stats['paths']} 条")
+    print(f"  - {'待生成' if dry_run else '已写入'}: {stats['paths'] if dry_run else stats['stored']} 条")
+    print(f"  - 生成失败: {stats['failed']} 条")
+    print(f"  - 耗时: {elapsed:.1f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="预生成每道题所有诊断路径的 LLM 解释")
+    parser.add_argument("--question-id", type=int, action="append", help="只处理指定题目（可重复）")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发 Gemini 请求数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计路径数，不调用 LLM、不写数据库")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(precompute(args.question_id, args.concurrency, args.dry_run))
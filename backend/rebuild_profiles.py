@@ -0,0 +1,44 @@
+"""
+rebuild_profiles.py — Recompute per-user error profiles from reflection history (see app/services/error_profile.py).
+
+Profiles are normally maintained incrementally when a reflection is submitted;
+run this after upgrading (migration 9 creates an empty table) or to repair drift.
+History is streamed through a server-side cursor and profiles are written with
+batched INSERTs; the delete + rebuild is committed as a single transaction.
+
+Run:
+    cd backend && python rebuild_profiles.py                          # 全部用户
+    cd backend && python rebuild_profiles.py --user-id 3 --user-id 7
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.services.error_profile import rebuild_profiles
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="从复盘历史重建学生错误画像")
+    parser.add_argument("--user-id", type=int, action="append", help="只重建指定用户（可重复指定多个）")
+    parser.add_argument("--batch-size", type=int, default=1000, help="游标每次读取的行数 / 每次批量写入的画像数")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    db = SessionLocal()
+    started = time.monotonic()
+    try:
+        rebuilt = rebuild_profiles(db, args.user_id, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"✅ 重建 {rebuilt} 个用户的错误画像，耗时 {time.monotonic() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
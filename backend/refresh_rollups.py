@@ -0,0 +1,54 @@
+"""
+refresh_rollups.py — Refresh the teacher dashboard rollup tables (see app/services/dashboard_rollups.py).
+
+Only rows created after the stored (created_at, id) watermark — and older than the
+safety lag — are read, aggregated per batch and merged into question_rollups /
+cohort_rollups; each batch commits together with its watermark. Run it from cron.
+
+Run:
+    cd backend && python refresh_rollups.py                 # 增量刷新
+    cd backend && python refresh_rollups.py --full          # 清空后全量重建
+    cd backend && python refresh_rollups.py --lag-seconds 0 # 不留安全延迟（离线 / 测试环境）
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import SessionLocal
+from app.services.dashboard_rollups import ROLLUP_SAFETY_LAG_SECONDS, refresh_rollups
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="增量刷新教师端 Dashboard 汇总表")
+    parser.add_argument("--batch-size", type=int, default=5000, help="每个事务汇总的来源行数")
+    parser.add_argument("--lag-seconds", type=int, default=ROLLUP_SAFETY_LAG_SECONDS,
+                        help="只汇总创建时间早于 now - lag 的行")
+    parser.add_argument("--full", action="store_true", help="清空汇总表和水位后从头汇总")
+    return parser.parse_args(argv)
+
+
+def print_progress(source, processed):
+    print(f"  {source}: {processed} 行")
+
+
+def main():
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        stats = refresh_rollups(
+            db, batch_size=args.batch_size, lag_seconds=args.lag_seconds,
+            full=args.full, on_batch=print_progress
+        )
+    finally:
+        db.close()
+
+    print(f"✅ 汇总 {stats.total_rows} 行，耗时 {stats.seconds:.2f}s")
+    for source, rows in stats.rows.items():
+        print(f"  - {source}: {rows} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+regenerate_explanations.py — Offline batch re-generation of LLM explanations.
+
+Walks reflection_responses in id order (keyset pagination, one chunk at a time),
+re-runs the rule engine for each matching row and regenerates
+llm_explanation / llm_suggestion with bounded parallel Gemini calls.
+
+Filters (combine freely; --fallback-only / --older-than / --pending are OR-ed,
+--question-id narrows the result):
+  --fallback-only      rows whose saved text is the rule-based fallback
+  --older-than N       rows generated with a PROMPT_VERSION lower than N
+  --pending            rows whose deferred LLM explanation never finished
+                       (pending, or generating left behind by a crashed worker)
+  --question-id ID     only reflections on the given question(s)
+
+Progress is checkpointed to a JSON file after every chunk; re-run with
+--resume to continue after an interruption.
+
+Run:
+    cd backend && python regenerate_explanations.py --fallback-only --concurrency 16
+    cd backend && python regenerate_explanations.py --older-than 2 --resume
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from app.core.database import SessionLocal
+from app.models.models import ReflectionResponse, UserAnswer
+from app.services.gemini_service import (
+    generate_diagnosis_explanation_async, get_llm_status, PROMPT_VERSION
+)
+from app.services.reflection_service import diagnose_reflection
+
+
+# 解释尚未写回的状态（generating 只会在生成中的进程崩溃后残留）
+PENDING_STATUSES = ("pending", "generating")
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".regenerate_checkpoint.json")
+
+
+# ---------------------------------------------------------------------------
+# Selection
+# ---------------------------------------------------------------------------
+
+def build_query(db, args):
+    """构建匹配过滤条件的查询（不含分页）"""
+    query = db.query(ReflectionResponse).options(joinedload(ReflectionResponse.user_answer))
+
+    alternatives = []
+    if args.fallback_only:
+        # 回退内容的 llm_prompt_version 为 NULL；升级前保存的行也是 NULL，逐行再核对文本
+        alternatives.append(
+            (ReflectionResponse.llm_status == "ready") & ReflectionResponse.llm_prompt_version.is_(None)
+        )
+    if args.older_than:
+        alternatives.append(ReflectionResponse.llm_prompt_version < args.older_than)
+    if args.pending:
+        alternatives.append(ReflectionResponse.llm_status.in_(PENDING_STATUSES))
+    if alternatives:
+        query = query.filter(or_(*alternatives))
+
+    if args.question_id:
+        query = query.join(UserAnswer, ReflectionResponse.user_answer_id == UserAnswer.id).filter(
+            UserAnswer.question_id.in_(args.question_id)
+        )
+    return query
+
+
+def fetch_chunk(db, args, last_id):
+    """按 id 顺序取下一批匹配的行（keyset 分页，不使用 OFFSET）"""
+    return build_query(db, args).filter(
+        ReflectionResponse.id > last_id
+    ).order_by(ReflectionResponse.id).limit(args.chunk_size).all()
+
+
+def needs_regeneration(row, prepared, args) -> bool:
+    """对 SQL 过滤后的行做最终判断"""
+    if row.llm_status in PENDING_STATUSES:
+        return True
+    if args.older_than and row.llm_prompt_version is not None and row.llm_prompt_version < args.older_than:
+        return True
+    if args.fallback_only:
+        return prepared.prompt_version_for(row.llm_explanation or "", row.llm_suggestion or "") is None
+    # 没有指定任何内容过滤条件时，重新生成全部匹配行
+    return not (args.fallback_only or args.older_than or args.pending)
+
+
+# ---------------------------------------------------------------------------
+# Regeneration
+# ---------------------------------------------------------------------------
+
+async def regenerate_chunk(items, concurrency):
+    """并发（最多 concurrency 个）重新生成一批解释，返回 [(row_id, prepared, result)]"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def regenerate(row_id, prepared):
+        async with semaphore:
+            result = await generate_diagnosis_explanation_async(
+                error_level=prepared.diagnosis_result.error_level,
+                error_type=prepared.diagnosis_result.error_type,
+                rule_details=prepared.diagnosis_result.details,
+                question_data=prepared.question_data,
+                user_responses=prepared.llm_context,
+                cache_key=prepared.cache_key
+            )
+            return row_id, prepared, result
+
+    return await asyncio.gather(*(regenerate(row_id, prepared) for row_id, prepared in items))
+
+
+def save_results(db, rows_by_id, results, stats):
+    """写回生成结果；仍然是回退内容且原来已有内容的行保持不变"""
+    for row_id, prepared, (explanation, suggestion) in results:
+        row = rows_by_id[row_id]
+        version = prepared.prompt_version_for(explanation, suggestion)
+        if version is None and row.llm_status == "ready":
+            stats["still_fallback"] += 1
+            continue
+        row.llm_explanation = explanation
+        row.llm_suggestion = suggestion
+        row.llm_status = "ready"
+        row.llm_prompt_version = version
+        stats["regenerated"] += 1
+    db.commit()
+
+
+# ---------------------------------------------------------------------------
+# Checkpoint
+# ---------------------------------------------------------------------------
+
+def filter_signature(args) -> dict:
+    return {
+        "fallback_only": args.fallback_only,
+        "older_than": args.older_than,
+        "pending": args.pending,
+        "question_id": sorted(args.question_id or []),
+    }
+
+
+def load_checkpoint(args) -> dict:
+    state = {
+        "last_id": 0,
+        "filters": filter_signature(args),
+        "stats": {"scanned": 0, "skipped": 0, "regenerated": 0, "still_fallback": 0},
+    }
+    if not args.resume or not os.path.exists(args.checkpoint):
+        return state
+    with open(args.checkpoint, encoding="utf-8") as f:
+        saved = json.load(f)
+    if saved.get("filters") != state["filters"]:
+        raise SystemExit(f"❌ 检查点 {args.checkpoint} 的过滤条件与本次不一致，请去掉 --resume 或删除检查点")
+    print(f"↩️  从检查点继续: last_id={saved['last_id']}")
+    return saved
+
+
+def save_checkpoint(args, state) -> None:
+    tmp = args.checkpoint + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, args.checkpoint)
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+async def run(args):
+    state = load_checkpoint(args)
+    stats = state["stats"]
+    started = time.monotonic()
+    processed_this_run = 0
+
+    db = SessionLocal()
+    try:
+        while True:
+            rows = fetch_chunk(db, args, state["last_id"])
+            if not rows:
+                break
+
+            items = []
+            for row in rows:
+                prepared = diagnose_reflection(row, row.user_answer, db)
+                if needs_regeneration(row, prepared, args):
+                    items.append((row.id, prepared))
+                else:
+                    stats["skipped"] += 1
+            stats["scanned"] += len(rows)
+
+            if items and not args.dry_run:
+                results = await regenerate_chunk(items, args.concurrency)
+                save_results(db, {row.id: row for row in rows}, results, stats)
+            elif items:
+                stats["regenerated"] += len(items)
+            processed_this_run += len(rows)
+
+            state["last_id"] = rows[-1].id
+            if not args.dry_run:
+                save_checkpoint(args, state)
+
+            elapsed = time.monotonic() - started
+            print(
+                f"  last_id={state['last_id']} scanned={stats['scanned']} "
+                f"regenerated={stats['regenerated']} still_fallback={stats['still_fallback']} "
+                f"skipped={stats['skipped']} ({processed_this_run / elapsed:.1f} rows/s)"
+            )
+            if args.limit and processed_this_run >= args.limit:
+                break
+    finally:
+        db.close()
+
+    elapsed = time.monotonic() - started
+    print("\n重新生成完成：")
+    print(f"  - 扫描: {stats['scanned']} 行")
+    print(f"  - {'待重新生成' if args.dry_run else '已重新生成'}: {stats['regenerated']} 行")
+    print(f"  - 仍为回退内容: {stats['still_fallback']} 行")
+    print(f"  - 跳过: {stats['skipped']} 行")
+    print(f"  - 耗时: {elapsed:.1f}s，吞吐: {processed_this_run / elapsed if elapsed else 0:.1f} rows/s")
+    guard = get_llm_status()["guard"]
+    print(f"  - Gemini: succeeded={guard['succeeded']} failed={guard['failed']} "
+          f"circuit={guard['circuit']['state']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量重新生成复盘记录的 LLM 解释")
+    parser.add_argument("--fallback-only", action="store_true", help="只处理回退内容")
+    parser.add_argument("--older-than", type=int, metavar="N",
+                        help=f"只处理 PROMPT_VERSION < N 生成的内容（当前版本 {PROMPT_VERSION}）")
+    parser.add_argument("--pending", action="store_true", help="只处理仍为 pending 的记录")
+    parser.add_argument("--question-id", type=int, action="append", help="只处理指定题目（可重复）")
+    parser.add_argument("--chunk-size", type=int, default=200, help="每批读取的行数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发 Gemini 请求数")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多处理的行数（0 表示不限）")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="检查点文件路径")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不调用 LLM、不写数据库")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
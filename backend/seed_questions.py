@@ -8,6 +8,7 @@ Passages:
 
 Run:
     cd backend && python seed_questions.py
+    cd backend && python seed_questions.py --precompute   # 同时预生成解释矩阵（需要 GEMINI_API_KEY）
 """
 
 import sys
@@ -16,76 +17,9 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app.core.database import engine, Base, SessionLocal
-from app.models.models import (
-    Passage, Question, Option, ReflectionStep,
-    ReflectionChoice, User,
-)
-
-
-# ---------------------------------------------------------------------------
-# Helper
-# ---------------------------------------------------------------------------
-
-def add_question(db, passage_id, stem, answer_sentence, options_data,
-                 step1_choices, step2_choices, step3_choices,
-                 step4_choices, step5_choices, step6_choices):
-    """
-    Insert one question + 4 options + 6 reflection steps + their choices.
-
-    options_data : list of (label, text, is_correct)
-    stepN_choices: list of (text, is_correct, order)
-    """
-    # 1. Question
-    question = Question(
-        passage_id=passage_id,
-        question_type="factual_information",
-        stem=stem,
-        answer_sentence=answer_sentence,
-    )
-    db.add(question)
-    db.flush()
-
-    # 2. Options
-    correct_option = None
-    for label, text, is_correct in options_data:
-        opt = Option(question_id=question.id, option_label=label,
-                     option_text=text, is_correct=is_correct)
-        db.add(opt)
-        if is_correct:
-            db.flush()
-            correct_option = opt
-
-    question.correct_option_id = correct_option.id
-
-    # 3. Reflection steps
-    steps_spec = [
-        (1, "keyword_selection",            "请选择你认为的定位词：",                         False, step1_choices),
-        (2, "sentence_location",            "请选择你认为的答案句：",                         False, step2_choices),
-        (3, "sentence_understanding",       "请选择最接近你对答案句理解的选项：",              True,  step3_choices),
-        (4, "wrong_option_understanding",   "请选择最接近你当时选择错误选项的理由：",          True,  step4_choices),
-        (5, "correct_option_understanding", "正确答案是：请选择最接近你现在理解的选项：",      True,  step5_choices),
-        (6, "self_diagnosis",               "回顾你的解题过程，你认为主要错在：",              True,  step6_choices),
-    ]
-
-    for step_number, step_type, prompt_text, allow_custom_input, choices in steps_spec:
-        step = ReflectionStep(
-            question_id=question.id,
-            step_number=step_number,
-            step_type=step_type,
-            prompt_text=prompt_text,
-            allow_custom_input=allow_custom_input,
-        )
-        db.add(step)
-        db.flush()
-        for text, is_correct, order in choices:
-            db.add(ReflectionChoice(
-                reflection_step_id=step.id,
-                choice_text=text,
-                is_correct=is_correct,
-                choice_order=order,
-            ))
-
-    return question
+from app.models.models import Passage
+from app.services.cache import invalidate_content_caches
+from app.services.content_import import import_passages, validate_corpus
 
 
 # ---------------------------------------------------------------------------
@@ -446,46 +380,17 @@ PASSAGES = [
 # ---------------------------------------------------------------------------
 
 def seed():
+    """
+    通过批量导入器写入 PASSAGES（按 content_key upsert，重复运行会更新已有的文章而不是重复插入）
+    """
     db = SessionLocal()
     try:
-        total_questions = 0
-        for passage_data in PASSAGES:
-            # Check if this passage already exists
-            existing = db.query(Passage).filter(
-                Passage.title == passage_data["title"]
-            ).first()
-            if existing:
-                print(f"⚠️  已存在，跳过: {passage_data['title']}")
-                continue
-
-            # Create passage
-            passage = Passage(
-                title=passage_data["title"],
-                content=passage_data["content"],
-            )
-            db.add(passage)
-            db.flush()
-            print(f"✅ 创建文章: {passage_data['title']} (id={passage.id})")
-
-            for q_data in passage_data["questions"]:
-                add_question(
-                    db=db,
-                    passage_id=passage.id,
-                    stem=q_data["stem"],
-                    answer_sentence=q_data["answer_sentence"],
-                    options_data=q_data["options"],
-                    step1_choices=q_data["step1_choices"],
-                    step2_choices=q_data["step2_choices"],
-                    step3_choices=q_data["step3_choices"],
-                    step4_choices=q_data["step4_choices"],
-                    step5_choices=q_data["step5_choices"],
-                    step6_choices=q_data["step6_choices"],
-                )
-                total_questions += 1
-                print(f"   ✅ 添加题目: {q_data['stem'][:60]}…")
-
-        db.commit()
-        print(f"\n数据导入完成！新增题目: {total_questions} 道")
+        passages = validate_corpus(PASSAGES)
+        stats = import_passages(db, passages)
+        invalidate_content_caches()
+        for passage in passages:
+            print(f"✅ 文章: {passage['title']}（{len(passage['questions'])} 道题）")
+        print(f"\n数据导入完成！写入题目: {stats.rows['questions']} 道，{stats.total_rows} 行，耗时 {stats.seconds:.3f}s")
 
         # Summary
         from app.models.models import Question as Q, Option as O, ReflectionStep as RS, ReflectionChoice as RC
@@ -497,7 +402,6 @@ def seed():
         print(f"  - reflection_choices: {db.query(RC).count()} 条")
 
     except Exception as e:
-        db.rollback()
         print(f"❌ 错误: {e}")
         raise
     finally:
@@ -505,4 +409,8 @@ def seed():
 
 
 if __name__ == "__main__":
-    seed()
\ No newline at end of file
+    seed()
+    if "--precompute" in sys.argv:
+        import asyncio
+        from precompute_explanations import precompute
+        asyncio.run(precompute())
\ No newline at end of file
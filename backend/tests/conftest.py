@@ -0,0 +1,114 @@
+"""
+pytest 公共 fixture
+
+测试使用独立的临时 SQLite 数据库（可用 TEST_DATABASE_URL 指向其他数据库），
+LLM 调用走离线的 Fake Gemini（GEMINI_BACKEND=fake，零延迟），不需要 API key。
+
+Run:
+    cd backend && python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import List
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# 必须在导入 app 之前设置：app.core.database 在导入时创建 engine
+_TMP_DIR = tempfile.mkdtemp(prefix="toefl-tests-")
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{_TMP_DIR}/test.db?check_same_thread=false"
+)
+os.environ["GEMINI_BACKEND"] = "fake"
+os.environ.setdefault("FAKE_GEMINI_LATENCY_MS", "0")
+os.environ.setdefault("FAKE_GEMINI_LATENCY_JITTER_MS", "0")
+os.environ.setdefault("FAKE_GEMINI_STREAM_CHUNK_DELAY_MS", "0")
+os.environ.setdefault("FAKE_GEMINI_SEED", "7")
+# 语句计数测试中不插入内容版本检查（test_content_version.py 单独开启）
+os.environ["CONTENT_VERSION_CHECK_SECONDS"] = "0"
+
+from sqlalchemy import event  # noqa: E402
+
+from app.core.database import engine  # noqa: E402
+
+
+class QueryCounter:
+    """记录 engine 上执行的 SQL 语句（before_cursor_execute）"""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    """在 with 块内统计 SQL 语句数"""
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+
+USER_ID = 1  # init_database.py 创建的 test_student
+
+STEP_FIELDS = {
+    "keyword_selection": "step1_choice_id",
+    "sentence_location": "step2_choice_id",
+    "sentence_understanding": "step3_choice_id",
+    "wrong_option_understanding": "step4a_choice_id",
+    "correct_option_understanding": "step4b_choice_id",
+    "self_diagnosis": "step5_choice_id",
+}
+
+
+def answer_question(client, question_id: int, option_id: int) -> int:
+    """提交一次答案，返回 user_answer_id"""
+    response = client.post("/api/answers", json={
+        "user_id": USER_ID, "question_id": question_id, "selected_option_id": option_id
+    })
+    assert response.status_code == 200
+    return response.json()["user_answer_id"]
+
+
+def reflection_body(user_answer_id: int, steps: dict) -> dict:
+    """复盘提交：每一步都选第一个 choice"""
+    body = {"user_answer_id": user_answer_id}
+    for step in steps["steps"]:
+        field = STEP_FIELDS.get(step["step_type"])
+        if field and step["choices"]:
+            body[field] = step["choices"][0]["id"]
+    return body
+
+
+@pytest.fixture(scope="session")
+def seeded_db():
+    """执行全部迁移并写入 init_database.py / seed_questions.py 的示例题库"""
+    from init_database import create_tables, insert_test_data
+    from seed_questions import seed
+
+    create_tables()
+    insert_test_data()
+    seed()
+    return engine
+
+
+@pytest.fixture(scope="session")
+def client(seeded_db):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,50 @@
+"""
+答案索引 / 推荐特征索引：加载期间发生的失效不会丢失
+"""
+
+from app.core.database import SessionLocal
+from app.services.answer_key import AnswerKeyIndex
+from app.services.recommender import QuestionFeatureIndex
+
+
+class _InvalidatingSession:
+    """读取选项之后、加载完成之前调用 index.invalidate()（模拟并发的题库导入）"""
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+
+    def query(self, *entities):
+        query = self.db.query(*entities)
+        self.index.invalidate()
+        return query
+
+
+def test_invalidate_during_load_is_not_lost(seeded_db):
+    index = AnswerKeyIndex(ttl=0, miss_reload_interval=60)
+    db = SessionLocal()
+    try:
+        index.load(_InvalidatingSession(db, index))
+        assert index.loads == 1
+
+        entry = index.get(1, db)
+        assert index.loads == 2, "加载期间的 invalidate() 应让下一次查询重新加载"
+        assert entry is not None and entry.correct_option_id in entry.option_ids
+
+        index.get(1, db)
+        assert index.loads == 2
+    finally:
+        db.close()
+
+
+def test_feature_index_invalidate_during_load_is_not_lost(seeded_db):
+    index = QuestionFeatureIndex(ttl=0)
+    db = SessionLocal()
+    try:
+        index.load(_InvalidatingSession(db, index))
+        index.get(db)
+        assert index.loads == 2
+        index.get(db)
+        assert index.loads == 2
+    finally:
+        db.close()
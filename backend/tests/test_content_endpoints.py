@@ -0,0 +1,109 @@
+"""
+题目 / 文章 / 复盘步骤内容接口：选项顺序、ETag 与 Cache-Control
+"""
+
+import pytest
+
+from conftest import answer_question
+from app.core.database import SessionLocal
+from app.models.models import Option, Passage, Question
+from app.services.cache import HTTP_CACHE_MAX_AGE, invalidate_content_caches
+
+
+@pytest.fixture(scope="module")
+def shuffled_question(seeded_db):
+    """选项按 D/B/A/C 的顺序插入的题目，返回 (passage_id, question_id)；模块结束后删除"""
+    db = SessionLocal()
+    try:
+        passage = Passage(title="Option Order Fixture", content="Option order fixture passage.")
+        question = Question(passage=passage, question_type="factual_information", stem="Option order?")
+        for label in "DBAC":
+            question.options.append(Option(option_label=label, option_text=f"Option {label}", is_correct=label == "A"))
+        db.add(passage)
+        db.commit()
+        ids = passage.id, question.id
+    finally:
+        db.close()
+    invalidate_content_caches()
+    yield ids
+
+    db = SessionLocal()
+    try:
+        db.query(Option).filter(Option.question_id == ids[1]).delete()
+        db.query(Question).filter(Question.id == ids[1]).delete()
+        db.query(Passage).filter(Passage.id == ids[0]).delete()
+        db.commit()
+    finally:
+        db.close()
+    invalidate_content_caches()
+
+
+def test_question_and_passage_list_options_in_label_order(client, shuffled_question):
+    passage_id, question_id = shuffled_question
+    question = client.get(f"/api/questions/{question_id}").json()
+    passage = client.get(f"/api/passages/{passage_id}").json()
+
+    assert [option["option_label"] for option in question["options"]] == list("ABCD")
+    assert passage["questions"][0]["options"] == question["options"]
+
+
+@pytest.mark.parametrize("path", ["/api/questions/1", "/api/questions/1?slim=true", "/api/passages/1"])
+def test_content_is_public_and_revalidated_with_etag(client, path):
+    response = client.get(path)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == f"public, max-age={HTTP_CACHE_MAX_AGE}"
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        not_modified = client.get(path, headers={"If-None-Match": if_none_match})
+        assert not_modified.status_code == 304, if_none_match
+        assert not_modified.content == b""
+        assert not_modified.headers["ETag"] == etag
+
+    assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_full_and_slim_question_have_different_etags(client):
+    full = client.get("/api/questions/1").headers["ETag"]
+    slim = client.get("/api/questions/1?slim=true").headers["ETag"]
+    assert full != slim
+
+
+def test_etag_changes_after_content_update(client):
+    question = client.get("/api/questions/1")
+    passage = client.get("/api/passages/1")
+    db = SessionLocal()
+    try:
+        row = db.get(Question, 1)
+        original, row.stem = row.stem, row.stem + " (edited)"
+        db.commit()
+        invalidate_content_caches()
+
+        updated = client.get("/api/questions/1", headers={"If-None-Match": question.headers["ETag"]})
+        assert updated.status_code == 200
+        assert updated.json()["stem"] == original + " (edited)"
+        assert updated.headers["ETag"] != question.headers["ETag"]
+        assert client.get(
+            "/api/passages/1", headers={"If-None-Match": passage.headers["ETag"]}
+        ).status_code == 200
+    finally:
+        row.stem = original
+        db.commit()
+        db.close()
+        invalidate_content_caches()
+    assert client.get("/api/questions/1").headers["ETag"] == question.headers["ETag"]
+
+
+def test_reflection_steps_are_private_and_revalidated_with_etag(client):
+    db = SessionLocal()
+    try:
+        question = db.get(Question, 1)
+        option_id = next(option.id for option in question.options if not option.is_correct)
+    finally:
+        db.close()
+    path = f"/api/reflections/{answer_question(client, 1, option_id)}"
+
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    assert client.get(path, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
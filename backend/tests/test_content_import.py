@@ -0,0 +1,96 @@
+"""
+题库重新导入：语料中删除的选项 / choice 同步删除，每题只保留一个正确行
+"""
+
+import copy
+
+import pytest
+
+from conftest import answer_question
+from app.core.database import SessionLocal
+from app.models.models import Option, Question, ReflectionStep
+from app.services.content_import import ContentValidationError, import_passages, validate_corpus
+from seed_questions import PASSAGES
+
+
+def _corpus(title):
+    """一篇只有一道题的文章：5 个选项（E 正确），Step 1 有 4 个 choice（第 4 个正确）"""
+    passage = copy.deepcopy(PASSAGES[0])
+    passage["title"] = title
+    question = passage["questions"][0]
+    passage["questions"] = [question]
+    question["options"] = [
+        (label, f"Option {label}", label == "E") for label in "ABCDE"
+    ]
+    question["step1_choices"] = [(f"keyword {order}", order == 4, order) for order in range(1, 5)]
+    return passage
+
+
+def _import(passage):
+    db = SessionLocal()
+    try:
+        stats = import_passages(db, validate_corpus([passage]))
+        return stats.question_ids[0]
+    finally:
+        db.close()
+
+
+def _correct_rows(question_id):
+    """[(选项标签, ...)], [(Step 1 choice_order, ...)] 中 is_correct 的行"""
+    db = SessionLocal()
+    try:
+        question = db.get(Question, question_id)
+        options = [option.option_label for option in question.options if option.is_correct]
+        step1 = db.query(ReflectionStep).filter(
+            ReflectionStep.question_id == question_id, ReflectionStep.step_number == 1
+        ).one()
+        choices = [choice.choice_order for choice in step1.choices if choice.is_correct]
+        labels = [option.option_label for option in question.options]
+        correct_label = db.get(Option, question.correct_option_id).option_label
+        return labels, options, choices, correct_label
+    finally:
+        db.close()
+
+
+def test_reimport_deletes_rows_missing_from_the_corpus(seeded_db):
+    passage = _corpus("Re-import Fixture: removed rows")
+    question_id = _import(passage)
+    assert _correct_rows(question_id) == (list("ABCDE"), ["E"], [4], "E")
+
+    question = passage["questions"][0]
+    question["options"] = [(label, f"Option {label}", label == "A") for label in "ABCD"]
+    question["step1_choices"] = [(f"keyword {order}", order == 1, order) for order in range(1, 4)]
+    assert _import(passage) == question_id
+
+    assert _correct_rows(question_id) == (list("ABCD"), ["A"], [1], "A")
+
+
+def test_reimport_rejects_removing_rows_students_answered(client):
+    passage = _corpus("Re-import Fixture: answered rows")
+    question_id = _import(passage)
+    db = SessionLocal()
+    try:
+        option_e = db.query(Option).filter(Option.question_id == question_id, Option.option_label == "E").one()
+        option_e_id = option_e.id
+    finally:
+        db.close()
+    answer_question(client, question_id, option_e_id)
+
+    question = passage["questions"][0]
+    question["options"] = [(label, f"Option {label}", label == "A") for label in "ABCD"]
+    with pytest.raises(ContentValidationError, match=f"options id={option_e_id}"):
+        _import(passage)
+
+    # 整批回滚：选项和正确答案保持不变
+    assert _correct_rows(question_id) == (list("ABCDE"), ["E"], [4], "E")
+
+
+def test_validate_corpus_rejects_more_than_one_correct_row():
+    passage = _corpus("Validation Fixture")
+    question = passage["questions"][0]
+    question["options"][0] = ("A", "Option A", True)
+    question["step1_choices"][0] = ("keyword 1", True, 1)
+    with pytest.raises(ContentValidationError) as error:
+        validate_corpus([passage])
+    assert any("正确选项（当前 2 个）" in message for message in error.value.errors)
+    assert any("step1: 必须恰好有一个正确 choice（当前 2 个）" in message for message in error.value.errors)
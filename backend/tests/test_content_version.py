@@ -0,0 +1,73 @@
+"""
+跨进程的内容缓存失效
+
+导入脚本在另一个进程里写入题库并递增 content_version，运行中的 API 进程
+在下一次检查时清空内容缓存和答案索引；检查间隔内的请求不访问数据库。
+"""
+
+import pytest
+
+from conftest import answer_question, count_queries
+from app.core.database import SessionLocal
+from app.models.models import Question
+from app.services.answer_key import answer_key_index
+from app.services.content_version import (
+    bump_content_version, content_version_watcher, read_content_version
+)
+
+
+@pytest.fixture
+def watcher(monkeypatch, client):
+    """开启检查（conftest 中默认关闭），下一个请求立即检查并重新记录版本号"""
+    monkeypatch.setattr(content_version_watcher, "interval", 60.0)
+    monkeypatch.setattr(content_version_watcher, "_checked_at", None)
+    monkeypatch.setattr(content_version_watcher, "_version", None)
+    return content_version_watcher
+
+
+def _set_stem(question_id, stem):
+    """模拟导入脚本所在的进程：直接写数据库，不碰本进程的缓存"""
+    db = SessionLocal()
+    try:
+        db.query(Question).filter(Question.id == question_id).update({Question.stem: stem})
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_bump_content_version_increments_the_row(seeded_db):
+    version = read_content_version()
+    assert bump_content_version() == version + 1
+    assert read_content_version() == version + 1
+
+
+def test_other_process_import_clears_api_caches(client, watcher):
+    question_id = 1
+    checks, changes = watcher.checks, watcher.changes
+    original = client.get(f"/api/questions/{question_id}").json()["stem"]
+    assert watcher.checks == checks + 1
+
+    try:
+        _set_stem(question_id, "Imported by another process")
+        bump_content_version()
+
+        # 检查间隔内：只比较时间，不查版本号，继续返回缓存
+        with count_queries() as queries:
+            stale = client.get(f"/api/questions/{question_id}").json()["stem"]
+        assert stale == original
+        assert queries.count == 0, queries.statements
+
+        loads = answer_key_index.loads
+        watcher._checked_at = None  # 到了下一次检查时间
+        assert client.get(f"/api/questions/{question_id}").json()["stem"] == "Imported by another process"
+        assert watcher.changes == changes + 1
+
+        # 答案索引在下一次判分时重新加载
+        option_id = client.get(f"/api/questions/{question_id}").json()["options"][0]["id"]
+        answer_question(client, question_id, option_id)
+        assert answer_key_index.loads == loads + 1
+    finally:
+        _set_stem(question_id, original)
+        bump_content_version()
+        watcher._checked_at = None
+        client.get(f"/api/questions/{question_id}")
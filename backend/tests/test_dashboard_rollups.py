@@ -0,0 +1,95 @@
+"""
+Dashboard 汇总：覆盖提交的复盘不会让 reflection_count / level_counts 重复累加
+"""
+
+import time
+from collections import Counter
+
+from sqlalchemy import select
+
+from conftest import answer_question, reflection_body
+from app.core.database import SessionLocal
+from app.models.models import Option, QuestionRollup
+from app.services.dashboard_rollups import ALL_COHORTS, refresh_rollups
+
+QUESTION_ID = 1
+
+
+def _refresh() -> None:
+    db = SessionLocal()
+    try:
+        refresh_rollups(db, lag_seconds=0)
+    finally:
+        db.close()
+
+
+def _rollup() -> tuple:
+    db = SessionLocal()
+    try:
+        row = db.get(QuestionRollup, (ALL_COHORTS, QUESTION_ID))
+        if row is None:
+            return 0, Counter()
+        return row.reflection_count, Counter(row.level_counts)
+    finally:
+        db.close()
+
+
+def _wrong_option_id() -> int:
+    db = SessionLocal()
+    try:
+        return db.scalars(
+            select(Option.id).where(Option.question_id == QUESTION_ID, Option.is_correct.is_(False))
+        ).first()
+    finally:
+        db.close()
+
+
+def _first_reflection(client) -> tuple:
+    """答错一次并提交复盘，返回 (诊断层级, 提交内容, 覆盖提交时 Step 1 改选的 choice id)"""
+    user_answer_id = answer_question(client, QUESTION_ID, _wrong_option_id())
+    steps = client.get(f"/api/reflections/{user_answer_id}").json()
+    body = reflection_body(user_answer_id, steps)
+    first = client.post("/api/reflections", json=body)
+    assert first.status_code == 200
+
+    step1 = next(step for step in steps["steps"] if step["step_type"] == "keyword_selection")
+    return first.json()["rule_error_level"], body, step1["choices"][-1]["id"]
+
+
+def _resubmit(client, body: dict, step1_choice_id: int) -> str:
+    response = client.post("/api/reflections", json={**body, "step1_choice_id": step1_choice_id})
+    assert response.status_code == 200
+    return response.json()["rule_error_level"]
+
+
+def test_resubmitted_reflection_is_not_counted_twice(client):
+    _refresh()
+    count_before, levels_before = _rollup()
+
+    first_level, body, step1_choice_id = _first_reflection(client)
+    _refresh()
+    count, levels = _rollup()
+    assert count == count_before + 1
+    assert levels == levels_before + Counter({first_level: 1})
+
+    # SQLite 会复用被删除的最大 id，created_at 只精确到秒：
+    # 等到下一秒，新记录的 (created_at, id) 才位于水位之后
+    time.sleep(1.1)
+    second_level = _resubmit(client, body, step1_choice_id)
+    _refresh()
+    count, levels = _rollup()
+    assert count == count_before + 1
+    assert levels == levels_before + Counter({second_level: 1})
+
+
+def test_reflection_resubmitted_before_refresh_is_counted_once(client):
+    _refresh()
+    count_before, levels_before = _rollup()
+
+    _, body, step1_choice_id = _first_reflection(client)
+    # 旧记录还在水位之后（尚未汇总），覆盖时不扣除
+    second_level = _resubmit(client, body, step1_choice_id)
+    _refresh()
+    count, levels = _rollup()
+    assert count == count_before + 1
+    assert levels == levels_before + Counter({second_level: 1})
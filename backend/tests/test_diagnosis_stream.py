@@ -0,0 +1,178 @@
+"""
+GET /api/diagnosis/{id}/stream 与后台任务写回 LLM 解释
+
+同一条复盘记录只有认领成功的写入方会调用 Gemini；没认领到的流等待写回后回放，
+写回失败（记录期间被其他写入方更新）时流以数据库中保存的文本结束。
+"""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+import app.api.routes as routes
+from conftest import answer_question, reflection_body
+from app.core.database import SessionLocal
+from app.models.models import Question, ReflectionResponse
+
+
+@pytest.fixture
+def user_answer_id(client):
+    """一次答错并进入复盘的答题记录"""
+    db = SessionLocal()
+    try:
+        question = db.query(Question).order_by(Question.id).first()
+        option_id = next(option.id for option in question.options if not option.is_correct)
+    finally:
+        db.close()
+    return answer_question(client, question.id, option_id)
+
+
+def _reflect(client, user_answer_id, **params):
+    steps = client.get(f"/api/reflections/{user_answer_id}").json()
+    response = client.post("/api/reflections", params=params, json=reflection_body(user_answer_id, steps))
+    assert response.status_code == 200
+    return response.json()
+
+
+def _stream(client, user_answer_id):
+    """返回 [(event, data)]"""
+    response = client.get(f"/api/diagnosis/{user_answer_id}/stream")
+    assert response.status_code == 200
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _saved(user_answer_id):
+    db = SessionLocal()
+    try:
+        row = db.query(ReflectionResponse).filter(ReflectionResponse.user_answer_id == user_answer_id).one()
+        return row.llm_explanation, row.llm_suggestion, row.llm_status
+    finally:
+        db.close()
+
+
+def _set_row(user_answer_id, **values):
+    db = SessionLocal()
+    try:
+        db.query(ReflectionResponse).filter(
+            ReflectionResponse.user_answer_id == user_answer_id
+        ).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _text(events):
+    """按事件拼出客户端最终看到的文本（reset 清空已收到的增量）"""
+    text = {"explanation": "", "suggestion": ""}
+    for event, data in events:
+        if event == "reset":
+            text = {"explanation": "", "suggestion": ""}
+        elif event in text:
+            text[event] += data["delta"]
+    return text["explanation"], text["suggestion"]
+
+
+def _no_llm_calls(monkeypatch):
+    def fail(**kwargs):
+        raise AssertionError("不应再次调用 Gemini")
+    monkeypatch.setattr(routes, "stream_diagnosis_explanation", fail)
+    monkeypatch.setattr(routes, "generate_diagnosis_explanation_async", fail)
+
+
+def test_stream_generates_and_stores_when_post_skips_background_task(client, user_answer_id):
+    assert _reflect(client, user_answer_id, stream="true")["llm_status"] == "pending"
+    assert _saved(user_answer_id)[2] == "pending"
+
+    events = _stream(client, user_answer_id)
+    explanation, suggestion, status = _saved(user_answer_id)
+    assert status == "ready" and explanation
+    assert events[-1] == ("done", {
+        "llm_explanation": explanation, "llm_suggestion": suggestion, "llm_status": "ready"
+    })
+    assert _text(events) == (explanation, suggestion)
+
+
+def test_stream_replays_text_stored_by_background_task(client, user_answer_id, monkeypatch):
+    _reflect(client, user_answer_id, defer_llm="true")
+    explanation, suggestion, status = _saved(user_answer_id)
+    assert status == "ready"
+
+    _no_llm_calls(monkeypatch)
+    events = _stream(client, user_answer_id)
+    assert events[-1][1] == {"llm_explanation": explanation, "llm_suggestion": suggestion, "llm_status": "ready"}
+
+
+def test_background_task_skips_row_claimed_by_stream(client, user_answer_id, monkeypatch):
+    _reflect(client, user_answer_id, stream="true")
+    assert routes._claim_llm_explanation(user_answer_id)
+    _no_llm_calls(monkeypatch)
+
+    prepared = object()  # 认领失败时后台任务不会用到诊断上下文
+    asyncio.run(routes._complete_llm_explanation(user_answer_id, prepared))
+    assert _saved(user_answer_id)[2] == "generating"
+
+
+def test_stream_waits_for_writer_that_claimed_the_row(client, user_answer_id, monkeypatch):
+    _reflect(client, user_answer_id, stream="true")
+    assert routes._claim_llm_explanation(user_answer_id)
+    _no_llm_calls(monkeypatch)
+    monkeypatch.setattr(routes, "STREAM_POLL_SECONDS", 0.05)
+
+    writer = threading.Timer(0.3, _set_row, args=(user_answer_id,), kwargs={
+        "llm_explanation": "其他写入方的解释", "llm_suggestion": "其他写入方的建议", "llm_status": "ready"
+    })
+    writer.start()
+    events = _stream(client, user_answer_id)
+    writer.join()
+
+    assert events[-1] == ("done", {
+        "llm_explanation": "其他写入方的解释", "llm_suggestion": "其他写入方的建议", "llm_status": "ready"
+    })
+    assert _text(events) == ("其他写入方的解释", "其他写入方的建议")
+
+
+def test_stream_that_loses_the_race_sends_stored_text(client, user_answer_id, monkeypatch):
+    _reflect(client, user_answer_id, stream="true")
+
+    async def racing_stream(**kwargs):
+        yield ("explanation", "流式生成的解释")
+        # 生成期间另一个写入方（如 regenerate_explanations.py）已经写回
+        _set_row(user_answer_id, llm_explanation="已保存的解释", llm_suggestion="已保存的建议", llm_status="ready")
+        yield ("suggestion", "流式生成的建议")
+
+    monkeypatch.setattr(routes, "stream_diagnosis_explanation", racing_stream)
+    events = _stream(client, user_answer_id)
+
+    assert ("reset", {}) in events
+    assert _text(events) == ("已保存的解释", "已保存的建议")
+    assert events[-1][1]["llm_explanation"] == "已保存的解释"
+    assert _saved(user_answer_id) == ("已保存的解释", "已保存的建议", "ready")
+
+
+def test_stream_persists_regenerated_text_for_ready_row_without_explanation(client, user_answer_id):
+    _reflect(client, user_answer_id)
+    _set_row(user_answer_id, llm_explanation="", llm_suggestion="")
+
+    events = _stream(client, user_answer_id)
+    explanation, suggestion, status = _saved(user_answer_id)
+    assert status == "ready" and explanation
+    assert _text(events) == (explanation, suggestion)
+
+
+def test_failed_generation_releases_the_claim(client, user_answer_id, monkeypatch):
+    _reflect(client, user_answer_id, stream="true")
+
+    async def broken_stream(**kwargs):
+        yield ("explanation", "半截")
+        raise RuntimeError("连接中断")
+
+    monkeypatch.setattr(routes, "stream_diagnosis_explanation", broken_stream)
+    with pytest.raises(RuntimeError):
+        _stream(client, user_answer_id)
+    assert _saved(user_answer_id)[2] == "pending"
@@ -0,0 +1,48 @@
+"""
+LLM 解释缓存：持久层故障按未命中处理，不让复盘请求失败
+"""
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import app.services.explanation_cache as explanation_cache_module
+from app.core.database import SessionLocal
+from app.services.explanation_cache import ExplanationCache
+
+
+@pytest.fixture
+def cache(seeded_db):
+    return ExplanationCache(ttl=0, max_rows=1000, memory_size=16, memory_ttl=60)
+
+
+def _failing(method):
+    def fail(*args, **kwargs):
+        raise OperationalError("SELECT 1", {}, Exception(f"{method} failed"))
+    return fail
+
+
+def _sessions_with(monkeypatch, method):
+    """让缓存使用的 session 的 method 抛出数据库错误"""
+    def session_factory():
+        db = SessionLocal()
+        setattr(db, method, _failing(method))
+        return db
+    monkeypatch.setattr(explanation_cache_module, "SessionLocal", session_factory)
+
+
+def test_db_read_failure_is_a_miss(cache, monkeypatch):
+    cache.put("read-failure", "解释", "建议")
+    cache.memory.invalidate()
+
+    _sessions_with(monkeypatch, "query")
+    assert cache.get("read-failure") is None
+    assert (cache.misses, cache.errors) == (1, 1)
+
+
+def test_hit_count_write_failure_still_returns_the_hit(cache, monkeypatch):
+    cache.put("write-failure", "解释", "建议")
+    cache.memory.invalidate()
+
+    _sessions_with(monkeypatch, "commit")
+    assert cache.get("write-failure") == ("解释", "建议")
+    assert (cache.db_hits, cache.errors) == (1, 1)
@@ -0,0 +1,115 @@
+"""
+LLMGuard 的半开探测名额与 Gemini 调用结果的熔断统计
+
+排队等待期间被取消或超时的探测要归还名额，否则熔断器会一直停在半开状态；
+无法解析或内容为空的响应计为失败。
+"""
+
+import asyncio
+
+import pytest
+
+import app.services.gemini_service as gemini_service
+from app.services.fake_gemini import FakeGeminiClient, FakeGeminiConfig
+from app.services.llm_guard import CircuitBreaker, LLMGuard, LLMUnavailable
+
+
+def _half_open_guard(queue_timeout: float) -> LLMGuard:
+    """熔断器已半开、令牌桶已空（下一个调用拿到探测名额后要排队等令牌）"""
+    guard = LLMGuard(
+        max_concurrency=4, rate_per_minute=0.6, burst=1, timeout=1.0,
+        queue_timeout=queue_timeout, failure_threshold=1, reset_timeout=0.0
+    )
+    guard.acquire()
+    guard.release(False)
+    assert guard.breaker.status()["state"] == CircuitBreaker.OPEN
+    return guard
+
+
+def test_cancelled_probe_returns_the_probe_slot():
+    guard = _half_open_guard(queue_timeout=30.0)
+
+    async def cancel_while_queued():
+        task = asyncio.create_task(guard.acquire_async())
+        await asyncio.sleep(0.05)
+        assert guard.breaker.status()["state"] == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_while_queued())
+    assert guard.breaker.allow() == (True, True)
+    assert guard.status()["active_calls"] == 0
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_probe_rejected_after_queue_timeout_returns_the_probe_slot(use_async):
+    guard = _half_open_guard(queue_timeout=0.01)
+    with pytest.raises(LLMUnavailable, match="rate_limited"):
+        if use_async:
+            asyncio.run(guard.acquire_async())
+        else:
+            guard.acquire()
+    assert guard.breaker.allow() == (True, True)
+
+
+def test_queued_call_keeps_another_callers_probe():
+    guard = LLMGuard(
+        max_concurrency=1, rate_per_minute=600, burst=20, timeout=1.0,
+        queue_timeout=0.2, failure_threshold=1, reset_timeout=0.0
+    )
+    guard.acquire()  # 占满并发名额
+
+    async def queue_then_time_out():
+        # 熔断器关闭时进入排队；排队期间熔断器打开，另一个调用拿到探测名额
+        task = asyncio.create_task(guard.acquire_async())
+        await asyncio.sleep(0.05)
+        guard.breaker.record_failure()
+        assert guard.breaker.allow() == (True, True)
+        with pytest.raises(LLMUnavailable, match="concurrency"):
+            await task
+
+    asyncio.run(queue_then_time_out())
+    assert guard.breaker.allow() == (False, False)
+
+
+@pytest.fixture
+def malformed_gemini(monkeypatch):
+    """每次都返回无法解析的响应的 Fake Gemini，以及一个全新的 LLMGuard"""
+    client = FakeGeminiClient(FakeGeminiConfig(latency_ms=0, jitter_ms=0, malformed_rate=1.0))
+    guard = LLMGuard(
+        max_concurrency=4, rate_per_minute=600, burst=20, timeout=1.0,
+        queue_timeout=0.1, failure_threshold=2, reset_timeout=60.0
+    )
+    monkeypatch.setattr(gemini_service, "client", client)
+    monkeypatch.setattr(gemini_service, "llm_guard", guard)
+    return guard
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_malformed_response_counts_as_failure(malformed_gemini, use_async):
+    for _ in range(2):
+        if use_async:
+            result = asyncio.run(gemini_service._request_explanation_async("prompt"))
+        else:
+            result = gemini_service._request_explanation("prompt")
+        assert result is None
+
+    status = malformed_gemini.status()
+    assert (status["succeeded"], status["failed"]) == (0, 2)
+    assert status["circuit"]["state"] == CircuitBreaker.OPEN
+
+
+def test_malformed_stream_counts_as_failure(malformed_gemini):
+    async def consume():
+        return [
+            delta async for delta in gemini_service.stream_diagnosis_explanation(
+                error_level="level_1", error_type="test", rule_details={},
+                question_data={}, user_responses={}
+            )
+        ]
+
+    deltas = asyncio.run(consume())
+    assert deltas[0][0] == "explanation"  # 回退内容
+    status = malformed_gemini.status()
+    assert (status["succeeded"], status["failed"]) == (0, 1)
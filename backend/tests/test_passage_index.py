@@ -0,0 +1,68 @@
+"""
+文章句子索引：句子切分与 choice 文本到句子的匹配（纯函数，不访问数据库）
+"""
+
+import pytest
+
+from app.services.passage_index import match_sentence, normalize_tokens, split_sentences
+
+CONTENT = (
+    "Dr. Smith studied trees. They grow slowly!\n"
+    "In 1990 the U.S. Congress met, e.g. Senate members agreed. Was it J. Watt? Yes.\n"
+    "\n"
+    "  Final paragraph here.  "
+)
+
+GLACIERS = "Glaciers carved deep valleys across northern Europe. Rivers later filled them."
+
+
+def test_split_sentences_paragraphs_and_abbreviations():
+    spans = split_sentences(CONTENT)
+    assert [CONTENT[span.start_offset:span.end_offset] for span in spans] == [
+        "Dr. Smith studied trees.",
+        "They grow slowly!",
+        "In 1990 the U.S. Congress met, e.g. Senate members agreed.",
+        "Was it J. Watt?",
+        "Yes.",
+        "Final paragraph here.",
+    ]
+    assert [span.sentence_index for span in spans] == list(range(6))
+    assert [span.paragraph_index for span in spans] == [0, 0, 1, 1, 1, 2]
+    assert spans[0].tokens == normalize_tokens("Dr. Smith studied trees.")
+
+
+def test_split_sentences_empty_content():
+    assert split_sentences("") == []
+    assert split_sentences(None) == []
+
+
+def test_normalize_tokens():
+    assert normalize_tokens("The studies of Darwin's trees and stresses") == {
+        "study", "darwin", "tree", "stress"
+    }
+
+
+@pytest.mark.parametrize("text, expected", [
+    # choice 的 5 个词中 3 个出现在句子中：恰好达到阈值 0.6
+    ("Glaciers carved valleys rapidly yesterday", 0),
+    # 2 / 5 低于阈值
+    ("Glaciers carved slowly rapidly yesterday", None),
+    # 删节后的原句
+    ("Rivers filled them.", 1),
+    ("Volcanoes erupt violently.", None),
+    ("", None),
+    ("the of and", None),
+])
+def test_match_sentence_threshold(text, expected):
+    span = match_sentence(text, split_sentences(GLACIERS))
+    assert (span.sentence_index if span else None) == expected
+
+
+def test_match_sentence_prefers_higher_sentence_coverage():
+    spans = split_sentences("Trees grow. Trees grow tall in dense northern forests.")
+    assert match_sentence("Trees grow.", spans).sentence_index == 0
+
+
+def test_match_sentence_duplicate_sentences_returns_first():
+    spans = split_sentences("Rivers flood in spring. Farmers wait. Rivers flood in spring.")
+    assert match_sentence("Rivers flood in spring.", spans).sentence_index == 0
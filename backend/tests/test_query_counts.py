@@ -0,0 +1,109 @@
+"""
+答题 / 复盘热路径的 SQL 语句数
+
+复盘步骤用 eager loading 一次加载题目、选项、步骤和 choices，语句数不随步骤数和
+choice 数增长；提交答案只写一行；提交复盘的语句数有固定上界。
+"""
+
+import copy
+
+import pytest
+
+from conftest import answer_question, count_queries, reflection_body
+from app.core.database import SessionLocal
+from app.models.models import Question, ReflectionStep
+from app.services.cache import invalidate_content_caches, reflection_steps_cache
+from app.services.content_import import import_passages, validate_corpus
+from seed_questions import PASSAGES
+
+# GET /api/reflections/{id} 缓存未命中：答题记录 / 题目 / 题目选项 / 复盘步骤 / 复盘 choices
+REFLECTION_STEPS_QUERIES = 5
+# 缓存命中：只查答题记录
+REFLECTION_STEPS_CACHED_QUERIES = 1
+# POST /api/reflections（LLM 路径，首次创建错误画像时最多）：
+#   答题记录 / 已有复盘 / 所选 choices / 题目 / 文章 / 所选选项 / 正确选项 / 答案句 /
+#   预生成解释 / 正确 choices / 解释缓存 2 次读 + 1 次写 / 错误画像读 /
+#   复盘写入 / 画像创建（savepoint + insert + release）/ 画像更新
+SUBMIT_REFLECTION_MAX_QUERIES = 19
+
+
+def _wrong_option_ids():
+    """每道题的一个错误选项：[(question_id, option_id)]"""
+    db = SessionLocal()
+    try:
+        questions = db.query(Question).order_by(Question.id).all()
+        return [
+            (question.id, next(option.id for option in question.options if not option.is_correct))
+            for question in questions
+        ]
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def large_question(seeded_db):
+    """导入一道每步有 12 个 choice 的题目，返回 (question_id, 错误选项 id)"""
+    passage = copy.deepcopy(PASSAGES[0])
+    passage["title"] = "Query Count Fixture: " + passage["title"]
+    question = passage["questions"][0]
+    passage["questions"] = [question]
+    for step in range(1, 7):
+        choices = question[f"step{step}_choices"]
+        question[f"step{step}_choices"] = choices + [
+            (f"extra choice {order}", False, order) for order in range(len(choices) + 1, 13)
+        ]
+
+    db = SessionLocal()
+    try:
+        import_passages(db, validate_corpus([passage]))
+        question_id = db.query(Question.id).filter(Question.stem == question["stem"]).order_by(
+            Question.id.desc()
+        ).first().id
+        assert all(
+            len(step.choices) == 12
+            for step in db.query(ReflectionStep).filter(ReflectionStep.question_id == question_id)
+        )
+    finally:
+        db.close()
+    invalidate_content_caches()
+    return next(pair for pair in _wrong_option_ids() if pair[0] == question_id)
+
+
+def test_submit_answer_is_a_single_insert(client):
+    question_id, option_id = _wrong_option_ids()[0]
+    with count_queries() as queries:
+        answer_question(client, question_id, option_id)
+    assert queries.count == 1, queries.statements
+
+
+def test_reflection_steps_query_count_is_fixed(client, large_question):
+    for question_id, option_id in _wrong_option_ids():
+        user_answer_id = answer_question(client, question_id, option_id)
+
+        reflection_steps_cache.invalidate()
+        with count_queries() as queries:
+            response = client.get(f"/api/reflections/{user_answer_id}")
+        assert response.status_code == 200
+        assert queries.count == REFLECTION_STEPS_QUERIES, (question_id, queries.statements)
+
+        with count_queries() as queries:
+            client.get(f"/api/reflections/{user_answer_id}")
+        assert queries.count == REFLECTION_STEPS_CACHED_QUERIES, queries.statements
+
+    # 步骤按 step_number 排序，choices 按 choice_order 排序
+    user_answer_id = answer_question(client, *large_question)
+    steps = client.get(f"/api/reflections/{user_answer_id}").json()["steps"]
+    assert [step["step_number"] for step in steps] == list(range(1, len(steps) + 1))
+    assert all(len(step["choices"]) == 12 for step in steps)
+    assert [choice["choice_order"] for choice in steps[0]["choices"]] == list(range(1, 13))
+
+
+def test_submit_reflection_query_count_is_bounded(client, large_question):
+    for question_id, option_id in _wrong_option_ids():
+        user_answer_id = answer_question(client, question_id, option_id)
+        steps = client.get(f"/api/reflections/{user_answer_id}").json()
+
+        with count_queries() as queries:
+            response = client.post("/api/reflections", json=reflection_body(user_answer_id, steps))
+        assert response.status_code == 200
+        assert queries.count <= SUBMIT_REFLECTION_MAX_QUERIES, (question_id, queries.statements)
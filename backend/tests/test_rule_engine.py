@@ -0,0 +1,123 @@
+"""
+规则引擎：直接构造 ChoiceSnapshot / SentenceSnapshot，不访问数据库
+"""
+
+from types import MappingProxyType
+
+import pytest
+
+from app.services.rule_engine import ChoiceSnapshot, ErrorDiagnoser, SentenceSnapshot, evaluate_steps
+
+KEYWORD = "photosynthesis"
+STUDENT_SENTENCE = "Photosynthesis converts light into chemical energy."
+
+
+def _sentence(sentence_id, sentence_index, paragraph_index):
+    return SentenceSnapshot(id=sentence_id, sentence_index=sentence_index, paragraph_index=paragraph_index)
+
+
+def _choice(choice_id, text, is_correct=False, choice_order=1, sentence=None):
+    return ChoiceSnapshot(
+        id=choice_id, reflection_step_id=choice_id * 10, choice_text=text,
+        is_correct=is_correct, choice_order=choice_order, sentence=sentence
+    )
+
+
+def _diagnose(
+    step1=True, step2=True, step3_correct=True, step3_order=1, step4a_order=1, step4b=True,
+    step2_sentence=None, answer_sentence=None, keyword=KEYWORD, student_sentence=STUDENT_SENTENCE
+):
+    """按各步骤的选择构造快照，经 evaluate_steps 判断正误后执行诊断"""
+    choices = {
+        1: _choice(1, keyword, is_correct=step1),
+        2: _choice(2, student_sentence, is_correct=step2, sentence=step2_sentence),
+        3: _choice(3, "理解", is_correct=step3_correct, choice_order=step3_order),
+        4: _choice(4, "错误选项理解", choice_order=step4a_order),
+        5: _choice(5, "正确选项理解", is_correct=step4b),
+        6: _choice(6, "自我诊断"),
+    }
+    step1_is_correct, step2_is_correct, step3_quality = evaluate_steps(choices[1], choices[2], choices[3])
+    diagnoser = ErrorDiagnoser(
+        choices=MappingProxyType(choices),
+        step1_is_correct=step1_is_correct, step1_choice_id=1,
+        step2_is_correct=step2_is_correct, step2_choice_id=2,
+        step3_quality=step3_quality, step3_choice_id=3, step3_custom_input=None,
+        step4a_choice_id=4, step4b_choice_id=5, step5_choice_id=6,
+        answer_sentence=answer_sentence,
+    )
+    return diagnoser.diagnose()
+
+
+@pytest.mark.parametrize("steps, level, error_type", [
+    (dict(step1=False), "level_1", "定位词概念不清晰"),
+    (dict(step1=False, step2=False, step3_correct=False), "level_1", "定位词概念不清晰"),
+    (dict(step2=False), "level_2", "定位能力不足 - 误判定位范围"),
+    (dict(step3_correct=False, step3_order=2), "level_3", "答案句理解偏差"),
+    (dict(step3_correct=False, step3_order=4), "level_3", "答案句理解存在困难"),
+    (dict(step4a_order=3), "level_4", "误判错误选项吸引力"),
+    (dict(step4a_order=3, step4b=False), "level_4", "误判错误选项吸引力"),
+    (dict(step4a_order=2, step4b=False), "level_4", "正确选项理解不足"),
+    (dict(step4a_order=2), "level_5", "完整理解但判断失误"),
+    (dict(), "level_5", "完整理解但判断失误"),
+])
+def test_diagnosis_level(steps, level, error_type):
+    result = _diagnose(**steps)
+    assert (result.error_level, result.error_type) == (level, error_type)
+
+
+@pytest.mark.parametrize("step3, expected", [
+    (None, (False, False, "wrong")),
+    (_choice(3, "正确理解", is_correct=True, choice_order=4), (False, False, "correct")),
+    (_choice(3, "以上都不对", choice_order=4), (False, False, "unknown")),
+    (_choice(3, "错误理解", choice_order=2), (False, False, "wrong")),
+])
+def test_evaluate_steps_step3_quality(step3, expected):
+    assert evaluate_steps(None, None, step3) == expected
+
+
+def test_missing_choices_diagnose_as_level_1():
+    diagnoser = ErrorDiagnoser(
+        choices=MappingProxyType({}),
+        step1_is_correct=False, step1_choice_id=None,
+        step2_is_correct=False, step2_choice_id=None,
+        step3_quality="wrong", step3_choice_id=None, step3_custom_input=None,
+        step4a_choice_id=None, step4b_choice_id=None, step5_choice_id=None,
+    )
+    result = diagnoser.diagnose()
+    assert result.error_level == "level_1"
+    assert result.details["student_keyword"] == "unknown"
+
+
+@pytest.mark.parametrize("located, answer, offset, same_paragraph", [
+    (_sentence(12, 4, 1), _sentence(10, 2, 1), 2, True),
+    (_sentence(8, 0, 0), _sentence(10, 2, 1), -2, False),
+])
+def test_level_2_reports_offset_from_answer_sentence(located, answer, offset, same_paragraph):
+    result = _diagnose(step2=False, step2_sentence=located, answer_sentence=answer)
+    assert result.error_level == "level_2"
+    assert result.details["sentence_offset"] == offset
+    assert result.details["same_paragraph"] is same_paragraph
+    assert result.details["answer_paragraph"] == answer.paragraph_index + 1
+
+
+def test_level_2_without_sentence_index_has_no_offset():
+    result = _diagnose(step2=False, answer_sentence=_sentence(10, 2, 1))
+    assert result.error_level == "level_2"
+    assert "sentence_offset" not in result.details
+
+
+@pytest.mark.parametrize("keyword, student_sentence, contains_keyword", [
+    (KEYWORD, STUDENT_SENTENCE, True),
+    ("LIGHT INTO", STUDENT_SENTENCE, True),
+    # 子串匹配：词形不同不算包含，词的一部分也算包含
+    ("plants", "Each plant converts light into energy.", False),
+    ("cell", "Cellular respiration releases energy.", True),
+    ("", STUDENT_SENTENCE, False),
+])
+def test_level_2_checks_keyword_as_substring(keyword, student_sentence, contains_keyword):
+    result = _diagnose(step2=False, keyword=keyword, student_sentence=student_sentence)
+    assert result.error_level == "level_2"
+    assert result.details["contains_keyword"] is contains_keyword
+    assert result.error_type == (
+        "定位能力不足 - 误判定位范围" if contains_keyword else "定位能力不足 - 未应用定位词"
+    )
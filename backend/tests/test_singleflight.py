@@ -0,0 +1,113 @@
+"""
+SingleFlight：相同 key 的并发调用共享一次执行的结果
+
+leader 的异常共享给 follower，leader 被取消时 follower 重新执行而不是跟着被取消。
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.singleflight import SingleFlight
+
+
+class _Calls:
+    """记录真正执行的次数；每次执行等待 delay 秒后返回 result"""
+
+    def __init__(self, result="ok", delay=0.1, error=None):
+        self.result = result
+        self.delay = delay
+        self.error = error
+        self.count = 0
+
+    async def run_async(self):
+        self.count += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def run(self):
+        self.count += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_async_callers_share_one_execution():
+    flight, calls = SingleFlight(), _Calls()
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("k", calls.run_async) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["ok"] * 5
+    assert calls.count == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+
+def test_sync_callers_share_one_execution():
+    flight, calls = SingleFlight(), _Calls()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("k", calls.run))) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["ok"] * 4
+    assert calls.count == 1
+
+
+def test_leader_exception_is_shared():
+    flight, calls = SingleFlight(), _Calls(error=ValueError("boom"))
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do_async("k", calls.run_async) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls.count == 1
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight, calls = SingleFlight(), _Calls()
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async("k", calls.run_async))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do_async("k", calls.run_async)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(main()) == ["ok", "ok"]
+    # 其中一个 follower 成为新的 leader 重新执行
+    assert calls.count == 2
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_follower_does_not_affect_the_leader():
+    flight, calls = SingleFlight(), _Calls()
+
+    async def main():
+        leader = asyncio.create_task(flight.do_async("k", calls.run_async))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do_async("k", calls.run_async))
+        other = asyncio.create_task(flight.do_async("k", calls.run_async))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader, await other
+
+    assert asyncio.run(main()) == ("ok", "ok")
+    assert calls.count == 1
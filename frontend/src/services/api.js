@@ -94,10 +94,11 @@ export const getReflectionSteps = (userAnswerId) => {
 /**
  * 提交复盘答案
  * @param {object} reflectionData - 复盘数据
+ * @param {object} params - 查询参数，如 { stream: true }：LLM 解释随后由 streamDiagnosis 生成
  * @returns {Promise} 诊断结果
  */
-export const submitReflection = (reflectionData) => {
-  return api.post('/reflections', reflectionData)
+export const submitReflection = (reflectionData, params = {}) => {
+  return api.post('/reflections', reflectionData, { params })
 }
 
 /**
@@ -109,4 +110,34 @@ export const getDiagnosis = (userAnswerId) => {
   return api.get(`/diagnosis/${userAnswerId}`)
 }
 
+/**
+ * 以 Server-Sent Events 流式获取诊断结果（与 submitReflection(data, { stream: true }) 配合使用）
+ * @param {number} userAnswerId - 答题记录 ID
+ * @param {object} handlers - 事件回调
+ * @param {function} handlers.onRule - 规则引擎诊断结果
+ * @param {function} handlers.onDelta - LLM 文本增量 (field: 'explanation' | 'suggestion', delta)
+ * @param {function} handlers.onReset - 丢弃已收到的增量（随后收到完整文本）
+ * @param {function} handlers.onDone - 完整的 llm_explanation / llm_suggestion 和 llm_status（"ready" 表示已保存）
+ * @param {function} handlers.onError - 连接错误
+ * @returns {EventSource} 调用 close() 可提前结束
+ */
+export const streamDiagnosis = (userAnswerId, handlers = {}) => {
+  const source = new EventSource(`/api/diagnosis/${userAnswerId}/stream`)
+  const parse = (event) => JSON.parse(event.data)
+
+  source.addEventListener('rule', (e) => handlers.onRule?.(parse(e)))
+  source.addEventListener('explanation', (e) => handlers.onDelta?.('explanation', parse(e).delta))
+  source.addEventListener('suggestion', (e) => handlers.onDelta?.('suggestion', parse(e).delta))
+  source.addEventListener('reset', () => handlers.onReset?.())
+  source.addEventListener('done', (e) => {
+    handlers.onDone?.(parse(e))
+    source.close()
+  })
+  source.onerror = (error) => {
+    handlers.onError?.(error)
+    source.close()
+  }
+  return source
+}
+
 export default api
\ No newline at end of file